@@ -0,0 +1,141 @@
+# app/bot/Album_Utils.py
+"""
+Álbumes de Telegram (varias fotos enviadas juntas, mismo media_group_id).
+
+Telegram entrega cada foto del álbum como un update distinto, casi a la vez.
+AlbumCollector las agrupa: cada foto reinicia una espera corta
+(ALBUM_WAIT_SECONDS) y, cuando deja de llegar ninguna (o hay 10, el máximo
+de Telegram), se procesa el álbum entero de una vez:
+
+1. descargas en paralelo a memoria (services/uploads.py),
+2. OCR en paralelo en un pool de hilos (ALBUM_OCR_WORKERS, por defecto
+   OCR_POOL_SIZE: un hilo por motor Tesseract),
+3. extracción por lotes (extract_expense_json_batch_async),
+
+y el bot crea los gastos y contesta con un único resumen.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable
+
+try:
+    from .Ocr_untils import OCR_POOL_SIZE, extract_text_and_words_from_image
+    from .Llm_Untils import extract_expense_json_batch_async
+    from ..services.uploads import spool_telegram_file
+except ImportError:
+    from Ocr_untils import OCR_POOL_SIZE, extract_text_and_words_from_image
+    from Llm_Untils import extract_expense_json_batch_async
+    from app.services.uploads import spool_telegram_file  # Llm_Untils ya añadió la raíz al path
+
+ALBUM_WAIT_SECONDS = float(os.getenv("ALBUM_WAIT_SECONDS", "1.5"))
+ALBUM_MAX_ITEMS = 10  # máximo de Telegram por álbum
+ALBUM_OCR_WORKERS = int(os.getenv("ALBUM_OCR_WORKERS", str(OCR_POOL_SIZE)))
+
+_ocr_executor = ThreadPoolExecutor(max_workers=max(1, ALBUM_OCR_WORKERS), thread_name_prefix="album-ocr")
+
+
+class AlbumCollector:
+    """Agrupa mensajes por media_group_id y llama a on_album(mensajes, contexto) una vez por álbum"""
+
+    def __init__(self, on_album: Callable[[list, Any], Awaitable[None]],
+                 wait_seconds: float = ALBUM_WAIT_SECONDS, max_items: int = ALBUM_MAX_ITEMS):
+        self.on_album = on_album
+        self.wait_seconds = wait_seconds
+        self.max_items = max_items
+        self._albums: dict[str, dict] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def add(self, media_group_id: str, message, context: Any = None) -> bool:
+        """Añade una foto; True si es la primera del álbum (para avisar una sola vez)"""
+        album = self._albums.get(media_group_id)
+        first = album is None
+        if first:
+            # El contexto (apartamento, cuenta...) se fija con la primera foto
+            album = self._albums[media_group_id] = {"messages": [], "context": context, "task": None}
+        album["messages"].append(message)
+        if album["task"]:
+            album["task"].cancel()
+        delay = 0 if len(album["messages"]) >= self.max_items else self.wait_seconds
+        task = asyncio.get_running_loop().create_task(self._flush_later(media_group_id, delay))
+        album["task"] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return first
+
+    async def _flush_later(self, media_group_id: str, delay: float):
+        await asyncio.sleep(delay)
+        album = self._albums.pop(media_group_id, None)
+        if not album:
+            return
+        messages = sorted(album["messages"], key=lambda m: m.message_id)
+        try:
+            await self.on_album(messages, album["context"])
+        except Exception as e:
+            print(f"[ALBUM] ❌ Error procesando álbum {media_group_id} ({len(messages)} fotos): {e}")
+            # El usuario ya vio "Recibiendo álbum": siempre hay respuesta
+            try:
+                await messages[0].reply_text(
+                    f"❌ No pude procesar el álbum ({len(messages)} fotos).\n\n"
+                    f"💡 Reenvía las fotos por separado o introdúcelas manualmente."
+                )
+            except Exception as reply_error:
+                print(f"[ALBUM] ❌ No se pudo avisar del error: {reply_error}")
+
+
+async def _download(message):
+    photo = message.photo[-1]  # Mejor calidad
+    return await spool_telegram_file(await photo.get_file())
+
+
+async def _ocr(upload):
+    loop = asyncio.get_running_loop()
+    with upload:
+        return await loop.run_in_executor(_ocr_executor, extract_text_and_words_from_image, upload)
+
+
+async def extract_album_expenses(messages: list, apartment_code: str, account_id: str | None = None) -> list[dict]:
+    """
+    Un resultado por foto, en orden: {"message_id", "expense" (dict o None),
+    "error" (texto o None)}
+    """
+    downloads = await asyncio.gather(*(_download(m) for m in messages), return_exceptions=True)
+
+    async def ocr_or_empty(upload):
+        if isinstance(upload, BaseException):
+            return "", []
+        return await _ocr(upload)
+
+    ocr = await asyncio.gather(*(ocr_or_empty(u) for u in downloads))
+    expenses = await extract_expense_json_batch_async(ocr, apartment_code, account_id=account_id)
+
+    results = []
+    for message, upload, (text, _), expense in zip(messages, downloads, ocr, expenses):
+        error = None
+        if isinstance(upload, BaseException):
+            error = f"descarga fallida ({upload})"
+        elif not text.strip():
+            error = "sin texto legible"
+        elif expense.get("error"):
+            error = expense["error"]
+        elif not expense.get("amount_gross"):
+            error = "sin importe"
+        results.append({"message_id": message.message_id, "expense": None if error else expense, "error": error})
+    return results
+
+
+def format_album_summary(results: list[dict], apartment_code: str) -> str:
+    """Resumen único del álbum; cada resultado puede traer "created" y "error" tras guardar"""
+    created = sum(1 for r in results if r.get("created"))
+    lines = [f"📚 **Álbum para {apartment_code}: {created}/{len(results)} gastos registrados**", ""]
+    for n, r in enumerate(results, start=1):
+        expense = r.get("expense") or {}
+        if r.get("created"):
+            lines.append(f"✅ {n}. €{expense.get('amount_gross', 0)} · {expense.get('vendor') or 'Sin proveedor'} · {expense.get('date', 'N/A')}")
+        else:
+            lines.append(f"❌ {n}. {r.get('error') or 'no registrado'}")
+    if created < len(results):
+        lines += ["", "💡 Reenvía por separado las que fallaron o introdúcelas manualmente."]
+    return "\n".join(lines)
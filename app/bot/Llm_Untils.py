@@ -1,6 +1,6 @@
-# Llm_Untils.py — versión solo SDK v1
+# Llm_Untils.py — versión solo SDK v1 (vía app/services/llm.py)
 from __future__ import annotations
-import os, json, re
+import asyncio, os, json, re, time
 from typing import List, Dict
 from dotenv import load_dotenv
 
@@ -8,15 +8,36 @@ from dotenv import load_dotenv
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 load_dotenv(dotenv_path=os.path.join(BASE_DIR, ".env"))
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise RuntimeError("OPENAI_API_KEY no configurada en .env")
-
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
-# SDK v1
-from openai import OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Todas las llamadas pasan por la pasarela común (concurrencia, límites de
+# OpenAI y presupuesto por cuenta); el proveedor se elige con LLM_PROVIDER.
+# La clave de OpenAI solo se exige al hacer la primera llamada real.
+try:
+    from ..metrics import metrics_registry
+    from ..services.llm_gateway import LLMBudgetExceeded, estimate_tokens, llm_gateway
+    from .Receipt_Rules import condense_text, extract_receipt_fields, guess_category
+except ImportError:
+    # Ejecutado como script suelto desde app/bot
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(BASE_DIR)))
+    from app.metrics import metrics_registry
+    from app.services.llm_gateway import LLMBudgetExceeded, estimate_tokens, llm_gateway
+    from Receipt_Rules import condense_text, extract_receipt_fields, guess_category
+
+# Vía rápida por reglas (Receipt_Rules): si resuelve los campos obligatorios
+# con confianza suficiente no se llama al LLM; si no, el LLM solo completa el resto.
+RECEIPT_RULES = os.getenv("RECEIPT_RULES", "1") == "1"
+RECEIPT_RULES_MIN_CONFIDENCE = float(os.getenv("RECEIPT_RULES_MIN_CONFIDENCE", "0.8"))
+RECEIPT_RULES_REQUIRED = [f.strip() for f in os.getenv("RECEIPT_RULES_REQUIRED", "amount_gross,date,vendor").split(",") if f.strip()]
+
+# Tokens máximos del texto OCR dentro del prompt: se quedan las líneas de
+# totales, fechas, proveedor e IVA; ruido y pies legales fuera (0 = texto completo)
+LLM_OCR_MAX_TOKENS = int(os.getenv("LLM_OCR_MAX_TOKENS", "400"))
+LLM_LOG_CALLS = os.getenv("LLM_LOG_CALLS", "1") == "1"
+
+# Álbumes: hasta LLM_BATCH_MAX recibos que necesitan LLM van en un solo prompt
+LLM_BATCH_MAX = int(os.getenv("LLM_BATCH_MAX", "5"))
 
 def _safe_json_loads(s: str) -> dict:
     s = (s or "").strip()
@@ -33,47 +54,94 @@ def _safe_json_loads(s: str) -> dict:
                 pass
     return {}
 
-def extract_expense_json(raw_text: str, apartment_code: str) -> dict:
+def _expense_messages(raw_text: str, apartment_code: str, known: Dict | None = None) -> List[Dict]:
     system = (
         "Eres un extractor estricto. Devuelve EXCLUSIVAMENTE un JSON válido, sin texto adicional. "
         "Normaliza: 'date' en YYYY-MM-DD, 'currency' en mayúsculas (EUR por defecto si no está claro), "
         "'amount_gross' como número con punto decimal. Si falta un dato, omítelo."
     )
 
-    user = f"""
-Texto OCR de una factura/gasto:
-
+    # apartment_code, source y status los completa _expense_from_content
+    user = f"""Texto OCR de una factura/gasto del apartamento {apartment_code}:
 <<<
 {raw_text}
 >>>
-
-El gasto pertenece al apartamento con código: {apartment_code}.
-
 Devuelve un JSON con esta forma (solo claves con datos):
-{{
-  "apartment_code": "{apartment_code}",
-  "date": "YYYY-MM-DD",
-  "amount_gross": 123.45,
-  "currency": "EUR",
-  "category": "mantenimiento",
-  "description": "texto breve",
-  "vendor": "proveedor",
-  "invoice_number": "ABC123",
-  "source": "telegram_bot",
-  "vat_rate": 21,
-  "file_url": null,
-  "status": "PENDING"
-}}
+{{"date": "YYYY-MM-DD", "amount_gross": 123.45, "currency": "EUR", "category": "mantenimiento", "description": "texto breve", "vendor": "proveedor", "invoice_number": "ABC123", "vat_rate": 21}}
+"""
+
+    if known:
+        user += f"""
+Estos datos ya están verificados, no los cambies: {json.dumps(known, ensure_ascii=False)}
+Completa solo el resto de claves.
 """
 
-    resp = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=[{"role": "system", "content": system},
-                  {"role": "user", "content": user}],
-        temperature=0,
+    return [{"role": "system", "content": system},
+            {"role": "user", "content": user}]
+
+def _batch_messages(texts: List[str], apartment_code: str, knowns: List[Dict]) -> List[Dict]:
+    system = (
+        "Eres un extractor estricto. Devuelve EXCLUSIVAMENTE un JSON válido, sin texto adicional. "
+        "Normaliza: 'date' en YYYY-MM-DD, 'currency' en mayúsculas (EUR por defecto si no está claro), "
+        "'amount_gross' como número con punto decimal. Si falta un dato, omítelo."
     )
-    content = resp.choices[0].message.content or ""
+
+    user = f"{len(texts)} facturas/gastos del apartamento {apartment_code}, cada una por separado:\n"
+    for n, (text, known) in enumerate(zip(texts, knowns), start=1):
+        user += f"\nFactura {n}:\n<<<\n{text}\n>>>\n"
+        if known:
+            user += f"Datos verificados de la factura {n}, no los cambies: {json.dumps(known, ensure_ascii=False)}\n"
+    user += f"""
+Devuelve {{"items": [...]}} con {len(texts)} objetos en el mismo orden, cada uno con esta forma (solo claves con datos):
+{{"date": "YYYY-MM-DD", "amount_gross": 123.45, "currency": "EUR", "category": "mantenimiento", "description": "texto breve", "vendor": "proveedor", "invoice_number": "ABC123", "vat_rate": 21}}
+"""
+
+    return [{"role": "system", "content": system},
+            {"role": "user", "content": user}]
+
+def _condensed_ocr(raw_text: str, words: List[Dict] | None) -> str:
+    if LLM_OCR_MAX_TOKENS <= 0:
+        return raw_text
+    condensed = condense_text(raw_text, LLM_OCR_MAX_TOKENS, words) or raw_text
+    metrics_registry.record_ocr_condensation(estimate_tokens(raw_text), estimate_tokens(condensed))
+    return condensed
+
+def _log_call(raw_text: str, messages: List[Dict], started: float):
+    if not LLM_LOG_CALLS:
+        return
+    ocr = messages[-1]["content"].split("<<<", 1)[-1].split(">>>", 1)[0].strip()
+    prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+    print(f"[LLM] 🧾 OCR {estimate_tokens(raw_text)}→{estimate_tokens(ocr)} tokens, "
+          f"prompt {prompt_tokens} tokens, {(time.perf_counter() - started) * 1000:.0f} ms")
+
+def _rules_known(raw_text: str, words: List[Dict] | None) -> Dict:
+    """Campos resueltos por reglas con confianza >= RECEIPT_RULES_MIN_CONFIDENCE"""
+    if not RECEIPT_RULES:
+        return {}
+    fields = extract_receipt_fields(raw_text, words)
+    return {name: g.value for name, g in fields.items() if g.confidence >= RECEIPT_RULES_MIN_CONFIDENCE}
+
+def _needs_llm(known: Dict) -> bool:
+    return any(field not in known for field in RECEIPT_RULES_REQUIRED)
+
+def _expense_from_rules(known: Dict, raw_text: str, apartment_code: str) -> dict:
+    data = dict(known)
+    category = guess_category(raw_text)
+    if category:
+        data["category"] = category
+    if data.get("vendor"):
+        data["description"] = data["vendor"] + (f" - {data['invoice_number']}" if data.get("invoice_number") else "")
+    data["extraction_method"] = "rules"
+    return _expense_from_content("", apartment_code, data)
+
+def _expense_from_content(content: str, apartment_code: str, known: Dict | None = None) -> dict:
     data = _safe_json_loads(content)
+    if known:
+        # Lo verificado por reglas prevalece sobre lo que diga el LLM
+        data.update(known)
+        data.setdefault("extraction_method", "rules+llm")
+    else:
+        data.setdefault("extraction_method", "llm")
 
     # Defaults/asegurados
     if apartment_code and not data.get("apartment_code"):
@@ -88,3 +156,89 @@ Devuelve un JSON con esta forma (solo claves con datos):
         data["date"] = date.today().isoformat()
     
     return data
+
+def extract_expense_json(raw_text: str, apartment_code: str, account_id: str | None = None,
+                         words: List[Dict] | None = None) -> dict:
+    """
+    Versión síncrona (bloquea el hilo que llama hasta tener respuesta).
+    `words`: cajas de palabras de Tesseract, si las hay, para las reglas.
+    """
+    known = _rules_known(raw_text, words)
+    if not _needs_llm(known):
+        return _expense_from_rules(known, raw_text, apartment_code)
+    messages = _expense_messages(_condensed_ocr(raw_text, words), apartment_code, known)
+    started = time.perf_counter()
+    content = llm_gateway.complete_sync(messages, model=OPENAI_MODEL, temperature=0, account_id=account_id)
+    _log_call(raw_text, messages, started)
+    return _expense_from_content(content, apartment_code, known)
+
+async def extract_expense_json_async(raw_text: str, apartment_code: str, account_id: str | None = None,
+                                     words: List[Dict] | None = None) -> dict:
+    """Para handlers async (FastAPI, bots): espera sin bloquear el event loop"""
+    known = _rules_known(raw_text, words)
+    if not _needs_llm(known):
+        return _expense_from_rules(known, raw_text, apartment_code)
+    messages = _expense_messages(_condensed_ocr(raw_text, words), apartment_code, known)
+    started = time.perf_counter()
+    content = await llm_gateway.complete(messages, model=OPENAI_MODEL, temperature=0, account_id=account_id)
+    _log_call(raw_text, messages, started)
+    return _expense_from_content(content, apartment_code, known)
+
+async def extract_expense_json_batch_async(items: List[tuple], apartment_code: str,
+                                           account_id: str | None = None) -> List[dict]:
+    """
+    Varios recibos a la vez (álbumes de Telegram): `items` es una lista de
+    (raw_text, words). Los que resuelven las reglas no pasan por el LLM; el
+    resto va en prompts de hasta LLM_BATCH_MAX recibos, en paralelo. Si una
+    respuesta no trae un objeto por recibo, esos recibos se piden uno a uno.
+    Devuelve un dict por recibo, en el mismo orden ({} si no había texto).
+    Un lote que falla (p. ej. LLMBudgetExceeded) no tumba los demás: sus
+    recibos llevan {"error": motivo}.
+    """
+    results: List[dict] = [{} for _ in items]
+    pending = []
+    for index, (raw_text, words) in enumerate(items):
+        if not (raw_text or "").strip():
+            continue
+        known = _rules_known(raw_text, words)
+        if _needs_llm(known):
+            pending.append((index, raw_text, words, known))
+        else:
+            results[index] = _expense_from_rules(known, raw_text, apartment_code)
+
+    async def single(index, raw_text, words, known):
+        results[index] = await extract_expense_json_async(raw_text, apartment_code, account_id=account_id, words=words)
+
+    async def batch(chunk):
+        if len(chunk) == 1:
+            return await single(*chunk[0])
+        messages = _batch_messages([_condensed_ocr(t, w) for _, t, w, _ in chunk], apartment_code, [k for *_, k in chunk])
+        started = time.perf_counter()
+        content = await llm_gateway.complete(messages, model=OPENAI_MODEL, temperature=0, account_id=account_id)
+        if LLM_LOG_CALLS:
+            prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+            print(f"[LLM] 🧾 Lote de {len(chunk)} recibos, prompt {prompt_tokens} tokens, "
+                  f"{(time.perf_counter() - started) * 1000:.0f} ms")
+        parsed = _safe_json_loads(content)
+        if isinstance(parsed, dict):
+            parsed = parsed.get("items")
+        if not isinstance(parsed, list) or len(parsed) != len(chunk) or not all(isinstance(p, dict) for p in parsed):
+            print(f"[LLM] ⚠️ Respuesta de lote no válida, {len(chunk)} recibos uno a uno")
+            await asyncio.gather(*(isolated([item]) for item in chunk))
+            return
+        for (index, _, _, known), data in zip(chunk, parsed):
+            results[index] = _expense_from_content(json.dumps(data, ensure_ascii=False), apartment_code, known)
+
+    async def isolated(chunk):
+        try:
+            await batch(chunk)
+        except Exception as e:
+            print(f"[LLM] ❌ Lote de {len(chunk)} recibos fallido: {e}")
+            reason = "presupuesto diario de IA agotado" if isinstance(e, LLMBudgetExceeded) else f"error de IA ({e.__class__.__name__})"
+            for index, *_ in chunk:
+                if not results[index]:
+                    results[index] = {"error": reason}
+
+    size = max(1, LLM_BATCH_MAX)
+    await asyncio.gather(*(isolated(pending[i:i + size]) for i in range(0, len(pending), size)))
+    return results
@@ -263,6 +263,41 @@ def send_expense_to_account(telegram_id: int, expense_data: Dict[str, Any]) -> T
     except Exception as e:
         return False, f"Error enviando gasto: {str(e)}"
 
+def send_expenses_bulk_to_account(telegram_id: int, expenses: List[Dict[str, Any]]) -> Tuple[bool, Any]:
+    """
+    Enviar varios gastos (álbum) en una sola petición a /api/v1/expenses/bulk.
+    Cada gasto puede llevar apartment_code; devuelve (True, {received, inserted,
+    ids, errors por índice}) o (False, mensaje de error).
+    """
+    user_data = USER_CACHE.get(telegram_id)
+    if not user_data:
+        return False, "Usuario no autenticado. Usa /login primero"
+    
+    current_account_id = user_data.get("current_account_id")
+    if not current_account_id:
+        return False, "No tienes una cuenta seleccionada"
+    
+    try:
+        response = requests.post(
+            f"{API_BASE_URL.rstrip('/')}/api/v1/expenses/bulk",
+            json={"items": expenses},
+            headers={
+                "Authorization": f"Bearer {user_data['access_token']}",
+                "X-Account-ID": current_account_id,
+                "Content-Type": "application/json"
+            },
+            timeout=30
+        )
+        
+        if response.status_code in (200, 201):
+            return True, response.json()
+        
+        print(f"[Bot] Error enviando gastos en bloque: {response.status_code} - {response.text}")
+        return False, f"Error del servidor: HTTP {response.status_code}"
+            
+    except Exception as e:
+        return False, f"Error enviando gastos: {str(e)}"
+
 # ---------- COMANDOS DEL BOT ----------
 
 def format_user_status(telegram_id: int) -> str:
@@ -1,58 +1,395 @@
 # utils/ocr.py
+"""
+OCR de facturas con backend intercambiable (OCR_BACKEND):
+
+- tesserocr: motores Tesseract en proceso (PyTessBaseAPI) que se quedan
+  cargados y se reutilizan; el traineddata spa+eng se carga una vez por
+  motor, no en cada foto. Hasta OCR_POOL_SIZE motores por idioma, cada uno
+  usado por un solo hilo a la vez.
+- pytesseract: un subproceso `tesseract` por imagen (lo de siempre; no
+  necesita compilar nada).
+- auto (por defecto): tesserocr si está instalado, si no pytesseract. Si
+  tesserocr falla con una imagen se reintenta con pytesseract.
+
+La capa de texto de los PDF digitales también va por backend
+(PDF_TEXT_BACKEND): pdfplumber agrupa los caracteres por posición (mejor
+orden de líneas en facturas cortas) y pdfium (pypdfium2, ya lo instala
+pdfplumber) lee el texto nativo de PDFium, mucho más rápido y con memoria
+constante en PDFs largos de suministros u OTAs. En auto se elige por
+documento según páginas y tamaño.
+
+Las funciones extract_* aceptan una ruta, bytes o un fichero binario
+abierto (p. ej. el SpooledTemporaryFile de app/services/uploads.py), así que
+las subidas y las fotos de Telegram no tienen que escribirse a disco.
+
+Son bloqueantes: desde un handler async se llaman con run_ocr, que las
+ejecuta en un pool de OCR_POOL_SIZE hilos sin parar el event loop.
+"""
+import asyncio
+import io
+import os
+import platform
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import pdfplumber
 import pytesseract
-from pdf2image import convert_from_path
-import os
+from pdf2image import convert_from_bytes, convert_from_path
 
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto").lower()
+OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", str(min(2, os.cpu_count() or 1))))
+IMAGE_LANG = "spa+eng"
+PDF_LANG = "spa"
+PDF_TEXT_BACKEND = os.getenv("PDF_TEXT_BACKEND", "auto").lower()
+# En auto, pdfplumber solo para PDFs pequeños; por encima de cualquiera de los dos límites, pdfium
+PDF_PLUMBER_MAX_PAGES = int(os.getenv("PDF_PLUMBER_MAX_PAGES", "2"))
+PDF_PLUMBER_MAX_BYTES = int(os.getenv("PDF_PLUMBER_MAX_BYTES", str(512 * 1024)))
 
-def extract_text_from_image(image_path: str) -> str:
-    """Extract text from image using OCR"""
-    try:
+
+def _as_input(source):
+    """Ruta tal cual; bytes → BytesIO; ficheros rebobinados para leerlos otra vez"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def _source_size(source) -> int:
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    position = source.tell()
+    size = source.seek(0, os.SEEK_END)
+    source.seek(position)
+    return size
+
+
+class OcrBackend:
+    name = "base"
+
+    def image_to_string(self, image, lang: str) -> str:
+        raise NotImplementedError
+
+    def image_to_words(self, image, lang: str) -> list[dict]:
+        """Palabras con caja y confianza: text, left, top, width, height, conf (0-100)"""
+        raise NotImplementedError
+
+
+class PytesseractBackend(OcrBackend):
+    name = "pytesseract"
+
+    def __init__(self):
         # Configurar Tesseract para diferentes sistemas
-        import platform
         if platform.system() == "Windows":
             pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
         else:
             # Linux/Unix (Render)
             pytesseract.pytesseract.tesseract_cmd = "/usr/bin/tesseract"
-        
+
+    def image_to_string(self, image, lang):
+        return pytesseract.image_to_string(image, lang=lang)
+
+    def image_to_words(self, image, lang):
+        data = pytesseract.image_to_data(image, lang=lang, output_type=pytesseract.Output.DICT)
+        keys = ("text", "left", "top", "width", "height", "conf")
+        return [
+            {k: data[k][i] for k in keys}
+            for i in range(len(data["text"]))
+            if str(data["text"][i]).strip() and float(data["conf"][i]) >= 0
+        ]
+
+
+class TesserocrBackend(OcrBackend):
+    name = "tesserocr"
+
+    def __init__(self, pool_size: int = OCR_POOL_SIZE, tessdata: str | None = None):
+        import tesserocr  # ImportError si no está instalado: get_ocr_backend() usa pytesseract
+        self._tesserocr = tesserocr
+        self.pool_size = max(1, pool_size)
+        self.tessdata = tessdata or os.getenv("TESSDATA_PREFIX")
+        self._lock = threading.Lock()
+        self._idle: dict[str, queue.LifoQueue] = {}
+        self._created: dict[str, int] = {}
+        self.engine_load_seconds = 0.0
+
+    def _new_api(self, lang: str):
+        started = time.perf_counter()
+        kwargs = {"lang": lang}
+        if self.tessdata:
+            kwargs["path"] = self.tessdata
+        api = self._tesserocr.PyTessBaseAPI(**kwargs)
+        elapsed = time.perf_counter() - started
+        self.engine_load_seconds += elapsed
+        print(f"[OCR] 🔥 Motor Tesseract ({lang}) cargado en {elapsed * 1000:.0f} ms")
+        return api
+
+    @contextmanager
+    def _api(self, lang: str):
+        with self._lock:
+            idle = self._idle.setdefault(lang, queue.LifoQueue())
+            try:
+                api = idle.get_nowait()
+            except queue.Empty:
+                api = None
+                create = self._created.get(lang, 0) < self.pool_size
+                if create:
+                    self._created[lang] = self._created.get(lang, 0) + 1
+        if api is None:
+            if create:
+                try:
+                    api = self._new_api(lang)
+                except Exception:
+                    with self._lock:
+                        self._created[lang] -= 1
+                    raise
+            else:
+                api = idle.get()  # todos ocupados: esperar a que quede uno libre
+        try:
+            yield api
+        finally:
+            api.Clear()
+            idle.put(api)
+
+    def image_to_string(self, image, lang):
+        with self._api(lang) as api:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+
+    def image_to_words(self, image, lang):
+        level = self._tesserocr.RIL.WORD
+        words = []
+        with self._api(lang) as api:
+            api.SetImage(image)
+            api.Recognize()
+            for item in self._tesserocr.iterate_level(api.GetIterator(), level):
+                text = item.GetUTF8Text(level)
+                box = item.BoundingBox(level)
+                if not text or not text.strip() or box is None:
+                    continue
+                left, top, right, bottom = box
+                words.append({"text": text, "left": left, "top": top, "width": right - left,
+                              "height": bottom - top, "conf": item.Confidence(level)})
+        return words
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"engines": dict(self._created), "idle": {k: q.qsize() for k, q in self._idle.items()},
+                    "engine_load_seconds": round(self.engine_load_seconds, 3)}
+
+
+_backend: OcrBackend | None = None
+_fallback: OcrBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def _build_backend(kind: str) -> OcrBackend:
+    if kind == "pytesseract":
+        return PytesseractBackend()
+    if kind == "tesserocr":
+        return TesserocrBackend()
+    if kind == "auto":
+        try:
+            return TesserocrBackend()
+        except ImportError:
+            return PytesseractBackend()
+    raise ValueError(f"OCR_BACKEND no válido: {kind}")
+
+
+def get_ocr_backend() -> OcrBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _build_backend(OCR_BACKEND)
+                print(f"[OCR] 🔎 Backend: {_backend.name}")
+    return _backend
+
+
+def set_ocr_backend(backend: OcrBackend | None):
+    """Sustituye el backend del proceso (benchmarks); None vuelve al de OCR_BACKEND"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def _ocr(method: str, image, lang: str):
+    global _fallback
+    backend = get_ocr_backend()
+    try:
+        return getattr(backend, method)(image, lang)
+    except Exception as e:
+        if isinstance(backend, PytesseractBackend):
+            raise
+        print(f"[OCR] ⚠️ {backend.name} falló ({e}), reintentando con pytesseract")
+        if _fallback is None:
+            _fallback = PytesseractBackend()
+        return getattr(_fallback, method)(image, lang)
+
+
+def extract_text_from_image(image_path) -> str:
+    """Extract text from image using OCR (ruta, bytes o fichero binario)"""
+    try:
         from PIL import Image
-        image = Image.open(image_path)
-        text = pytesseract.image_to_string(image, lang="spa+eng")
+        with Image.open(_as_input(image_path)) as image:
+            text = _ocr("image_to_string", image, IMAGE_LANG)
         return text.strip()
     except Exception as e:
         print(f"[OCR] Error extracting text from image: {e}")
         return ""
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    text = ""
+def extract_text_and_words_from_image(image_path) -> tuple[str, list[dict]]:
+    """
+    OCR con cajas de palabras: devuelve el texto por líneas reconstruidas
+    por posición y las palabras (text, left, top, width, height, conf) para
+    las reglas de Receipt_Rules. Una sola pasada de Tesseract.
+    """
+    try:
+        from PIL import Image
+        try:
+            from .Receipt_Rules import lines_from_words
+        except ImportError:
+            from Receipt_Rules import lines_from_words
 
-    # Configurar ruta de Tesseract para diferentes sistemas
-    import platform
-    if platform.system() == "Windows":
-        pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-    else:
-        # Linux/Unix (Render)
-        pytesseract.pytesseract.tesseract_cmd = "/usr/bin/tesseract"
+        with Image.open(_as_input(image_path)) as image:
+            words = _ocr("image_to_words", image, IMAGE_LANG)
+        text = "\n".join(line for line, _ in lines_from_words(words))
+        return text.strip(), words
+    except Exception as e:
+        print(f"[OCR] Error extracting words from image: {e}")
+        return "", []
 
-    # 1. Intentar extracción directa con pdfplumber (si hay texto digital)
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
+class PdfTextBackend:
+    name = "base"
+
+    def extract_pages(self, pdf_path) -> list[str]:
+        """Texto de la capa digital, una cadena por página ('' si no hay); ruta o fichero binario"""
+        raise NotImplementedError
+
+
+class PdfplumberBackend(PdfTextBackend):
+    name = "pdfplumber"
+
+    def extract_pages(self, pdf_path):
+        pages = []
+        with pdfplumber.open(_as_input(pdf_path)) as pdf:
             for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+                pages.append(page.extract_text() or "")
+                page.close()  # liberar la caché de objetos de la página
+        return pages
+
+
+class PdfiumBackend(PdfTextBackend):
+    name = "pdfium"
+
+    def __init__(self):
+        import pypdfium2  # ImportError si no está: se usa pdfplumber
+        self._pdfium = pypdfium2
+
+    def extract_pages(self, pdf_path):
+        pages = []
+        pdf = self._pdfium.PdfDocument(_as_input(pdf_path))
+        try:
+            for index in range(len(pdf)):
+                page = pdf[index]
+                textpage = page.get_textpage()
+                try:
+                    pages.append(textpage.get_text_range().replace("\r\n", "\n"))
+                finally:
+                    textpage.close()
+                    page.close()
+        finally:
+            pdf.close()
+        return pages
+
+    def page_count(self, pdf_path) -> int:
+        pdf = self._pdfium.PdfDocument(_as_input(pdf_path))
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+
+_pdf_backends: dict[str, PdfTextBackend] = {}
+
+
+def _pdf_backend(name: str) -> PdfTextBackend | None:
+    if name not in _pdf_backends:
+        try:
+            _pdf_backends[name] = PdfiumBackend() if name == "pdfium" else PdfplumberBackend()
+        except ImportError:
+            return None
+    return _pdf_backends[name]
+
+
+def choose_pdf_backend(pdf_path) -> PdfTextBackend:
+    """Backend de texto para este PDF según PDF_TEXT_BACKEND, páginas y tamaño"""
+    if PDF_TEXT_BACKEND in ("pdfium", "pdfplumber"):
+        return _pdf_backend(PDF_TEXT_BACKEND) or _pdf_backend("pdfplumber")
+    if PDF_TEXT_BACKEND != "auto":
+        raise ValueError(f"PDF_TEXT_BACKEND no válido: {PDF_TEXT_BACKEND}")
+
+    pdfium = _pdf_backend("pdfium")
+    if pdfium is None:
+        return _pdf_backend("pdfplumber")
+    try:
+        if _source_size(_as_input(pdf_path)) > PDF_PLUMBER_MAX_BYTES:
+            return pdfium
+        if pdfium.page_count(pdf_path) > PDF_PLUMBER_MAX_PAGES:
+            return pdfium
+    except Exception:
+        pass  # PDF dañado: que lo intente pdfplumber
+    return _pdf_backend("pdfplumber")
+
+
+def extract_text_from_pdf(pdf_path) -> str:
+    text = ""
+
+    # 1. Intentar extracción directa de la capa de texto (si hay texto digital)
+    backend = choose_pdf_backend(pdf_path)
+    try:
+        text = "\n".join(page for page in backend.extract_pages(pdf_path) if page.strip())
     except Exception as e:
-        print(f"[OCR] Error en pdfplumber: {e}")
+        print(f"[OCR] Error en {backend.name}: {e}")
+        if backend.name != "pdfplumber":
+            try:
+                text = "\n".join(page for page in PdfplumberBackend().extract_pages(pdf_path) if page.strip())
+            except Exception as e:
+                print(f"[OCR] Error en pdfplumber: {e}")
 
     # 2. Si no se extrajo nada, usar OCR con Tesseract
     if not text.strip():
         try:
-            images = convert_from_path(pdf_path)
+            if isinstance(pdf_path, (str, os.PathLike)):
+                images = convert_from_path(pdf_path)
+            else:
+                images = convert_from_bytes(_as_input(pdf_path).read())
             for img in images:
-                ocr_text = pytesseract.image_to_string(img, lang="spa")
+                ocr_text = _ocr("image_to_string", img, PDF_LANG)
                 text += ocr_text + "\n"
         except Exception as e:
             print(f"[OCR] Error en OCR con Tesseract: {e}")
 
     return text.strip()
+
+
+_ocr_executor = None
+_ocr_executor_lock = threading.Lock()
+
+
+def get_ocr_executor() -> ThreadPoolExecutor:
+    """Pool de hilos del OCR: uno por motor Tesseract (OCR_POOL_SIZE)"""
+    global _ocr_executor
+    if _ocr_executor is None:
+        with _ocr_executor_lock:
+            if _ocr_executor is None:
+                _ocr_executor = ThreadPoolExecutor(max_workers=max(1, OCR_POOL_SIZE), thread_name_prefix="ocr")
+    return _ocr_executor
+
+
+async def run_ocr(func, *args):
+    """await run_ocr(extract_text_from_pdf, upload): la extract_* en el pool, fuera del event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_ocr_executor(), func, *args)
@@ -0,0 +1,465 @@
+# Receipt_Rules.py — extracción por reglas de tickets y facturas españolas
+"""
+Vía rápida antes del LLM: muchos tickets tienen un "TOTAL", una fecha y un
+CIF/NIF claros. Estas reglas sacan importe, fecha, CIF/NIF del proveedor,
+número de factura, tipo de IVA y nombre del proveedor del texto OCR, cada
+campo con una confianza entre 0 y 1.
+
+Si hay cajas de palabras de Tesseract (image_to_data) se reconstruyen las
+líneas por posición: en los tickets el importe suele estar en otra columna y
+image_to_string lo separa de su etiqueta. La confianza OCR de la línea
+rebaja la del campo.
+
+Llm_Untils decide con RECEIPT_RULES_MIN_CONFIDENCE qué campos se dan por
+resueltos y solo pregunta al LLM por el resto.
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+from datetime import date, timedelta
+
+VALID_VAT_RATES = (0, 4, 5, 10, 21)
+
+_AMOUNT_RE = re.compile(r"(?<![\d.,])(\d{1,3}(?:\.\d{3})+|\d{1,3}(?:,\d{3})+|\d+)([.,])(\d{2})(?![\d])")
+_EXCLUDED_TOTAL_RE = re.compile(
+    r"SUB\s*-?\s*TOTAL|TOTAL\s*(?:DE\s+)?(?:IVA|I\.V\.A|BASE|DTO|DESCUENTO|AHORRO|ART|UDS|UNIDADES|PARCIAL|CUOTA|LINEAS|PUNTOS)"
+    r"|BASE\s+IMPONIBLE|CAMBIO|ENTREGADO|DEVOLUCI"
+)
+_TOTAL_PATTERNS = (
+    (re.compile(r"TOTAL\s*(?:A\s+PAGAR|FACTURA|COMPRA|EUR|€)|IMPORTE\s+TOTAL|TOTAL\s+IMPORTE"), 0.95),
+    (re.compile(r"\bTOTAL\b"), 0.9),
+    (re.compile(r"\bA\s+PAGAR\b|\bIMPORTE\b"), 0.75),
+    (re.compile(r"\b(?:EFECTIVO|TARJETA|VISA|MASTERCARD|PAGADO|COBRADO)\b"), 0.6),
+)
+_BASE_RE = re.compile(r"BASE(?:\s+IMPONIBLE)?")
+_QUOTA_RE = re.compile(r"CUOTA|(?:TOTAL\s+)?I\.?V\.?A\.?\s*(?:\d{1,2}(?:[.,]0+)?\s*%)?\s*[:=]?\s*\d")
+
+_NUMERIC_DATE_RE = re.compile(r"(?<!\d)(\d{1,2})[/.\-](\d{1,2})[/.\-](\d{4}|\d{2})(?!\d)|(?<!\d)(\d{4})-(\d{2})-(\d{2})(?!\d)")
+_MONTHS = {
+    "ENE": 1, "FEB": 2, "MAR": 3, "ABR": 4, "MAY": 5, "JUN": 6,
+    "JUL": 7, "AGO": 8, "SEP": 9, "SET": 9, "OCT": 10, "NOV": 11, "DIC": 12,
+}
+_WORD_DATE_RE = re.compile(r"(?<!\d)(\d{1,2})\s*(?:DE\s+|[\-/ ])?(ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEPT?|SET|OCT|NOV|DIC)[A-Z]*\.?\s*(?:DE\s+|[\-/ ])?(\d{4})")
+_DATE_LABEL_RE = re.compile(r"FECHA(?!\s+(?:DE\s+)?(?:VENC|CADUC|ENTREGA|PAGO))|EMISI|EXPEDICI")
+_DATE_NEGATIVE_RE = re.compile(r"VENC|CADUC|VALIDO|HASTA|ENTREGA")
+
+_TAX_ID_RE = re.compile(r"(?<![A-Z0-9])([ABCDEFGHJNPQRSUVW])[\s.\-]?(\d{7})[\s.\-]?([0-9A-J])(?![A-Z0-9])"
+                        r"|(?<![A-Z0-9])([XYZ]?)[\s.\-]?(\d{7,8})[\s.\-]?([A-Z])(?![A-Z0-9])")
+_TAX_LABEL_RE = re.compile(r"\b(?:C\.?I\.?F|N\.?I\.?F|N\.?I\.?E|VAT|DNI)\b")
+_NIF_LETTERS = "TRWAGMYFPDXBNJZSQVHLCKE"
+
+_INVOICE_RE = re.compile(
+    r"(?:(FACTURA(?:\s+SIMPLIFICADA)?|FRA\.?|INVOICE|TICKET|SIMPLIFICADA)(?:\s+(?:N[ºO°]\.?|NUM\.?|NUMERO))?|(N[ºO°]\.?|NUM\.?|NUMERO))"
+    r"\s*(?:(?:DE\s+)?(?:FACTURA|TICKET|DOC)\w*)?\s*[:#.]?\s*([A-Z0-9][A-Z0-9/\-.]{2,24})"
+)
+
+_VAT_TABLE_HEADER_RE = re.compile(r"I\.?V\.?A.*(?:BASE|CUOTA)|(?:BASE|CUOTA).*I\.?V\.?A|%\s*(?:BASE|B\.I)")
+_VAT_TABLE_ROW_RE = re.compile(r"^(\d{1,2})(?:[.,]0+)?\s*%")
+_VAT_RE = re.compile(r"(?:IVA|I\.V\.A\.?)\D{0,12}?(\d{1,2})(?:[.,]0+)?\s*%|(\d{1,2})(?:[.,]0+)?\s*%\s*(?:DE\s+)?(?:IVA|I\.V\.A)")
+
+_VENDOR_SKIP_RE = re.compile(
+    r"FACTURA|TICKET|FECHA|HORA|TEL[EÉF]|TFNO|FAX|C/|CALLE|AVDA|AVENIDA|PLAZA|PASEO|CTRA|\bCP\b|WWW|HTTP|@"
+    r"|N[ºO°]|SIMPLIFICADA|CLIENTE\s*[:#]|CAJA|MESA|BIENVENID|GRACIAS|CIF|NIF|ATENDID|OPERADOR"
+)
+_COMPANY_SUFFIX_RE = re.compile(r"\b(?:S\.?\s?L\.?\s?U?\.?|S\.?\s?A\.?\s?U?\.?|S\.?\s?COOP\.?|S\.?\s?C\.?|C\.?\s?B\.?|SLNE)(?=\s|$|,)")
+
+_CATEGORY_KEYWORDS = (
+    ("limpieza", ("LIMPIEZA", "LIMPIEZAS", "DETERGENTE", "LEJIA", "FREGONA")),
+    ("lavandería", ("LAVANDERIA", "TINTORERIA", "LAVADO")),
+    ("suministros", ("IBERDROLA", "ENDESA", "NATURGY", "ELECTRIC", "AGUA", "GAS ", "CANAL DE ISABEL", "MOVISTAR", "VODAFONE", "ORANGE", "FIBRA")),
+    ("mantenimiento", ("FERRETERIA", "FONTANER", "ELECTRICISTA", "REPARACI", "CERRAJER", "PINTURA", "LEROY MERLIN", "BRICO")),
+    ("amenities", ("MERCADONA", "CARREFOUR", "MAKRO", "LIDL", "ALDI", "DIA ", "EROSKI", "SUPERMERCADO", "AMENITIES")),
+    ("comunidad", ("COMUNIDAD DE PROPIETARIOS", "ADMINISTRADOR DE FINCAS")),
+)
+
+
+class FieldGuess:
+    __slots__ = ("value", "confidence", "line")
+
+    def __init__(self, value, confidence: float, line: str = ""):
+        self.value = value
+        self.confidence = round(min(max(confidence, 0.0), 0.99), 3)
+        self.line = line
+
+    def __repr__(self):
+        return f"FieldGuess({self.value!r}, {self.confidence})"
+
+
+# ---------- LÍNEAS ----------
+
+def _fold(text: str) -> str:
+    """Mayúsculas sin tildes (Ñ se mantiene) para comparar con las reglas"""
+    text = text.upper().replace("Ñ", "\0")
+    text = "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+    return text.replace("\0", "Ñ")
+
+
+def lines_from_words(words: list[dict]) -> list[tuple[str, float]]:
+    """
+    Reconstruye las líneas a partir de las cajas de Tesseract agrupando por
+    altura (no por bloque: la columna de importes suele ser otro bloque).
+    Devuelve (texto, confianza OCR media 0-1) por línea, de arriba abajo.
+    """
+    valid = [w for w in words if str(w.get("text", "")).strip() and float(w.get("conf", 0)) >= 0]
+    valid.sort(key=lambda w: w["top"] + w["height"] / 2)
+    rows = []
+    for w in valid:
+        cy = w["top"] + w["height"] / 2
+        if rows and abs(cy - rows[-1]["cy"]) <= 0.5 * max(w["height"], rows[-1]["h"]):
+            row = rows[-1]
+            row["words"].append(w)
+            row["cy"] += (cy - row["cy"]) / len(row["words"])
+        else:
+            rows.append({"cy": cy, "h": w["height"], "words": [w]})
+    lines = []
+    for row in rows:
+        row_words = sorted(row["words"], key=lambda w: w["left"])
+        text = " ".join(str(w["text"]).strip() for w in row_words)
+        conf = sum(float(w["conf"]) for w in row_words) / len(row_words) / 100
+        lines.append((text, conf))
+    return lines
+
+
+def _prepare_lines(raw_text: str, words: list[dict] | None) -> list[tuple[str, str, float]]:
+    """(original, normalizada, factor de confianza OCR) por línea no vacía"""
+    if words:
+        source = lines_from_words(words)
+    else:
+        source = [(line, 1.0) for line in (raw_text or "").splitlines()]
+    prepared = []
+    for text, ocr_conf in source:
+        text = re.sub(r"\s+", " ", text).strip()
+        if text:
+            prepared.append((text, _fold(text), 0.6 + 0.4 * min(max(ocr_conf, 0.0), 1.0)))
+    return prepared
+
+
+# ---------- CAMPOS ----------
+
+def parse_amount(integer: str, separator: str, decimals: str) -> float:
+    return float(re.sub(r"[.,]", "", integer) + "." + decimals)
+
+
+def _amounts(folded: str) -> list[float]:
+    return [parse_amount(*m.groups()) for m in _AMOUNT_RE.finditer(folded)]
+
+
+def _only_amount(folded: str) -> float | None:
+    stripped = re.sub(r"€|EUR|EUROS|[:\s]", "", folded)
+    m = _AMOUNT_RE.fullmatch(stripped)
+    return parse_amount(*m.groups()) if m else None
+
+
+def _vat_table(lines) -> list[tuple[int, float, float]]:
+    """Filas "tipo% base cuota" bajo una cabecera "IVA BASE CUOTA" (tickets de supermercado)"""
+    rows, in_table = [], False
+    for _, folded, _ in lines:
+        if _VAT_TABLE_HEADER_RE.search(folded) and not _amounts(folded):
+            in_table = True
+            continue
+        m = _VAT_TABLE_ROW_RE.match(folded)
+        amounts = _amounts(folded[m.end():]) if m else []
+        if in_table and m and len(amounts) >= 2 and int(m.group(1)) in VALID_VAT_RATES:
+            rows.append((int(m.group(1)), amounts[0], amounts[1]))
+        elif in_table and rows:
+            break
+    return rows
+
+
+def _base_and_quota(lines) -> tuple[float, float] | None:
+    table = _vat_table(lines)
+    if table:
+        return round(sum(r[1] for r in table), 2), round(sum(r[2] for r in table), 2)
+    base = quota = None
+    for _, folded, _ in lines:
+        amounts = _amounts(folded)
+        if not amounts:
+            continue
+        if base is None and _BASE_RE.search(folded):
+            base = amounts[-1]
+        elif quota is None and _QUOTA_RE.search(folded) and "TOTAL" not in folded.replace("TOTAL IVA", ""):
+            quota = amounts[-1]
+    return (base, quota) if base and quota is not None else None
+
+
+def _extract_total(lines, base_quota) -> FieldGuess | None:
+    candidates = []
+    for i, (text, folded, factor) in enumerate(lines):
+        if _EXCLUDED_TOTAL_RE.search(folded):
+            continue
+        for pattern, score in _TOTAL_PATTERNS:
+            if pattern.search(folded):
+                amounts = _amounts(folded[pattern.search(folded).end():]) or _amounts(folded)
+                if amounts:
+                    candidates.append((score * factor, amounts[-1], text))
+                elif i + 1 < len(lines):
+                    # Importe alineado a la derecha en la línea siguiente
+                    amount = _only_amount(lines[i + 1][1])
+                    if amount is not None:
+                        candidates.append((score * factor * 0.9, amount, f"{text} {lines[i + 1][0]}"))
+                break
+
+    if base_quota:
+        expected = round(base_quota[0] + base_quota[1], 2)
+        if not candidates:
+            return FieldGuess(expected, 0.85, "base + cuota")
+        for score, amount, text in candidates:
+            if abs(amount - expected) < 0.011:
+                return FieldGuess(amount, 0.99, text)
+
+    if not candidates:
+        amounts = [a for _, folded, _ in lines for a in _amounts(folded)]
+        return FieldGuess(max(amounts), 0.45, "mayor importe") if amounts else None
+
+    best_score = max(c[0] for c in candidates)
+    best = [c for c in candidates if c[0] >= best_score - 0.01]
+    score, amount, text = max(best, key=lambda c: c[1])
+    if len({c[1] for c in best}) > 1:
+        score -= 0.15  # varios totales distintos al mismo nivel
+    if any(abs(c[1] - amount) < 0.011 for c in candidates if c[2] != text):
+        score += 0.04  # otra línea (pago con tarjeta, efectivo) confirma el importe
+    return FieldGuess(amount, score, text)
+
+
+def _make_date(year: int, month: int, day: int) -> date | None:
+    if year < 100:
+        year += 2000
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _extract_date(lines, today: date) -> FieldGuess | None:
+    found = []  # (fecha, etiquetada, línea)
+    for text, folded, factor in lines:
+        candidates = []
+        for m in _NUMERIC_DATE_RE.finditer(folded):
+            if m.group(4):
+                candidates.append(_make_date(int(m.group(4)), int(m.group(5)), int(m.group(6))))
+            else:
+                candidates.append(_make_date(int(m.group(3)), int(m.group(2)), int(m.group(1))))
+        for m in _WORD_DATE_RE.finditer(folded):
+            candidates.append(_make_date(int(m.group(3)), _MONTHS[m.group(2)[:3]], int(m.group(1))))
+        for d in candidates:
+            if d is None or _DATE_NEGATIVE_RE.search(folded):
+                continue
+            if not (today - timedelta(days=365 * 5) <= d <= today + timedelta(days=1)):
+                continue
+            found.append((d, bool(_DATE_LABEL_RE.search(folded)), factor, text))
+    if not found:
+        return None
+
+    labelled = [f for f in found if f[1]]
+    distinct = {f[0] for f in found}
+    d, _, factor, text = labelled[0] if labelled else found[0]
+    if len(distinct) == 1:
+        confidence = 0.95
+    elif labelled:
+        confidence = 0.85
+    else:
+        confidence = 0.6
+    return FieldGuess(d.isoformat(), confidence * factor, text)
+
+
+def valid_tax_id(tax_id: str) -> bool:
+    """Comprueba el dígito/letra de control de un CIF, NIF o NIE"""
+    tax_id = tax_id.upper()
+    if re.fullmatch(r"\d{8}[A-Z]", tax_id):
+        return _NIF_LETTERS[int(tax_id[:8]) % 23] == tax_id[8]
+    if re.fullmatch(r"[XYZ]\d{7}[A-Z]", tax_id):
+        number = int(str("XYZ".index(tax_id[0])) + tax_id[1:8])
+        return _NIF_LETTERS[number % 23] == tax_id[8]
+    if re.fullmatch(r"[ABCDEFGHJNPQRSUVW]\d{7}[0-9A-J]", tax_id):
+        digits = tax_id[1:8]
+        total = sum(int(digits[i]) for i in (1, 3, 5))
+        for i in (0, 2, 4, 6):
+            doubled = int(digits[i]) * 2
+            total += doubled // 10 + doubled % 10
+        control = (10 - total % 10) % 10
+        letter = "JABCDEFGHI"[control]
+        if tax_id[0] in "PQRSNW":
+            return tax_id[8] == letter
+        if tax_id[0] in "ABEH":
+            return tax_id[8] == str(control)
+        return tax_id[8] in (str(control), letter)
+    return False
+
+
+def _extract_tax_id(lines) -> tuple[FieldGuess | None, int | None]:
+    found = []  # (id, válido, etiquetado, factor, índice de línea, línea)
+    for i, (text, folded, factor) in enumerate(lines):
+        for m in _TAX_ID_RE.finditer(folded):
+            tax_id = "".join(g for g in m.groups() if g)
+            if len(tax_id) != 9:
+                continue
+            found.append((tax_id, valid_tax_id(tax_id), bool(_TAX_LABEL_RE.search(folded)), factor, i, text))
+    valid = [f for f in found if f[1]]
+    if valid:
+        tax_id, _, _, factor, index, text = valid[0]
+        confidence = 0.95 if len({f[0] for f in valid}) == 1 else 0.8  # el segundo suele ser el cliente
+        return FieldGuess(tax_id, confidence * factor, text), index
+    labelled = [f for f in found if f[2]]
+    if labelled:
+        tax_id, _, _, factor, index, text = labelled[0]
+        return FieldGuess(tax_id, 0.55 * factor, text), index
+    return None, None
+
+
+def _extract_invoice_number(lines) -> FieldGuess | None:
+    for text, folded, factor in lines:
+        for m in _INVOICE_RE.finditer(folded):
+            number = m.group(3).rstrip(".-/")
+            if not re.search(r"\d", number) or _NUMERIC_DATE_RE.fullmatch(number):
+                continue
+            confidence = 0.85 if m.group(1) else 0.7
+            # Conservar las mayúsculas/minúsculas del texto original
+            start = folded.find(number, m.start(3))
+            original = text[start:start + len(number)] if start >= 0 and len(text) == len(folded) else number
+            return FieldGuess(original, confidence * factor, text)
+    return None
+
+
+def _extract_vat_rate(lines, base_quota) -> FieldGuess | None:
+    table = _vat_table(lines)
+    if table:
+        # IVA mixto: el tipo de la base mayor
+        rate = max(table, key=lambda r: r[1])[0]
+        return FieldGuess(rate, 0.95 if len({r[0] for r in table}) == 1 else 0.6, "tabla de IVA")
+    if base_quota and base_quota[0]:
+        computed = base_quota[1] / base_quota[0] * 100
+        nearest = min(VALID_VAT_RATES, key=lambda r: abs(r - computed))
+        if abs(nearest - computed) < 0.6:
+            return FieldGuess(nearest, 0.95, "cuota / base")
+    rates = []
+    for text, folded, factor in lines:
+        for m in _VAT_RE.finditer(folded):
+            rate = int(m.group(1) or m.group(2))
+            if rate in VALID_VAT_RATES:
+                rates.append((rate, factor, text))
+    if not rates:
+        return None
+    rate, factor, text = rates[0]
+    confidence = 0.9 if len({r[0] for r in rates}) == 1 else 0.6  # IVA mixto
+    return FieldGuess(rate, confidence * factor, text)
+
+
+def _extract_vendor(lines, tax_line: int | None) -> FieldGuess | None:
+    for i, (text, folded, factor) in enumerate(lines[:6]):
+        letters = sum(c.isalpha() for c in folded)
+        digits = sum(c.isdigit() for c in folded)
+        if letters < 3 or digits > letters or _VENDOR_SKIP_RE.search(folded):
+            continue
+        if _TAX_ID_RE.search(folded) or _NUMERIC_DATE_RE.search(folded) or _amounts(folded):
+            continue
+        name = text.strip(" ,:;-*=")
+        if _COMPANY_SUFFIX_RE.search(folded):
+            confidence = 0.9
+        elif tax_line is not None and 0 < tax_line - i <= 2:
+            confidence = 0.85
+        else:
+            confidence = 0.6
+        return FieldGuess(name[:120], confidence * factor, text)
+    return None
+
+
+def guess_category(raw_text: str) -> str | None:
+    folded = _fold(raw_text or "") + " "
+    for category, keywords in _CATEGORY_KEYWORDS:
+        if any(k in folded for k in keywords):
+            return category
+    return None
+
+
+def extract_receipt_fields(raw_text: str = "", words: list[dict] | None = None,
+                           today: date | None = None) -> dict[str, FieldGuess]:
+    """
+    Campos encontrados por reglas: amount_gross, date, vendor_tax_id,
+    invoice_number, vat_rate y vendor. Los que no aparecen no se incluyen.
+    """
+    lines = _prepare_lines(raw_text, words)
+    base_quota = _base_and_quota(lines)
+    tax_id, tax_line = _extract_tax_id(lines)
+    fields = {
+        "amount_gross": _extract_total(lines, base_quota),
+        "date": _extract_date(lines, today or date.today()),
+        "vendor_tax_id": tax_id,
+        "invoice_number": _extract_invoice_number(lines),
+        "vat_rate": _extract_vat_rate(lines, base_quota),
+        "vendor": _extract_vendor(lines, tax_line),
+    }
+    return {name: guess for name, guess in fields.items() if guess is not None}
+
+
+# ---------- CONDENSACIÓN PARA EL LLM ----------
+
+_FOOTER_RE = re.compile(
+    r"PROTECCION DE DATOS|LOPD|RGPD|REGISTRO MERCANTIL|INSCRITA|\bTOMO\s+\d|\bFOLIO\s+\d|\bHOJA\s+[A-Z]?-?\d"
+    r"|DEVOLUCI|CONSERVE|GRACIAS|VUELVA PRONTO|WWW\.|HTTP|HORARIO|SIGUENOS|ATENDID|LE ATENDI|COPIA PARA"
+)
+_PAYMENT_RE = re.compile(r"\b(?:EFECTIVO|TARJETA|VISA|MASTERCARD|PAGADO|COBRADO|CAMBIO|ENTREGADO)\b")
+
+
+def _is_noise(text: str) -> bool:
+    visible = text.replace(" ", "")
+    alnum = sum(c.isalnum() for c in visible)
+    return alnum < 2 or alnum < 0.4 * len(visible)
+
+
+def _line_score(index: int, folded: str) -> float:
+    """Relevancia de una línea para el LLM: totales > IVA/fechas/CIF > nº factura > cabecera > artículos"""
+    if _is_noise(folded) or _FOOTER_RE.search(folded):
+        return 0.0
+    score = 0.0
+    if not _EXCLUDED_TOTAL_RE.search(folded) and any(p.search(folded) for p, s in _TOTAL_PATTERNS if s >= 0.75):
+        score = 10.0
+    if _BASE_RE.search(folded) or _VAT_RE.search(folded) or _VAT_TABLE_HEADER_RE.search(folded) \
+            or _VAT_TABLE_ROW_RE.match(folded):
+        score = max(score, 8.0)
+    if _NUMERIC_DATE_RE.search(folded) or _WORD_DATE_RE.search(folded):
+        score = max(score, 9.0 if _DATE_LABEL_RE.search(folded) else 8.0)
+    if _TAX_ID_RE.search(folded):
+        score = max(score, 8.0)
+    if _INVOICE_RE.search(folded):
+        score = max(score, 7.0)
+    if _COMPANY_SUFFIX_RE.search(folded):
+        score = max(score, 7.0)
+    if index < 4 and not _amounts(folded):
+        score = max(score, 6.0 - index)  # cabecera: proveedor y dirección
+    if _PAYMENT_RE.search(folded):
+        score = max(score, 4.0)
+    if not score and _amounts(folded):
+        score = 1.0  # línea de artículo
+    return score
+
+
+def condense_text(raw_text: str, max_tokens: int, words: list[dict] | None = None) -> str:
+    """
+    Reduce el texto OCR a las líneas relevantes para importe, fechas,
+    proveedor e impuestos sin pasar de `max_tokens` (~4 caracteres por token,
+    la misma estimación que la pasarela LLM). Quita ruido y pies legales;
+    los artículos solo entran si sobra presupuesto. Mantiene el orden original.
+    """
+    lines = _prepare_lines(raw_text, words)
+    scores = [_line_score(i, folded) for i, (_, folded, _) in enumerate(lines)]
+    for i in range(len(lines) - 1):
+        # Etiqueta sin importe: el importe está en la línea siguiente
+        if scores[i] >= 7 and not _amounts(lines[i][1]) and _only_amount(lines[i + 1][1]) is not None:
+            scores[i + 1] = max(scores[i + 1], scores[i])
+
+    budget = max_tokens * 4
+    if sum(len(lines[i][0]) + 1 for i, s in enumerate(scores) if s > 0) > budget:
+        budget -= 32  # sitio para la marca de líneas omitidas
+    keep = set()
+    for i in sorted((i for i, s in enumerate(scores) if s > 0), key=lambda i: (-scores[i], i)):
+        cost = len(lines[i][0]) + 1
+        if cost <= budget:
+            keep.add(i)
+            budget -= cost
+
+    kept = [lines[i][0] for i in sorted(keep)]
+    omitted = sum(1 for i, s in enumerate(scores) if s > 0 and i not in keep)
+    if omitted:
+        kept.append(f"[... {omitted} líneas omitidas]")
+    return "\n".join(kept)
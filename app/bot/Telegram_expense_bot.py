@@ -20,12 +20,12 @@ load_dotenv()  # Carga .env
 # Importaciones relativas para cuando se ejecuta como módulo
 try:
     from .Ocr_untils import extract_text_from_pdf, extract_text_from_image
-    from .Llm_Untils import extract_expense_json
+    from .Llm_Untils import extract_expense_json_async
     from .Api_Utils import send_expense_to_backend, get_apartment_id_by_code
 except ImportError:
     # Importaciones absolutas para cuando se ejecuta directamente
     from Ocr_untils import extract_text_from_pdf, extract_text_from_image
-    from Llm_Untils import extract_expense_json
+    from Llm_Untils import extract_expense_json_async
     from Api_Utils import send_expense_to_backend, get_apartment_id_by_code
 
 # ---------------------------------------------------------------------
@@ -305,7 +305,7 @@ async def handle_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # 5) LLM → JSON
         try:
-            expense_json = extract_expense_json(text, base_code)
+            expense_json = await extract_expense_json_async(text, base_code)
         except Exception as e:
             logger.exception("Error en LLM:")
             await update.message.reply_text(f"❌ Error interpretando el ticket con IA: {e}")
@@ -400,7 +400,7 @@ async def _process_expense_text(update, user_id, base_code, base_id, texto_extra
         logger.info(f"Texto extraído (primeros 200 chars): {texto_extraido[:200]}")
 
         # 1) Llamar al LLM
-        expense_json = extract_expense_json(texto_extraido)
+        expense_json = await extract_expense_json_async(texto_extraido, base_code)
         if not expense_json:
             await update.message.reply_text("❌ No pude extraer datos de gasto del texto.")
             return
@@ -4,10 +4,10 @@ Bot de Telegram con sistema multiusuario
 """
 from __future__ import annotations
 
+import asyncio
 import os
 import json
 import logging
-import tempfile
 from uuid import uuid4
 from pathlib import Path
 import unicodedata
@@ -26,20 +26,24 @@ try:
         register_telegram_user, authenticate_user_by_email, get_user_by_telegram_id,
         get_user_accounts, switch_account, get_current_account, get_account_apartments,
         send_expense_to_account, format_user_status, format_apartments_list,
-        save_user_cache_to_file, MultiuserBotError
+        save_user_cache_to_file, MultiuserBotError, send_expenses_bulk_to_account
     )
-    from .Ocr_untils import extract_text_from_pdf, extract_text_from_image
-    from .Llm_Untils import extract_expense_json
+    from .Ocr_untils import extract_text_from_pdf, extract_text_from_image, extract_text_and_words_from_image, run_ocr
+    from .Llm_Untils import extract_expense_json_async
+    from ..services.uploads import UploadTooLarge, spool_telegram_file
+    from .Album_Utils import AlbumCollector, extract_album_expenses, format_album_summary
 except ImportError:
     # Importaciones absolutas para cuando se ejecuta directamente
     from Multiuser_Utils import (
         register_telegram_user, authenticate_user_by_email, get_user_by_telegram_id,
         get_user_accounts, switch_account, get_current_account, get_account_apartments,
         send_expense_to_account, format_user_status, format_apartments_list,
-        save_user_cache_to_file, MultiuserBotError
+        save_user_cache_to_file, MultiuserBotError, send_expenses_bulk_to_account
     )
-    from Ocr_untils import extract_text_from_pdf, extract_text_from_image
-    from Llm_Untils import extract_expense_json
+    from Ocr_untils import extract_text_from_pdf, extract_text_from_image, extract_text_and_words_from_image, run_ocr
+    from Llm_Untils import extract_expense_json_async
+    from app.services.uploads import UploadTooLarge, spool_telegram_file  # Llm_Untils ya añadió la raíz al path
+    from Album_Utils import AlbumCollector, extract_album_expenses, format_album_summary
 
 # Configuración
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
@@ -467,7 +471,9 @@ async def process_manual_expense(update: Update, context: ContextTypes.DEFAULT_T
     
     try:
         # Usar IA para extraer datos del texto
-        expense_json = extract_expense_json(text, apartment_code)
+        expense_json = await extract_expense_json_async(
+            text, apartment_code, account_id=(get_user_by_telegram_id(user_id) or {}).get("current_account_id")
+        )
         
         if not expense_json:
             await update.message.reply_text(
@@ -484,7 +490,7 @@ async def process_manual_expense(update: Update, context: ContextTypes.DEFAULT_T
         expense_json["source"] = "telegram_manual"
         
         # Enviar al backend
-        success, message = send_expense_to_account(user_id, expense_json)
+        success, message = await asyncio.to_thread(send_expense_to_account, user_id, expense_json)
         
         if success:
             # Formatear respuesta exitosa
@@ -536,6 +542,18 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         )
         return
     
+    # Fotos de un álbum: se agrupan y se procesan juntas con un solo resumen
+    if update.message.media_group_id:
+        album_context = {"user_id": user_id, "apartment_code": selected_apartment,
+                         "account_id": user_data.get("current_account_id")}
+        if album_collector.add(update.message.media_group_id, update.message, album_context):
+            await update.message.reply_text(
+                f"📚 **Recibiendo álbum para {selected_apartment}...**\n"
+                "⏳ Proceso todas las fotos juntas y te envío un resumen.",
+                parse_mode='Markdown'
+            )
+        return
+    
     await update.message.reply_text(
         "📸 **Procesando factura...**\n"
         "⏳ Extrayendo texto con OCR + IA..."
@@ -546,11 +564,10 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         photo = update.message.photo[-1]  # Mejor calidad
         file = await context.bot.get_file(photo.file_id)
         
-        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp_file:
-            await file.download_to_drive(tmp_file.name)
-            
-            # Extraer texto con OCR
-            ocr_text = extract_text_from_image(tmp_file.name)
+        # Descargar a memoria (sin temporal en disco); se libera al salir del with
+        with await spool_telegram_file(file) as upload:
+            # Extraer texto con OCR (en el pool de hilos, sin parar el bot)
+            ocr_text, words = await run_ocr(extract_text_and_words_from_image, upload)
             
             if not ocr_text:
                 await update.message.reply_text(
@@ -563,7 +580,9 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                 return
             
             # Procesar con IA
-            expense_json = extract_expense_json(ocr_text, selected_apartment)
+            expense_json = await extract_expense_json_async(
+                ocr_text, selected_apartment, account_id=user_data.get("current_account_id"), words=words
+            )
             
             if not expense_json:
                 await update.message.reply_text(
@@ -578,7 +597,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             expense_json["source"] = "telegram_ocr"
             
             # Enviar al backend
-            success, message = send_expense_to_account(user_id, expense_json)
+            success, message = await asyncio.to_thread(send_expense_to_account, user_id, expense_json)
             
             if success:
                 # Respuesta exitosa con detalles
@@ -604,12 +623,41 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                     f"📝 **Datos extraídos:**\n{json.dumps(expense_json, indent=2, ensure_ascii=False)}"
                 )
     
+    except UploadTooLarge as e:
+        await update.message.reply_text(f"❌ {e}. Envía una foto más pequeña.")
     except Exception as e:
         logger.error(f"Error procesando imagen: {e}")
         await update.message.reply_text(
             "❌ Error procesando la imagen. Inténtalo de nuevo."
         )
 
+async def process_album(messages, album_context) -> None:
+    """Álbum completo: OCR en paralelo, extracción por lotes y alta en bloque"""
+    apartment_code = album_context["apartment_code"]
+    results = await extract_album_expenses(messages, apartment_code, account_id=album_context["account_id"])
+    
+    pending = [r for r in results if r["expense"]]
+    if pending:
+        items = [dict(r["expense"], apartment_code=apartment_code, source="telegram_ocr") for r in pending]
+        # requests bloqueante (hasta 30 s): en un hilo para no parar el bot
+        success, outcome = await asyncio.to_thread(send_expenses_bulk_to_account, album_context["user_id"], items)
+        if success:
+            errors = {e["index"]: e["errors"] for e in outcome.get("errors", [])}
+            for index, result in enumerate(pending):
+                if index in errors:
+                    result["error"] = "; ".join(errors[index])
+                else:
+                    result["created"] = True
+        else:
+            for result in pending:
+                result["error"] = outcome
+    
+    created = sum(1 for r in results if r.get("created"))
+    logger.info(f"Álbum {apartment_code}: {created}/{len(results)} gastos creados")
+    await messages[0].reply_text(format_album_summary(results, apartment_code), parse_mode='Markdown')
+
+album_collector = AlbumCollector(process_album)
+
 # ---------- CALLBACKS ----------
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
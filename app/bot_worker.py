@@ -0,0 +1,160 @@
+# app/bot_worker.py
+"""
+Bot de Telegram (polling) como proceso aparte del web.
+
+En el proceso web el bot competía por el GIL con las peticiones de la API
+(polling, OCR, reglas, LLM). Aquí corre en su propio proceso y event loop y
+se escala por separado (servicio `worker` en render.yaml):
+
+    python -m app.bot_worker
+
+- Supervisor (proceso padre, ligero): lanza el bot en un proceso hijo y lo
+  reinicia si termina, con backoff exponencial (BOT_RESTART_BACKOFF_SECONDS
+  hasta BOT_RESTART_MAX_BACKOFF_SECONDS; vuelve al mínimo si el hijo
+  aguantó BOT_HEALTHY_SECONDS). SIGTERM/SIGINT se reenvían al hijo.
+- Latido: cada BOT_HEARTBEAT_SECONDS envía su estado a
+  {API_BASE_URL}/bot/heartbeat (X-Internal-Key); /bot/status del web lo
+  muestra. Con el worker desplegado el web lleva BOT_MODE=worker: nunca
+  arranca el bot en un hilo ni configura el webhook, haya latido o no.
+- BOT_WORKER_BOT elige el bot: production (por defecto, con los mismos
+  fallbacks que TelegramBotService), multiuser o expense.
+- PROCESS_ROLE=bot por defecto (pool de BD pequeño, ver app/db.py).
+- BOT_WORKER_NICE (0): prioridad del bot hijo; si comparte máquina con el
+  web, un valor > 0 deja la CPU antes al web (con hilos no se puede).
+
+El polling borra el webhook de Telegram: con este worker no se usa
+/webhook/telegram.
+"""
+from __future__ import annotations
+
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault("PROCESS_ROLE", "bot")
+
+API_BASE_URL = os.getenv("API_BASE_URL", "https://ses-gastos.onrender.com")
+INTERNAL_KEY = os.getenv("INTERNAL_KEY") or os.getenv("ADMIN_KEY")
+BOT_WORKER_BOT = os.getenv("BOT_WORKER_BOT", "production").lower()
+BOT_RESTART_BACKOFF_SECONDS = float(os.getenv("BOT_RESTART_BACKOFF_SECONDS", "2"))
+BOT_RESTART_MAX_BACKOFF_SECONDS = float(os.getenv("BOT_RESTART_MAX_BACKOFF_SECONDS", "60"))
+BOT_HEALTHY_SECONDS = float(os.getenv("BOT_HEALTHY_SECONDS", "60"))
+BOT_HEARTBEAT_SECONDS = float(os.getenv("BOT_HEARTBEAT_SECONDS", "30"))
+BOT_WORKER_NICE = int(os.getenv("BOT_WORKER_NICE", "0"))
+
+
+# ---------- PROCESO HIJO: EL BOT ----------
+
+def run_bot():
+    """Arranca el bot elegido; run_polling crea el event loop de este proceso"""
+    if BOT_WORKER_NICE and hasattr(os, "nice"):
+        os.nice(BOT_WORKER_NICE)
+    if BOT_WORKER_BOT == "multiuser":
+        from .bot.Telegram_multiuser_bot import main as bot_main
+    elif BOT_WORKER_BOT == "expense":
+        from .bot.Telegram_expense_bot import main as bot_main
+    else:
+        try:
+            from .production_bot import main as bot_main
+        except ImportError as e:
+            print(f"[BOT] ⚠️ No se pudo importar bot de producción: {e}")
+            try:
+                from .bot.Telegram_expense_bot import main as bot_main
+            except ImportError as e2:
+                print(f"[BOT] ⚠️ No se pudo importar bot completo: {e2}")
+                from .simple_bot_test import main as bot_main
+    print(f"[BOT] 🤖 Bot '{BOT_WORKER_BOT}' en proceso {os.getpid()} (PROCESS_ROLE={os.environ['PROCESS_ROLE']})")
+    bot_main()
+
+
+# ---------- PROCESO PADRE: SUPERVISOR ----------
+
+class BotSupervisor:
+    def __init__(self, command: list[str] | None = None):
+        self.command = command or [sys.executable, "-m", "app.bot_worker", "--child"]
+        self.child: subprocess.Popen | None = None
+        self.stopping = False
+        self.restarts = 0
+        self.last_exit_code: int | None = None
+        self.started_at = datetime.now(timezone.utc)
+        self.child_started_at: datetime | None = None
+        self._last_heartbeat = 0.0
+
+    def _handle_signal(self, signum, frame):
+        print(f"[BOT] 🛑 Señal {signum}: deteniendo bot")
+        self.stopping = True
+        if self.child and self.child.poll() is None:
+            self.child.send_signal(signal.SIGTERM)
+
+    def status(self) -> dict:
+        alive = bool(self.child and self.child.poll() is None)
+        return {
+            "supervisor_pid": os.getpid(),
+            "bot": BOT_WORKER_BOT,
+            "child_pid": self.child.pid if alive else None,
+            "child_alive": alive,
+            "restarts": self.restarts,
+            "last_exit_code": self.last_exit_code,
+            "started_at": self.started_at.isoformat(),
+            "child_started_at": self.child_started_at.isoformat() if self.child_started_at else None,
+            "heartbeat_seconds": BOT_HEARTBEAT_SECONDS,
+        }
+
+    def heartbeat(self, force: bool = False):
+        if not INTERNAL_KEY or (not force and time.monotonic() - self._last_heartbeat < BOT_HEARTBEAT_SECONDS):
+            return
+        self._last_heartbeat = time.monotonic()
+        try:
+            import httpx
+            httpx.post(f"{API_BASE_URL.rstrip('/')}/bot/heartbeat", json=self.status(),
+                       headers={"X-Internal-Key": INTERNAL_KEY}, timeout=5.0)
+        except Exception as e:
+            print(f"[BOT] ⚠️ Latido no enviado: {e}")
+
+    def _sleep(self, seconds: float):
+        deadline = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < deadline:
+            self.heartbeat()
+            time.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        backoff = BOT_RESTART_BACKOFF_SECONDS
+
+        while not self.stopping:
+            self.child = subprocess.Popen(self.command)
+            if self.stopping:  # señal recibida justo antes de arrancar
+                self.child.send_signal(signal.SIGTERM)
+            self.child_started_at = datetime.now(timezone.utc)
+            started = time.monotonic()
+            print(f"[BOT] 🚀 Bot arrancado (pid {self.child.pid}, reinicios {self.restarts})")
+            self.heartbeat(force=True)
+
+            while self.child.poll() is None:
+                self.heartbeat()
+                time.sleep(1.0)
+
+            self.last_exit_code = self.child.returncode
+            self.heartbeat(force=True)
+            if self.stopping:
+                break
+            if time.monotonic() - started >= BOT_HEALTHY_SECONDS:
+                backoff = BOT_RESTART_BACKOFF_SECONDS
+            print(f"[BOT] ❌ Bot terminado con código {self.last_exit_code}; reinicio en {backoff:.0f}s")
+            self._sleep(backoff)
+            backoff = min(backoff * 2, BOT_RESTART_MAX_BACKOFF_SECONDS)
+            self.restarts += 1
+
+        print("[BOT] ✅ Supervisor detenido")
+        return 0
+
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        run_bot()
+    else:
+        sys.exit(BotSupervisor().run())
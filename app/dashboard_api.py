@@ -11,7 +11,7 @@ from datetime import datetime, date
 import json
 import os
 
-from app.db import get_db
+from app.db import get_db, get_read_db
 from app import models
 from app.schemas import DashboardMonthSummary, DashboardMonthlyResponse
 from app.auth_multiuser import get_current_account, require_member_or_above
@@ -85,7 +85,7 @@ def dashboard_monthly(
     apartment_code: Optional[str] = Query(None, description="Opcional: SES01 para filtrar"),
     current_account: models.Account = Depends(get_current_account),
     membership: models.AccountUser = Depends(require_member_or_above),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     # Resuelve apartment_id si llega apartment_code (SOLO de la cuenta actual)
     apartment_id = None
@@ -233,7 +233,7 @@ def dashboard_content(
     apartment_code: Optional[str] = Query(None, description="Opcional: SES01 para filtrar"),
     current_account: models.Account = Depends(get_current_account),
     membership: models.AccountUser = Depends(require_member_or_above),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     """Serve dashboard content for HTMX updates"""
     try:
@@ -276,7 +276,7 @@ def dashboard_data(
     apartment_code: Optional[str] = Query(None, description="Opcional: SES01 para filtrar"),
     current_account: models.Account = Depends(get_current_account),
     membership: models.AccountUser = Depends(require_member_or_above),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     """Enhanced dashboard data with additional metrics"""
     try:
@@ -306,7 +306,7 @@ def dashboard_data(
 def get_apartments(
     current_account: models.Account = Depends(get_current_account),
     membership: models.AccountUser = Depends(require_member_or_above),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get list of apartments for filter dropdown - SOLO de la cuenta actual"""
     apartments = db.query(models.Apartment).filter(
@@ -323,7 +323,7 @@ def get_recent_expenses(
     apartment_code: Optional[str] = Query(None),
     current_account: models.Account = Depends(get_current_account),
     membership: models.AccountUser = Depends(require_member_or_above),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get recent expenses for the activity feed - SOLO de la cuenta actual"""
     q = db.query(models.Expense).join(models.Apartment).filter(
@@ -404,7 +404,7 @@ def get_summary_stats(
     apartment_code: Optional[str] = Query(None),
     current_account: models.Account = Depends(get_current_account),
     membership: models.AccountUser = Depends(require_member_or_above),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get summary statistics for the dashboard - SOLO de la cuenta actual"""
     
@@ -1,10 +1,14 @@
 # app/db.py
 from __future__ import annotations
+import asyncio
 import os
 import re
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 
 # ------------------------------------------------------------
 # Normalización de DATABASE_URL -> postgresql+psycopg
@@ -17,17 +21,21 @@ DATABASE_URL = (
     "sqlite:///local.db"
 )
 
-print(f"[DB] Intentando con DATABASE_URL desde: {
+_url_source = (
     'DATABASE_URL' if os.getenv('DATABASE_URL') else
-    'DATABASE_PRIVATE_URL' if os.getenv('DATABASE_PRIVATE_URL') else  
+    'DATABASE_PRIVATE_URL' if os.getenv('DATABASE_PRIVATE_URL') else
     'POSTGRES_URL' if os.getenv('POSTGRES_URL') else
     'fallback SQLite'
-}")
+)
+print(f"[DB] Intentando con DATABASE_URL desde: {_url_source}")
 
-# Normalizar URL de PostgreSQL
-if DATABASE_URL and "postgresql" in DATABASE_URL:
+
+def _normalize_pg_url(raw_url: str) -> str:
+    """Normaliza variantes de URL de PostgreSQL al driver psycopg v3"""
+    if not raw_url or "postgres" not in raw_url:
+        return raw_url
     try:
-        url = make_url(DATABASE_URL)
+        url = make_url(raw_url)
         # Corrige variantes comunes
         if url.drivername == "postgres":
             url = url.set(drivername="postgresql+psycopg")
@@ -35,19 +43,29 @@ if DATABASE_URL and "postgresql" in DATABASE_URL:
             url = url.set(drivername="postgresql+psycopg")
         elif url.drivername == "postgresql.psycopg":  # error típico con '.'
             url = url.set(drivername="postgresql+psycopg")
-        DATABASE_URL = str(url)
+        return url.render_as_string(hide_password=False)
     except Exception as url_error:
         print(f"[DB] URL parsing error: {url_error}")
         # Fallback manual
-        if DATABASE_URL.startswith("postgres://"):
-            DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+psycopg://", 1)
-        elif DATABASE_URL.startswith("postgresql.psycopg://"):
-            DATABASE_URL = DATABASE_URL.replace("postgresql.psycopg://", "postgresql+psycopg://", 1)
-        elif DATABASE_URL.startswith("postgresql://"):
-            DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg://", 1)
+        if raw_url.startswith("postgres://"):
+            return raw_url.replace("postgres://", "postgresql+psycopg://", 1)
+        elif raw_url.startswith("postgresql.psycopg://"):
+            return raw_url.replace("postgresql.psycopg://", "postgresql+psycopg://", 1)
+        elif raw_url.startswith("postgresql://"):
+            return raw_url.replace("postgresql://", "postgresql+psycopg://", 1)
+        return raw_url
+
+
+def _mask(url: str) -> str:
+    return re.sub(r"://([^:@]+):[^@]+@", r"://\1:***@", url)
+
+
+# Normalizar URL de PostgreSQL
+if DATABASE_URL and "postgresql" in DATABASE_URL:
+    DATABASE_URL = _normalize_pg_url(DATABASE_URL)
 
 # Logs útiles (sin password)
-masked = re.sub(r"://([^:@]+):[^@]+@", r"://\1:***@", DATABASE_URL)
+masked = _mask(DATABASE_URL)
 print(f"[DB] Using DATABASE_URL = {masked}")
 
 # Versiones (para verificar en Render qué instaló realmente)
@@ -63,6 +81,273 @@ try:
 except Exception as e:
     print(f"[DB] psycopg (v3) not importable: {e}")
 
+# ------------------------------------------------------------
+# Tamaño del pool por rol de proceso (web, bot, worker)
+# ------------------------------------------------------------
+# Cada proceso abre hasta pool_size + max_overflow conexiones; la suma de
+# todos los procesos debe quedar por debajo de max_connections de Postgres.
+POOL_PROFILES = {
+    "web":    {"pool_size": 5, "max_overflow": 10, "pool_timeout": 30},
+    "bot":    {"pool_size": 2, "max_overflow": 3,  "pool_timeout": 30},
+    "worker": {"pool_size": 3, "max_overflow": 5,  "pool_timeout": 60},
+}
+
+PROCESS_ROLE = os.getenv("PROCESS_ROLE", "web").lower()
+if PROCESS_ROLE not in POOL_PROFILES:
+    print(f"[DB] ⚠️ PROCESS_ROLE desconocido '{PROCESS_ROLE}', usando 'web'")
+    PROCESS_ROLE = "web"
+
+
+def _pool_settings() -> dict:
+    """Perfil del rol actual, sobreescribible con DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT"""
+    settings = dict(POOL_PROFILES[PROCESS_ROLE])
+    for env_name, key in (
+        ("DB_POOL_SIZE", "pool_size"),
+        ("DB_MAX_OVERFLOW", "max_overflow"),
+        ("DB_POOL_TIMEOUT", "pool_timeout"),
+    ):
+        value = os.getenv(env_name)
+        if value:
+            try:
+                settings[key] = int(value)
+            except ValueError:
+                print(f"[DB] ⚠️ {env_name}={value!r} no es un entero, se ignora")
+    settings["pool_recycle"] = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    return settings
+
+
+class PoolMetrics:
+    """Contadores de espera al obtener conexiones del pool (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+
+    def record(self, wait_ms: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total_ms / attempts, 3) if attempts else 0.0,
+                "wait_max_ms": round(self.wait_max_ms, 3),
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout por una conexión libre"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            self.metrics.record((time.perf_counter() - start) * 1000, timed_out=True)
+            raise
+        self.metrics.record((time.perf_counter() - start) * 1000)
+        return conn
+
+    def recreate(self):
+        new_pool = super().recreate()
+        new_pool.metrics = self.metrics
+        return new_pool
+
+
+def _create_pg_engine(url: str, application_name: str):
+    settings = _pool_settings()
+    return create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_pre_ping=True,
+        connect_args={
+            "connect_timeout": 10,
+            "application_name": application_name,
+        },
+        echo=False,
+        **settings,
+    )
+
+
+def pool_status(target_engine) -> dict:
+    """Métricas del pool de un engine: conexiones en uso, overflow y esperas"""
+    pool = target_engine.pool
+    status = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+        })
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        status.update(metrics.snapshot())
+    return status
+
+# ------------------------------------------------------------
+# Perfil SQLite (WAL + pragmas + un único escritor por proceso)
+# ------------------------------------------------------------
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))      # 64 MB
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # 256 MB
+SQLITE_WRITE_LOCK_TIMEOUT = float(os.getenv("SQLITE_WRITE_LOCK_TIMEOUT", "30"))
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA foreign_keys=ON")
+    finally:
+        cursor.close()
+
+
+def _create_sqlite_engine(url: str):
+    """Engine SQLite con WAL: los lectores nunca bloquean al escritor ni viceversa"""
+    sqlite_engine = create_engine(
+        url,
+        pool_pre_ping=True,
+        connect_args={
+            "check_same_thread": False,
+            "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+        },
+    )
+    event.listen(sqlite_engine, "connect", _apply_sqlite_pragmas)
+    return sqlite_engine
+
+
+class SQLiteWriteLockTimeout(RuntimeError):
+    """No se obtuvo el turno de escritura a tiempo: la escritura no se hace"""
+
+
+class SQLiteWriteQueue:
+    """
+    Serializa las escrituras de las sesiones ORM del proceso.
+
+    SQLite admite un solo escritor; en vez de que varios hilos compitan por el
+    lock del fichero (y acaben en "database is locked"), cada sesión toma este
+    turno en su primer flush y lo suelta al terminar la transacción. Las
+    lecturas no pasan por aquí, así que con WAL nunca esperan.
+
+    El turno es del hilo, no de la sesión: otra sesión del mismo hilo (la del
+    claim de idempotencia, un SessionLocal() anidado) entra sin esperar en
+    vez de bloquearse contra sí misma (si las dos dejan escrituras sin
+    confirmar, SQLite responde "database is locked" tras busy_timeout). Si el
+    turno tarda más de SQLITE_WRITE_LOCK_TIMEOUT se lanza
+    SQLiteWriteLockTimeout: nunca se escribe sin turno.
+
+    En el hilo del event loop el turno es de la tarea asyncio (todas las
+    corrutinas comparten ese hilo) y no se espera: esperar congelaría el loop
+    y, si el turno lo tiene otra corrutina, no podría soltarlo nunca. Si está
+    ocupado se lanza SQLiteWriteLockTimeout al momento. Por eso las rutas que
+    escriben son síncronas (threadpool) o pasan la escritura a
+    run_in_threadpool.
+    """
+
+    def __init__(self, timeout: float = SQLITE_WRITE_LOCK_TIMEOUT):
+        self._lock = threading.Lock()   # el turno (Lock normal: se puede soltar desde otro hilo)
+        self._state = threading.Lock()  # protege _owner/_holds
+        self._owner: int | None = None  # hilo con el turno
+        self._holds = 0                 # sesiones de ese hilo con escrituras abiertas
+        self.timeout = timeout
+        self.acquired = 0
+        self.reentrant = 0
+        self.lock_timeouts = 0
+        self.loop_rejections = 0
+
+    @staticmethod
+    def _owner_key():
+        """(clave del dueño, True si es el hilo de un event loop)"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:  # sin event loop corriendo en este hilo
+            task = None
+        if task is not None:
+            return ("task", id(task)), True
+        return threading.get_ident(), False
+
+    def _before_flush(self, session, flush_context, instances):
+        self.acquire(session)
+
+    def _before_orm_dml(self, orm_execute_state):
+        # INSERT/UPDATE/DELETE masivos vía session.execute() no pasan por flush
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            self.acquire(orm_execute_state.session)
+
+    def acquire(self, session):
+        """Toma el turno para la sesión (lo hacen flush/DML; a mano si hay que leer y luego escribir)"""
+        if session.info.get("_sqlite_write_lock"):
+            return
+        me, on_loop = self._owner_key()
+        with self._state:
+            if self._owner == me:
+                self._holds += 1
+                self.reentrant += 1
+                session.info["_sqlite_write_lock"] = True
+                return
+        if on_loop:
+            if not self._lock.acquire(blocking=False):
+                self.loop_rejections += 1
+                print("[DB] ❌ Cola de escritura SQLite ocupada: escritura desde el event loop cancelada (usar una ruta síncrona)")
+                raise SQLiteWriteLockTimeout("Turno de escritura SQLite ocupado; no se espera en el event loop")
+        elif not self._lock.acquire(timeout=self.timeout):
+            self.lock_timeouts += 1
+            print(f"[DB] ❌ Cola de escritura SQLite: espera > {self.timeout}s, escritura cancelada")
+            raise SQLiteWriteLockTimeout(f"Sin turno de escritura SQLite tras {self.timeout}s")
+        with self._state:
+            self._owner = me
+            self._holds = 1
+            self.acquired += 1
+        session.info["_sqlite_write_lock"] = True
+
+    def _after_transaction_end(self, session, transaction):
+        # La sesión puede cerrarse en otro hilo (dependencias de FastAPI): se
+        # libera por sesión, sin comprobar qué hilo llama
+        if transaction.parent is None and session.info.pop("_sqlite_write_lock", False):
+            with self._state:
+                self._holds -= 1
+                if self._holds > 0:
+                    return
+                self._owner = None
+            self._lock.release()
+
+    def install(self, session_factory):
+        event.listen(session_factory, "before_flush", self._before_flush)
+        event.listen(session_factory, "do_orm_execute", self._before_orm_dml)
+        event.listen(session_factory, "after_transaction_end", self._after_transaction_end)
+        return self
+
+    def stats(self) -> dict:
+        return {
+            "writes_serialized": self.acquired,
+            "reentrant": self.reentrant,
+            "lock_timeouts": self.lock_timeouts,
+            "loop_rejections": self.loop_rejections,
+            "busy_timeout_ms": SQLITE_BUSY_TIMEOUT_MS,
+        }
+
 # ------------------------------------------------------------
 # Crear engine (solo psycopg v3)
 # ------------------------------------------------------------
@@ -72,24 +357,12 @@ connect_args = {}
 if "postgresql" in DATABASE_URL:
     print("[DB] 🐘 Configurando PostgreSQL...")
     try:
-        # Configuración simplificada para Render PostgreSQL
-        connect_args = {
-            "connect_timeout": 10,
-            "application_name": "ses-gastos"
-        }
-        
-        engine = create_engine(
-            DATABASE_URL, 
-            pool_pre_ping=True, 
-            connect_args=connect_args,
-            pool_timeout=30,
-            pool_recycle=1800,
-            echo=False
-        )
+        # Pool dimensionado según PROCESS_ROLE (ver POOL_PROFILES)
+        engine = _create_pg_engine(DATABASE_URL, f"ses-gastos-{PROCESS_ROLE}")
+        print(f"[DB] 🏊 Pool '{PROCESS_ROLE}': {_pool_settings()}")
         
         # Test de conexión inmediato con reintentos
         from sqlalchemy import text
-        import time
         
         max_retries = 3
         for attempt in range(max_retries):
@@ -130,17 +403,45 @@ if "postgresql" in DATABASE_URL:
             db_dir = "/tmp"  # Fallback si no existe
         
         DATABASE_URL = f"sqlite:///{db_dir}/ses_gastos_persistent.db"
-        engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+        engine = _create_sqlite_engine(DATABASE_URL)
         print(f"[DB] 📁 SQLite persistente: {db_dir}/ses_gastos_persistent.db")
         print("[DB] 💡 Los datos se mantendrán entre despliegues hasta que PostgreSQL funcione")
         print("[DB] 🔧 Para arreglar PostgreSQL, verifica las credenciales en Render Environment")
 else:
     print("[DB] 📁 Usando SQLite (desarrollo)...")
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+    if DATABASE_URL.startswith("sqlite"):
+        engine = _create_sqlite_engine(DATABASE_URL)
+    else:
+        engine = create_engine(DATABASE_URL, pool_pre_ping=True)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+sqlite_write_queue = None
+if engine.dialect.name == "sqlite":
+    sqlite_write_queue = SQLiteWriteQueue().install(SessionLocal)
+    print("[DB] ✍️ SQLite en modo WAL con cola de escritura serializada")
+
+# ------------------------------------------------------------
+# Réplica de solo lectura para reportes (opcional)
+# ------------------------------------------------------------
+DATABASE_READ_URL = _normalize_pg_url(os.getenv("DATABASE_READ_URL", ""))
+read_engine = engine
+
+if DATABASE_READ_URL and "postgresql" in DATABASE_URL:
+    try:
+        read_engine = _create_pg_engine(DATABASE_READ_URL, f"ses-gastos-{PROCESS_ROLE}-ro")
+        with read_engine.connect() as conn:
+            conn.exec_driver_sql("SELECT 1")
+        print(f"[DB] 📖 Réplica de lectura: {_mask(DATABASE_READ_URL)}")
+    except Exception as replica_error:
+        print(f"[DB] ⚠️ Réplica de lectura no disponible, usando primaria: {replica_error}")
+        read_engine = engine
+elif DATABASE_READ_URL:
+    print("[DB] ⚠️ DATABASE_READ_URL ignorada: la primaria no es PostgreSQL")
+
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -148,4 +449,24 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    """Sesión para endpoints de reportes: réplica si está configurada, si no la primaria"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_pool_stats() -> dict:
+    stats = {
+        "process_role": PROCESS_ROLE,
+        "primary": pool_status(engine),
+        "replica": None,
+    }
+    if read_engine is not engine:
+        stats["replica"] = pool_status(read_engine)
+    if sqlite_write_queue is not None:
+        stats["sqlite_write_queue"] = sqlite_write_queue.stats()
+    return stats
+
 
@@ -0,0 +1,353 @@
+# app/idempotency.py
+"""
+Idempotencia reutilizable para rutas POST (cabecera X-Idempotency-Key).
+
+Uso en una ruta:
+
+    idem: IdempotencyGuard = Depends(idempotency)
+    ...
+    if idem.replay is not None:
+        return idem.replay
+    ... crear objetos ...
+    idem.save(db, response)   # se confirma con el commit de la ruta
+    db.commit()
+
+Flujo:
+- La clave se reserva con un INSERT ... ON CONFLICT DO NOTHING (atómico): solo
+  una petición gana; las concurrentes reciben 409 mientras la primera está en
+  curso, y la respuesta guardada una vez terminada.
+- La respuesta se escribe en la misma transacción que los datos de negocio.
+- Si la ruta falla, la reserva se libera para que el cliente pueda reintentar.
+- Delante de la tabla hay una LRU en memoria con las respuestas completadas.
+- Las claves caducan a las IDEMPOTENCY_TTL_HOURS; un hilo las borra por lotes
+  usando el índice de created_at.
+- Cada llamante tiene su propio espacio de claves (usuario y X-Account-ID del
+  token, clave interna o anónimo): la misma X-Idempotency-Key en dos cuentas
+  son dos claves distintas, en la tabla y en la LRU.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from fastapi import Depends, Header, HTTPException, Request
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .db import SessionLocal, get_db
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "2048"))
+IDEMPOTENCY_CLEANUP_BATCH = int(os.getenv("IDEMPOTENCY_CLEANUP_BATCH", "1000"))
+IDEMPOTENCY_CLEANUP_INTERVAL = int(os.getenv("IDEMPOTENCY_CLEANUP_INTERVAL", "3600"))  # 0 = desactivado
+
+# response_json de una clave reservada cuya petición aún no ha terminado
+_PENDING = {"__idempotency__": "pending"}
+
+
+class IdempotencyConflict(Exception):
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite devuelve datetimes naive (guardados en UTC)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_hours: float = IDEMPOTENCY_TTL_HOURS, cache_size: int = IDEMPOTENCY_CACHE_SIZE):
+        self.ttl = timedelta(hours=ttl_hours)
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, tuple[str, dict, datetime]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.db_hits = 0
+        self.purged = 0
+        self._cleanup_thread: threading.Thread | None = None
+
+    def _cutoff(self) -> datetime:
+        return datetime.now(timezone.utc) - self.ttl
+
+    # ---------- LRU ----------
+
+    def _cache_get(self, key: str):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry[2] < self._cutoff():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return entry
+
+    def _cache_put(self, key: str, request_hash: str, response: dict, created_at: datetime):
+        with self._lock:
+            self._cache[key] = (request_hash, response, created_at)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ---------- RESERVA / REPLAY ----------
+
+    def _insert_if_absent(self, db: Session, key: str, request_hash: str) -> bool:
+        values = {
+            "key": key,
+            "request_hash": request_hash,
+            "response_json": _PENDING,
+            "created_at": datetime.now(timezone.utc),
+        }
+        dialect = db.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(models.IdempotencyKey).values(**values).on_conflict_do_nothing(index_elements=["key"])
+            inserted = db.execute(stmt).rowcount == 1
+            db.commit()
+            return inserted
+
+        try:
+            db.add(models.IdempotencyKey(**values))
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+
+    def claim(self, db: Session, key: str, request_hash: str) -> dict | None:
+        """
+        None si esta petición se queda con la clave; la respuesta guardada si
+        ya se completó con el mismo cuerpo. IdempotencyConflict en otro caso.
+        """
+        cached = self._cache_get(key)
+        if cached is not None:
+            if cached[0] != request_hash:
+                raise IdempotencyConflict("Idempotency-Key en uso con otro cuerpo")
+            self.cache_hits += 1
+            return cached[1]
+
+        for _ in range(2):
+            if self._insert_if_absent(db, key, request_hash):
+                return None
+
+            row = db.get(models.IdempotencyKey, key, populate_existing=True)
+            if row is None:
+                continue  # se borró entre medias: reintentar la reserva
+            if _as_utc(row.created_at) < self._cutoff():
+                # Caducada pero aún no purgada: se descarta y se vuelve a reservar
+                db.execute(delete(models.IdempotencyKey).where(
+                    models.IdempotencyKey.key == key,
+                    models.IdempotencyKey.created_at < self._cutoff(),
+                ))
+                db.commit()
+                continue
+            if row.request_hash != request_hash:
+                raise IdempotencyConflict("Idempotency-Key en uso con otro cuerpo")
+            if row.response_json == _PENDING:
+                raise IdempotencyConflict("idempotency_request_in_progress")
+
+            self.db_hits += 1
+            self._cache_put(key, row.request_hash, row.response_json, _as_utc(row.created_at))
+            return row.response_json
+
+        raise IdempotencyConflict("idempotency_request_in_progress")
+
+    def stage_response(self, db: Session, key: str, response: dict):
+        """Guarda la respuesta en la transacción actual de la ruta (sin commit)"""
+        db.execute(
+            update(models.IdempotencyKey)
+            .where(models.IdempotencyKey.key == key)
+            .values(response_json=response)
+        )
+
+    def remember(self, key: str, request_hash: str, response: dict):
+        self._cache_put(key, request_hash, response, datetime.now(timezone.utc))
+
+    def release(self, db: Session, key: str):
+        """Libera una clave reservada cuya petición no terminó bien"""
+        try:
+            db.rollback()
+            # Comparación en Python: el tipo JSON de PostgreSQL no tiene operador '='
+            row = db.get(models.IdempotencyKey, key, populate_existing=True)
+            if row is not None and row.response_json == _PENDING:
+                db.delete(row)
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[IDEMPOTENCY] ⚠️ No se pudo liberar la clave {key}: {e}")
+
+    # ---------- LIMPIEZA ----------
+
+    def purge_expired(self, db: Session, batch_size: int = IDEMPOTENCY_CLEANUP_BATCH) -> int:
+        """Borra claves caducadas por lotes (transacciones cortas, usa ix_idempotency_keys_created_at)"""
+        cutoff = self._cutoff()
+        total = 0
+        while True:
+            keys = db.scalars(
+                select(models.IdempotencyKey.key)
+                .where(models.IdempotencyKey.created_at < cutoff)
+                .limit(batch_size)
+            ).all()
+            if not keys:
+                break
+            db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.key.in_(keys)))
+            db.commit()
+            total += len(keys)
+            if len(keys) < batch_size:
+                break
+        self.purged += total
+        return total
+
+    def start_cleanup_job(self, interval: int = IDEMPOTENCY_CLEANUP_INTERVAL):
+        if interval <= 0 or (self._cleanup_thread and self._cleanup_thread.is_alive()):
+            return
+
+        def _loop():
+            while True:
+                db = SessionLocal()
+                try:
+                    deleted = self.purge_expired(db)
+                    if deleted:
+                        print(f"[IDEMPOTENCY] 🧹 {deleted} claves caducadas eliminadas")
+                except Exception as e:
+                    db.rollback()
+                    print(f"[IDEMPOTENCY] ❌ Error limpiando claves: {e}")
+                finally:
+                    db.close()
+                time.sleep(interval)
+
+        self._cleanup_thread = threading.Thread(target=_loop, name="idempotency-cleanup", daemon=True)
+        self._cleanup_thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            cached = len(self._cache)
+        return {
+            "ttl_hours": self.ttl.total_seconds() / 3600,
+            "cache_entries": cached,
+            "cache_size": self.cache_size,
+            "cache_hits": self.cache_hits,
+            "db_hits": self.db_hits,
+            "purged": self.purged,
+        }
+
+
+idempotency_store = IdempotencyStore()
+
+
+# ---------- DEPENDENCIA FASTAPI ----------
+
+class IdempotencyGuard:
+    def __init__(self, key: str | None, request_hash: str | None, replay: dict | None = None):
+        self.key = key
+        self.request_hash = request_hash
+        self.replay = replay
+        self.response: dict | None = None
+
+    @property
+    def owns_key(self) -> bool:
+        return self.key is not None and self.replay is None
+
+    def save(self, db: Session, response) -> None:
+        if not self.owns_key:
+            return
+        from fastapi.encoders import jsonable_encoder
+        self.response = jsonable_encoder(response)
+        idempotency_store.stage_response(db, self.key, self.response)
+
+
+async def request_fingerprint(request: Request) -> str:
+    """Hash de método + ruta + cuerpo (JSON canonicalizado si se puede)"""
+    body = await request.body()
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode()
+    except ValueError:
+        pass
+    digest = hashlib.sha256(f"{request.method} {request.url.path}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def _token_subject(token: str, secret: str, algorithm: str) -> str | None:
+    import jwt
+    try:
+        return jwt.decode(token, secret, algorithms=[algorithm]).get("sub")
+    except jwt.PyJWTError:
+        return None
+
+
+def idempotency_scope(request: Request) -> str:
+    """
+    Espacio de nombres de la clave según quién llama. Solo se usan
+    credenciales con firma válida; la ruta sigue haciendo su propia
+    autenticación.
+    """
+    from .auth_multiuser import ALGORITHM, SECRET_KEY
+
+    authorization = request.headers.get("Authorization", "")
+    if authorization[:7].lower() == "bearer ":
+        user_id = _token_subject(authorization[7:].strip(), SECRET_KEY, ALGORITHM)
+        if user_id:
+            return f"user:{user_id}/account:{request.headers.get('X-Account-ID') or '-'}"
+    cookie = request.cookies.get("access_token")
+    if cookie:
+        email = _token_subject(cookie, SECRET_KEY, ALGORITHM)
+        if email:
+            return f"web:{email}"
+    if request.headers.get("X-Internal-Key"):
+        return "internal"
+    return "anon"
+
+
+def _scoped_key(scope: str, key: str) -> str:
+    if len(scope) > 64:  # emails largos: cabe siempre en la columna (255)
+        scope = "h:" + hashlib.sha256(scope.encode()).hexdigest()[:40]
+    return f"{scope}:{key}"
+
+
+def idempotency(
+    request: Request,
+    x_idempotency_key: str | None = Header(default=None, alias="X-Idempotency-Key"),
+    fingerprint: str = Depends(request_fingerprint),
+    db: Session = Depends(get_db),
+):
+    if not x_idempotency_key:
+        yield IdempotencyGuard(None, None)
+        return
+    if len(x_idempotency_key) > 128:
+        raise HTTPException(status_code=400, detail="idempotency_key_too_long")
+
+    key = _scoped_key(idempotency_scope(request), x_idempotency_key)
+    try:
+        replay = idempotency_store.claim(db, key, fingerprint)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=e.detail)
+
+    guard = IdempotencyGuard(key, fingerprint, replay)
+    if not guard.owns_key:
+        yield guard
+        return
+
+    try:
+        yield guard
+    except Exception:
+        idempotency_store.release(db, guard.key)
+        raise
+
+    if guard.response is None:
+        idempotency_store.release(db, guard.key)
+        return
+    # Por si la ruta no hizo commit tras save() (no-op si ya lo hizo)
+    db.commit()
+    idempotency_store.remember(guard.key, guard.request_hash, guard.response)
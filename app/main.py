@@ -1,7 +1,7 @@
 # app/main.py
 import os
-from fastapi import FastAPI, Depends
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi import FastAPI, Depends, Header, HTTPException
+from fastapi.responses import RedirectResponse, HTMLResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 
@@ -9,6 +9,8 @@ from sqlalchemy.orm import Session
 from . import models  # noqa
 
 from .db import Base, engine, get_db
+from .metrics import MetricsMiddleware, metrics_registry
+from .services.uploads import UploadLimitMiddleware, configure_multipart_spool
 
 # Importaciones básicas primero - importar individualmente para evitar fallos en cadena
 auth = None
@@ -25,6 +27,8 @@ vectors = None
 management = None
 fix_incomes = None
 real_time_api = None
+export = None
+availability = None
 
 try:
     from .routers import auth
@@ -128,6 +132,18 @@ try:
 except Exception as e:
     print(f"[import] ❌ Error en real_time_api router: {e}")
 
+try:
+    from .routers import export
+    print("[import] ✅ Export router importado")
+except Exception as e:
+    print(f"[import] ❌ Error en export router: {e}")
+
+try:
+    from .routers import availability
+    print("[import] ✅ Availability router importado")
+except Exception as e:
+    print(f"[import] ❌ Error en availability router: {e}")
+
 # Importar admin_management por separado para evitar errores
 try:
     from .routers import admin_management
@@ -155,6 +171,13 @@ except Exception as e:
 
 app = FastAPI(title="SES.GASTOS")
 
+# Subidas multipart: 413 por encima de UPLOAD_MAX_BYTES antes de parsear el cuerpo
+configure_multipart_spool()
+app.add_middleware(UploadLimitMiddleware)
+
+# Tiempos por ruta y contadores de SQL por petición (/metrics, /debug/sql-stats)
+app.add_middleware(MetricsMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -555,6 +578,17 @@ def on_startup() -> None:
         print("[startup] ✅ Tablas creadas/verificadas")
     except Exception as e:
         print(f"[startup] ❌ Error creando tablas: {e}")
+
+    # Columna del token del feed iCal en BDs creadas antes de existir
+    try:
+        from sqlalchemy import inspect, text
+        columns = {c["name"] for c in inspect(engine).get_columns("apartments")}
+        if "calendar_token" not in columns:
+            with engine.begin() as conn:
+                conn.execute(text("ALTER TABLE apartments ADD COLUMN calendar_token VARCHAR(64)"))
+            print("[startup] ✅ Columna apartments.calendar_token añadida")
+    except Exception as e:
+        print(f"[startup] ❌ Error añadiendo calendar_token: {e}")
     
     # Inicializar apartamentos básicos si no existen
     try:
@@ -674,6 +708,14 @@ def on_startup() -> None:
     except Exception as e:
         print(f"[startup] Error initializing apartments: {e}")
     
+    # Purga periódica de claves de idempotencia caducadas
+    try:
+        from .idempotency import idempotency_store
+        idempotency_store.start_cleanup_job()
+        print("[startup] ✅ Limpieza de claves de idempotencia programada")
+    except Exception as e:
+        print(f"[startup] ❌ Error programando limpieza de idempotencia: {e}")
+    
     # Iniciar bot de Telegram (temporalmente deshabilitado por problemas de threading)
     try:
         # from .telegram_bot_service import telegram_service
@@ -686,6 +728,39 @@ def on_startup() -> None:
     except Exception as e:
         print(f"[startup] ❌ Error iniciando Telegram bot: {e}")
 
+@app.on_event("startup")
+async def start_outbox_dispatcher() -> None:
+    # Entrega de eventos del outbox (se puede desactivar y correr aparte con python -m app.services.outbox)
+    if os.getenv("OUTBOX_DISPATCHER", "1") != "1":
+        print("[startup] ⚠️ Dispatcher del outbox desactivado (OUTBOX_DISPATCHER != 1)")
+        return
+    try:
+        from .services.outbox import outbox_dispatcher
+        await outbox_dispatcher.start()
+        print("[startup] ✅ Dispatcher del outbox iniciado")
+    except Exception as e:
+        print(f"[startup] ❌ Error iniciando dispatcher del outbox: {e}")
+
+@app.on_event("shutdown")
+async def stop_outbox_dispatcher() -> None:
+    try:
+        from .services.outbox import outbox_dispatcher
+        await outbox_dispatcher.stop()
+    except Exception as e:
+        print(f"[shutdown] Error deteniendo dispatcher del outbox: {e}")
+
+@app.on_event("shutdown")
+async def drain_webhook_queue() -> None:
+    # Updates ya confirmados a Telegram: no los reenviará, así que se terminan antes de salir
+    try:
+        from .webhook_bot import update_queue
+        drained = await update_queue.join(timeout=float(os.getenv("WEBHOOK_DRAIN_SECONDS", "20")))
+        await update_queue.stop()
+        if not drained:
+            print(f"[shutdown] ⚠️ Cola del webhook sin vaciar: {update_queue.stats()}")
+    except Exception as e:
+        print(f"[shutdown] Error vaciando cola del webhook: {e}")
+
 @app.on_event("shutdown")
 def on_shutdown() -> None:
     try:
@@ -1347,6 +1422,37 @@ def test_postgres_direct():
             "message": "❌ Error conectando a PostgreSQL"
         }
 
+def require_admin_key(
+    key: str | None = None,
+    x_internal_key: str | None = Header(default=None, alias="X-Internal-Key"),
+):
+    """Endpoints de diagnóstico: ADMIN_KEY en ?key= o X-Internal-Key, como /admin/*"""
+    admin_key = os.getenv("ADMIN_KEY") or ""
+    if not admin_key or (key or x_internal_key or "") != admin_key:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.get("/debug/db-pool", dependencies=[Depends(require_admin_key)])
+def db_pool_status():
+    """Métricas del pool de conexiones (primaria y réplica) para dimensionar max_connections"""
+    from app.db import get_pool_stats
+    return get_pool_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False, dependencies=[Depends(require_admin_key)])
+def prometheus_metrics():
+    """Histogramas por ruta (duración, sentencias SQL, tiempo de SQL) en formato Prometheus"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/sql-stats", dependencies=[Depends(require_admin_key)])
+def sql_stats():
+    """Rutas ordenadas por tiempo de SQL, con media de sentencias y la más lenta"""
+    return {"routes": metrics_registry.route_summary()}
+
+@app.get("/debug/outbox", dependencies=[Depends(require_admin_key)])
+def outbox_status():
+    """Estado del outbox de eventos (pendientes, enviados, fallidos) y del dispatcher"""
+    from app.services.outbox import outbox_dispatcher
+    return outbox_dispatcher.stats()
+
 @app.get("/db-status")
 def db_status():
     """Check database connection status"""
@@ -1651,6 +1757,20 @@ if real_time_api:
     except Exception as e:
         print(f"[router] ❌ Error incluyendo real_time_api: {e}")
 
+if export:
+    try:
+        app.include_router(export.router)
+        print("[router] ✅ Export router incluido")
+    except Exception as e:
+        print(f"[router] ❌ Error incluyendo export: {e}")
+
+if availability:
+    try:
+        app.include_router(availability.router)
+        print("[router] ✅ Availability router incluido")
+    except Exception as e:
+        print(f"[router] ❌ Error incluyendo availability: {e}")
+
 if ADMIN_MANAGEMENT_AVAILABLE:
     try:
         app.include_router(admin_management.router)
@@ -1837,11 +1957,27 @@ def bot_status():
     except Exception as e:
         return {"error": str(e), "bot_running": False}
 
+@app.post("/bot/heartbeat")
+def bot_worker_heartbeat(payload: dict, x_internal_key: str | None = Header(default=None, alias="X-Internal-Key")):
+    """Latido del proceso bot_worker (python -m app.bot_worker)"""
+    expected = os.getenv("INTERNAL_KEY") or os.getenv("ADMIN_KEY")
+    if not expected or x_internal_key != expected:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    from .telegram_bot_service import telegram_service
+    telegram_service.record_worker_heartbeat(payload)
+    return {"ok": True}
+
 @app.post("/bot/restart")
 def restart_bot():
     """Reiniciar el bot de Telegram"""
     try:
-        from .telegram_bot_service import telegram_service
+        from .telegram_bot_service import bot_mode, telegram_service
+        if bot_mode() == "worker":
+            return {"success": False, "error": "bot_mode_worker",
+                    "message": "BOT_MODE=worker: el bot corre en el servicio bot_worker, reinícialo desde allí"}
+        if telegram_service.worker_alive():
+            return {"success": False, "error": "bot_running_in_worker",
+                    "message": "El bot corre en el proceso bot_worker: reinícialo desde su servicio"}
         telegram_service.stop_bot()
         import time
         time.sleep(3)  # Esperar más tiempo antes de reiniciar
@@ -2608,6 +2744,7 @@ def migrate_render_fix():
                 "ALTER TABLE apartments ADD COLUMN IF NOT EXISTS bathrooms INTEGER",
                 "ALTER TABLE apartments ADD COLUMN IF NOT EXISTS account_id VARCHAR(36)",
                 "ALTER TABLE apartments ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE",
+                "ALTER TABLE apartments ADD COLUMN IF NOT EXISTS calendar_token VARCHAR(64)",
                 
                 "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_superadmin BOOLEAN DEFAULT FALSE",
                 "ALTER TABLE users ADD COLUMN IF NOT EXISTS phone VARCHAR(50)",
@@ -2938,7 +3075,7 @@ async def debug_multitenancy():
         return {"success": False, "error": str(e)}
 
 @app.post("/fix-multitenancy")
-async def fix_multitenancy():
+def fix_multitenancy():
     """Arreglar problemas de multitenancy automáticamente"""
     try:
         from .db import SessionLocal
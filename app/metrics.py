@@ -0,0 +1,277 @@
+# app/metrics.py
+"""
+Instrumentación de peticiones y SQL.
+
+- MetricsMiddleware (ASGI) mide cada petición y la etiqueta con la plantilla
+  de la ruta (/api/v1/incomes/{income_id}), no con la URL real.
+- Los hooks before/after_cursor_execute de SQLAlchemy cuentan sentencias y
+  tiempo de SQL de la petición en curso (ContextVar, vale para rutas sync en
+  el threadpool) y guardan la sentencia más lenta.
+- Todo se acumula en histogramas en memoria del proceso y se publica en
+  formato Prometheus en /metrics; /debug/sql-stats da el resumen por ruta.
+- Las sentencias por encima de SLOW_QUERY_MS pasan a app/slow_queries.py.
+- La pasarela LLM registra duración y tokens de cada llamada, y la
+  extracción de gastos los tokens del texto OCR antes y después de condensarlo.
+- METRICS_DEBUG_HEADERS=1 añade X-SQL-Queries y X-SQL-Time-Ms a cada
+  respuesta para ver los N+1 al momento en desarrollo.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+
+from .slow_queries import slow_query_log
+
+METRICS_DEBUG_HEADERS = os.getenv("METRICS_DEBUG_HEADERS", "0").lower() in ("1", "true", "yes")
+METRICS_STATEMENT_MAX_CHARS = int(os.getenv("METRICS_STATEMENT_MAX_CHARS", "500"))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+TOKEN_BUCKETS = (50, 100, 200, 400, 800, 1600, 3200, 6400, 12800)
+
+
+class Histogram:
+    """Histograma acumulativo estilo Prometheus por combinación de etiquetas"""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...], buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series: dict[tuple, list] = {}  # etiquetas -> [conteos por bucket, suma, total]
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(s[0]), s[1], s[2]) for labels, s in self._series.items()]
+        for labels, counts, total, count in sorted(snapshot):
+            base = _labels(zip(self.label_names, labels))
+            for bound, value in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(zip(self.label_names, labels), le=_fmt(bound))} {value}")
+            lines.append(f"{self.name}_bucket{_labels(zip(self.label_names, labels), le='+Inf')} {count}")
+            lines.append(f"{self.name}_sum{base} {_fmt(total)}")
+            lines.append(f"{self.name}_count{base} {count}")
+        return lines
+
+
+def _fmt(value: float) -> str:
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs, **extra) -> str:
+    items = [*pairs, *extra.items()]
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in items) + "}"
+
+
+class RequestStats:
+    __slots__ = ("scope", "queries", "sql_seconds", "slowest_seconds", "slowest_statement")
+
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement: str | None = None
+
+
+_current_request: ContextVar[RequestStats | None] = ContextVar("metrics_current_request", default=None)
+
+
+def current_request_stats() -> RequestStats | None:
+    return _current_request.get()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        labels = ("method", "route")
+        self.request_seconds = Histogram(
+            "http_request_duration_seconds", "Duración de las peticiones HTTP", labels + ("status",), DURATION_BUCKETS)
+        self.request_queries = Histogram(
+            "http_request_sql_queries", "Sentencias SQL por petición", labels, QUERY_COUNT_BUCKETS)
+        self.request_sql_seconds = Histogram(
+            "http_request_sql_seconds", "Tiempo total de SQL por petición", labels, DURATION_BUCKETS)
+        self.llm_seconds = Histogram(
+            "llm_call_duration_seconds", "Duración de las llamadas al proveedor LLM", ("kind", "model"), DURATION_BUCKETS)
+        self.llm_prompt_tokens = Histogram(
+            "llm_prompt_tokens", "Tokens de entrada (estimados) por llamada LLM", ("kind", "model"), TOKEN_BUCKETS)
+        self.llm_completion_tokens = Histogram(
+            "llm_completion_tokens", "Tokens de salida (estimados) por llamada LLM", ("kind", "model"), TOKEN_BUCKETS)
+        self.llm_ocr_tokens = Histogram(
+            "llm_ocr_text_tokens", "Tokens del texto OCR antes (raw) y después (condensed) de condensarlo",
+            ("stage",), TOKEN_BUCKETS)
+        self._lock = threading.Lock()
+        self._slowest: dict[tuple, tuple[float, str]] = {}
+        self.sql_statements_total = 0
+        self.sql_seconds_total = 0.0
+        self.started_at = time.time()
+
+    def record_statement(self, seconds: float):
+        with self._lock:
+            self.sql_statements_total += 1
+            self.sql_seconds_total += seconds
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        key = (method, route)
+        self.request_seconds.observe(key + (str(status),), seconds)
+        self.request_queries.observe(key, stats.queries)
+        self.request_sql_seconds.observe(key, stats.sql_seconds)
+        if stats.slowest_statement is not None:
+            with self._lock:
+                previous = self._slowest.get(key)
+                if previous is None or stats.slowest_seconds > previous[0]:
+                    self._slowest[key] = (stats.slowest_seconds, stats.slowest_statement)
+
+    def record_llm_call(self, kind: str, model: str, seconds: float, prompt_tokens: int, completion_tokens: int):
+        self.llm_seconds.observe((kind, model), seconds)
+        self.llm_prompt_tokens.observe((kind, model), prompt_tokens)
+        if kind == "complete":
+            self.llm_completion_tokens.observe((kind, model), completion_tokens)
+
+    def record_ocr_condensation(self, raw_tokens: int, condensed_tokens: int):
+        self.llm_ocr_tokens.observe(("raw",), raw_tokens)
+        self.llm_ocr_tokens.observe(("condensed",), condensed_tokens)
+
+    def render(self) -> str:
+        lines = []
+        for histogram in (self.request_seconds, self.request_queries, self.request_sql_seconds,
+                          self.llm_seconds, self.llm_prompt_tokens, self.llm_completion_tokens, self.llm_ocr_tokens):
+            lines += histogram.render()
+        with self._lock:
+            slowest = sorted(self._slowest.items())
+            statements, sql_seconds = self.sql_statements_total, self.sql_seconds_total
+        lines += ["# HELP http_route_slowest_sql_seconds Sentencia SQL más lenta vista en la ruta",
+                  "# TYPE http_route_slowest_sql_seconds gauge"]
+        for (method, route), (seconds, _) in slowest:
+            lines.append(f"http_route_slowest_sql_seconds{_labels([('method', method), ('route', route)])} {seconds!r}")
+        lines += ["# HELP sql_statements_total Sentencias SQL ejecutadas por el proceso",
+                  "# TYPE sql_statements_total counter",
+                  f"sql_statements_total {statements}",
+                  "# HELP sql_seconds_total Tiempo total en SQL del proceso",
+                  "# TYPE sql_seconds_total counter",
+                  f"sql_seconds_total {sql_seconds!r}",
+                  "# HELP process_start_time_seconds Arranque del proceso (epoch)",
+                  "# TYPE process_start_time_seconds gauge",
+                  f"process_start_time_seconds {self.started_at!r}"]
+        return "\n".join(lines) + "\n"
+
+    def route_summary(self) -> list[dict]:
+        """Resumen por ruta ordenado por tiempo de SQL (para /debug/sql-stats)"""
+        with self.request_queries._lock:
+            queries = {k: (s[1], s[2]) for k, s in self.request_queries._series.items()}
+        with self.request_sql_seconds._lock:
+            sql = {k: s[1] for k, s in self.request_sql_seconds._series.items()}
+        with self._lock:
+            slowest = dict(self._slowest)
+        items = []
+        for key, (total_queries, count) in queries.items():
+            seconds, statement = slowest.get(key, (0.0, None))
+            items.append({
+                "method": key[0],
+                "route": key[1],
+                "requests": count,
+                "avg_queries": round(total_queries / count, 2) if count else 0,
+                "avg_sql_ms": round(sql.get(key, 0.0) * 1000 / count, 3) if count else 0,
+                "slowest_sql_ms": round(seconds * 1000, 3),
+                "slowest_statement": statement,
+            })
+        items.sort(key=lambda i: i["avg_sql_ms"] * i["requests"], reverse=True)
+        return items
+
+
+metrics_registry = MetricsRegistry()
+
+
+# ---------- HOOKS SQLALCHEMY (todos los engines) ----------
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_metrics_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("_metrics_query_start")
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+    metrics_registry.record_statement(seconds)
+    stats = _current_request.get()
+    if seconds * 1000 >= slow_query_log.threshold_ms:
+        route = f"{stats.scope['method']} {_route_template(stats.scope)}" if stats is not None and stats.scope else None
+        slow_query_log.observe(conn, statement, parameters, executemany, seconds, route)
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.sql_seconds += seconds
+    if seconds > stats.slowest_seconds:
+        stats.slowest_seconds = seconds
+        stats.slowest_statement = " ".join(statement.split())[:METRICS_STATEMENT_MAX_CHARS]
+
+
+# ---------- MIDDLEWARE ----------
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    # Sin ruta (404, estáticos...): una sola etiqueta para no disparar la cardinalidad
+    return "<unmatched>"
+
+
+class MetricsMiddleware:
+    def __init__(self, app, debug_headers: bool = METRICS_DEBUG_HEADERS):
+        self.app = app
+        self.debug_headers = debug_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.debug_headers:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("X-SQL-Queries", str(stats.queries))
+                    headers.append("X-SQL-Time-Ms", f"{stats.sql_seconds * 1000:.1f}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            _current_request.reset(token)
+            metrics_registry.record_request(
+                scope["method"], _route_template(scope), status, time.perf_counter() - start, stats
+            )
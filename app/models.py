@@ -1,12 +1,13 @@
 # app/models.py
 from __future__ import annotations
 
+import secrets
 import uuid
 from datetime import datetime, timezone
 
 from sqlalchemy import (
     Column, String, Integer, Date, DateTime, Boolean,
-    ForeignKey, Numeric, JSON, func
+    ForeignKey, Numeric, JSON, Index, func
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID as PGUUID
@@ -55,7 +56,7 @@ class Reservation(Base):
 # ---------- IDEMPOTENCIA ----------
 class IdempotencyKey(Base):
     __tablename__ = "idempotency_keys"
-    key           = Column(String(128), primary_key=True)
+    key           = Column(String(255), primary_key=True)  # "<ámbito>:<X-Idempotency-Key>"
     request_hash  = Column(String(64), nullable=False)
     response_json = Column(JSON, nullable=False)
     created_at    = Column(
@@ -65,7 +66,52 @@ class IdempotencyKey(Base):
         server_default=func.now(),
     )
 
+    # Índice para la purga por TTL (ver app/idempotency.py)
+    __table_args__ = (
+        Index("ix_idempotency_keys_created_at", "created_at"),
+    )
+
+# ---------- OUTBOX DE EVENTOS ----------
+class OutboxEvent(Base):
+    """
+    Evento pendiente de enviar a un sistema externo (p.ej. SES.HOSPEDAJES).
+    Se escribe en la misma transacción que el dato que lo origina y lo envía
+    el dispatcher de app/services/outbox.py.
+    """
+    __tablename__ = "outbox_events"
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    event_type = Column(String(64), nullable=False)   # reservation.created
+    endpoint   = Column(String(64), nullable=False)   # destino, para limitar concurrencia
+    payload    = Column(JSON, nullable=False)
+    idempotency_key = Column(String(128), nullable=True)
+
+    status   = Column(String(20), nullable=False, default="PENDING")  # PENDING | PROCESSING | SENT | FAILED
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+    )
+    last_error = Column(String(1000), nullable=True)
+
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+    )
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_outbox_events_status_next_attempt", "status", "next_attempt_at"),
+    )
+
 # ---------- APARTAMENTOS ----------
+def new_calendar_token() -> str:
+    return secrets.token_urlsafe(24)
+
+
 class Apartment(Base):
     __tablename__ = "apartments"
 
@@ -85,6 +131,9 @@ class Apartment(Base):
     
     # Estado y configuración
     is_active = Column(Boolean, default=True)
+
+    # Secreto de la URL del feed iCal (/api/v1/apartments/{id}/calendar.ics?token=...)
+    calendar_token = Column(String(64), nullable=True, default=new_calendar_token)
     
     # Campos legacy (mantener por compatibilidad)
     owner_email = Column(String(255), nullable=True)
@@ -108,7 +157,10 @@ class Apartment(Base):
     user = relationship("User", foreign_keys=[user_id])
 
     # Constraint único: código único dentro de cada cuenta
+    # Índices para paginación por keyset (created_at + id)
     __table_args__ = (
+        Index("ix_apartments_account_created_at_id", "account_id", "created_at", "id"),
+        Index("ix_apartments_created_at_id", "created_at", "id"),
         {"extend_existing": True},
     )
 
@@ -144,6 +196,13 @@ class Expense(Base):
 
     apartment = relationship("Apartment", back_populates="expenses")
 
+    # Índices para paginación por keyset (fecha/created_at + id)
+    __table_args__ = (
+        Index("ix_expenses_apartment_date_id", "apartment_id", "date", "id"),
+        Index("ix_expenses_date_id", "date", "id"),
+        Index("ix_expenses_created_at_id", "created_at", "id"),
+    )
+
 # ---------- INGRESOS ----------
 class Income(Base):
     __tablename__ = "incomes"
@@ -190,6 +249,13 @@ class Income(Base):
     apartment = relationship("Apartment", back_populates="incomes")
     reservation = relationship("Reservation")
 
+    # Índices para paginación por keyset (fecha/created_at + id)
+    __table_args__ = (
+        Index("ix_incomes_apartment_date_id", "apartment_id", "date", "id"),
+        Index("ix_incomes_date_id", "date", "id"),
+        Index("ix_incomes_created_at_id", "created_at", "id"),
+    )
+
 
 # ---------- CUENTAS DE ANFITRIÓN (TENANTS) ----------
 class Account(Base):
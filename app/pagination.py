@@ -0,0 +1,108 @@
+# app/pagination.py
+"""
+Paginación por keyset (cursor) para los endpoints de listado.
+
+En vez de OFFSET, cada página continúa a partir de la última fila devuelta
+usando (columna_de_orden, id), así que la página 1000 cuesta lo mismo que la
+primera siempre que exista un índice sobre esas columnas. El cursor es opaco
+para el cliente: base64 de la clave de orden y los valores de la última fila.
+"""
+from __future__ import annotations
+
+import base64
+import json
+import uuid
+from datetime import date, datetime
+from typing import Any, Optional
+
+from fastapi import HTTPException, Response
+from sqlalchemy import literal, tuple_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _serialize(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _deserialize(value: Any, column) -> Any:
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    if python_type is uuid.UUID:
+        return uuid.UUID(value)
+    return value
+
+
+def encode_cursor(key: str, values: list) -> str:
+    payload = json.dumps({"k": key, "v": [_serialize(v) for v in values]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, key: str, columns: list) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if data.get("k") != key or len(data.get("v", [])) != len(columns):
+            raise ValueError("cursor de otro listado")
+        return [_deserialize(v, col) for v, col in zip(data["v"], columns)]
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid_cursor")
+
+
+def keyset_paginate(
+    query,
+    sort_column,
+    id_column,
+    *,
+    limit: int,
+    cursor: Optional[str] = None,
+    descending: bool = True,
+) -> tuple[list, Optional[str]]:
+    """
+    Aplica orden + filtro keyset a una Query ORM y devuelve (filas, next_cursor).
+    next_cursor es None cuando no quedan más filas.
+    """
+    key = f"{sort_column.key}:{id_column.key}"
+    columns = [sort_column, id_column]
+
+    if cursor:
+        last_sort, last_id = decode_cursor(cursor, key, columns)
+        position = tuple_(sort_column, id_column)
+        boundary = tuple_(literal(last_sort, sort_column.type), literal(last_id, id_column.type))
+        if descending:
+            query = query.filter(position < boundary)
+        else:
+            query = query.filter(position > boundary)
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(key, [getattr(last, sort_column.key), getattr(last, id_column.key)])
+    return rows, next_cursor
+
+
+def set_next_cursor_header(response: Response, next_cursor: Optional[str]) -> None:
+    """Para endpoints que devuelven una lista plana: el cursor viaja en cabecera"""
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
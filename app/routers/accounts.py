@@ -10,7 +10,7 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import and_, func, desc
 
-from ..db import get_db
+from ..db import get_db, get_read_db
 from ..models import Account, User, AccountUser, Apartment, Expense, Income
 from ..schemas import (
     AccountCreate, AccountUpdate, AccountOut, 
@@ -29,7 +29,7 @@ router = APIRouter(prefix="/api/v1/accounts", tags=["Cuentas"])
 # ---------- GESTIÓN DE CUENTAS ----------
 
 @router.post("/", response_model=AccountOut)
-async def create_account(
+def create_account(
     account_data: AccountCreate,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -77,7 +77,7 @@ async def create_account(
     return account_out
 
 @router.get("/", response_model=List[AccountOut])
-async def list_accounts(
+def list_accounts(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
     include_stats: bool = Query(False, description="Incluir estadísticas de apartamentos y usuarios")
@@ -120,7 +120,7 @@ async def list_accounts(
     return result
 
 @router.get("/{account_id}", response_model=AccountOut)
-async def get_account(
+def get_account(
     account_id: str,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -164,7 +164,7 @@ async def get_account(
     return account_out
 
 @router.patch("/{account_id}", response_model=AccountOut)
-async def update_account(
+def update_account(
     account_id: str,
     account_data: AccountUpdate,
     membership: AccountUser = Depends(require_admin_or_owner),
@@ -198,7 +198,7 @@ async def update_account(
     return AccountOut.from_orm(account)
 
 @router.delete("/{account_id}")
-async def delete_account(
+def delete_account(
     account_id: str,
     membership: AccountUser = Depends(require_owner),
     db: Session = Depends(get_db)
@@ -234,7 +234,7 @@ async def delete_account(
 # ---------- GESTIÓN DE USUARIOS EN CUENTAS ----------
 
 @router.get("/{account_id}/users", response_model=List[AccountUserOut])
-async def list_account_users(
+def list_account_users(
     account_id: str,
     membership: AccountUser = Depends(require_member_or_above),
     db: Session = Depends(get_db)
@@ -259,7 +259,7 @@ async def list_account_users(
     return result
 
 @router.post("/{account_id}/users", response_model=AccountUserOut)
-async def invite_user_to_account(
+def invite_user_to_account(
     account_id: str,
     user_data: AccountUserCreate,
     membership: AccountUser = Depends(require_admin_or_owner),
@@ -310,7 +310,7 @@ async def invite_user_to_account(
     return membership_out
 
 @router.patch("/{account_id}/users/{user_id}", response_model=AccountUserOut)
-async def update_user_role(
+def update_user_role(
     account_id: str,
     user_id: str,
     user_data: AccountUserUpdate,
@@ -350,7 +350,7 @@ async def update_user_role(
     return AccountUserOut.from_orm(target_membership)
 
 @router.delete("/{account_id}/users/{user_id}")
-async def remove_user_from_account(
+def remove_user_from_account(
     account_id: str,
     user_id: str,
     membership: AccountUser = Depends(require_admin_or_owner),
@@ -395,10 +395,10 @@ async def remove_user_from_account(
 # ---------- ESTADÍSTICAS DE CUENTA ----------
 
 @router.get("/{account_id}/stats")
-async def get_account_stats(
+def get_account_stats(
     account_id: str,
     membership: AccountUser = Depends(require_member_or_above),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Obtener estadísticas de la cuenta"""
     # Contar apartamentos
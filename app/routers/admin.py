@@ -152,6 +152,24 @@ def migrate(
         # 4) re-crear FK incomes -> reservations
         try_exec(conn, "ALTER TABLE incomes ADD CONSTRAINT incomes_reservation_id_fkey FOREIGN KEY (reservation_id) REFERENCES reservations(id) ON DELETE CASCADE")
 
+        # ---------- ÍNDICES PARA PAGINACIÓN POR CURSOR ----------
+        try_exec(conn, "CREATE INDEX IF NOT EXISTS ix_expenses_apartment_date_id ON expenses (apartment_id, date, id)")
+        try_exec(conn, "CREATE INDEX IF NOT EXISTS ix_expenses_date_id ON expenses (date, id)")
+        try_exec(conn, "CREATE INDEX IF NOT EXISTS ix_expenses_created_at_id ON expenses (created_at, id)")
+        try_exec(conn, "CREATE INDEX IF NOT EXISTS ix_incomes_apartment_date_id ON incomes (apartment_id, date, id)")
+        try_exec(conn, "CREATE INDEX IF NOT EXISTS ix_incomes_date_id ON incomes (date, id)")
+        try_exec(conn, "CREATE INDEX IF NOT EXISTS ix_incomes_created_at_id ON incomes (created_at, id)")
+        try_exec(conn, "CREATE INDEX IF NOT EXISTS ix_apartments_account_created_at_id ON apartments (account_id, created_at, id)")
+        try_exec(conn, "CREATE INDEX IF NOT EXISTS ix_apartments_created_at_id ON apartments (created_at, id)")
+
+        # ---------- TOKEN DEL FEED iCAL ----------
+        try_exec(conn, "ALTER TABLE apartments ADD COLUMN IF NOT EXISTS calendar_token VARCHAR(64)")
+
+        # ---------- IDEMPOTENCIA: ÍNDICE PARA PURGA POR TTL ----------
+        try_exec(conn, "CREATE INDEX IF NOT EXISTS ix_idempotency_keys_created_at ON idempotency_keys (created_at)")
+        # Claves con ámbito por cuenta/usuario ("<ámbito>:<clave>")
+        try_exec(conn, "ALTER TABLE idempotency_keys ALTER COLUMN key TYPE VARCHAR(255)")
+
     # Inspecciones
     with engine.begin() as conn:
         cols_exp = conn.execute(text("""
@@ -254,6 +272,61 @@ async def exec_sql(
 
     return {"ok": True, "executed": executed, "errors": errors}
 
+# ---------- CONSULTAS LENTAS ----------
+
+@router.get("/slow-queries")
+def list_slow_queries(
+    limit: int = Query(default=50, ge=1, le=500),
+    key: str | None = None,
+    x_internal_key: str | None = Header(default=None, alias="X-Internal-Key"),
+):
+    """Últimas sentencias por encima de SLOW_QUERY_MS (más recientes primero)"""
+    _require_admin(key, x_internal_key)
+    from ..slow_queries import slow_query_log
+    return {**slow_query_log.stats(), "queries": slow_query_log.list(limit)}
+
+@router.post("/slow-queries/{query_id}/explain")
+def explain_slow_query(
+    query_id: int,
+    analyze: bool = Query(default=True),
+    key: str | None = None,
+    x_internal_key: str | None = Header(default=None, alias="X-Internal-Key"),
+):
+    """
+    Plan de una consulta capturada con sus parámetros originales:
+    EXPLAIN (ANALYZE, BUFFERS) en PostgreSQL (solo lecturas) y
+    EXPLAIN QUERY PLAN en SQLite. Siempre dentro de una transacción que se deshace.
+    """
+    _require_admin(key, x_internal_key)
+    from ..slow_queries import explain, slow_query_log
+    entry = slow_query_log.get(query_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="slow_query_not_found")
+    try:
+        return explain(entry, analyze=analyze)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"explain_failed: {e.__class__.__name__}: {e}")
+
+@router.delete("/slow-queries")
+def clear_slow_queries(
+    key: str | None = None,
+    x_internal_key: str | None = Header(default=None, alias="X-Internal-Key"),
+):
+    _require_admin(key, x_internal_key)
+    from ..slow_queries import slow_query_log
+    slow_query_log.clear()
+    return {"ok": True}
+
+@router.get("/llm-usage")
+def llm_usage(
+    key: str | None = None,
+    x_internal_key: str | None = Header(default=None, alias="X-Internal-Key"),
+):
+    """Estado de la pasarela LLM: llamadas en vuelo, esperas por rate limit y consumo por cuenta"""
+    _require_admin(key, x_internal_key)
+    from ..services.llm_gateway import llm_gateway
+    return llm_gateway.stats()
+
 @router.get("/apartments", response_class=HTMLResponse)
 def admin_apartments_page(request: Request):
     """Panel de administración de apartamentos"""
@@ -8,12 +8,15 @@ from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, F
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
 from typing import Optional
 from datetime import date, datetime
 
 from ..db import get_db
 from .. import models, schemas
+from ..services.stats import stats_engine
+from ..pagination import MAX_PAGE_SIZE, keyset_paginate
+
+ADMIN_PAGE_SIZE = 100
 
 # Initialize templates
 templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), "..", "templates"))
@@ -37,18 +40,27 @@ def admin_management_home(request: Request):
     return templates.TemplateResponse("admin_management.html", {"request": request})
 
 @router.get("/apartments", response_class=HTMLResponse)
-def apartments_management_page(request: Request, db: Session = Depends(get_db)):
+def apartments_management_page(
+    request: Request,
+    cursor: Optional[str] = Query(None),
+    db: Session = Depends(get_db)
+):
     """Página de gestión de apartamentos"""
-    apartments = db.query(models.Apartment).order_by(desc(models.Apartment.created_at)).all()
+    apartments, next_cursor = keyset_paginate(
+        db.query(models.Apartment), models.Apartment.created_at, models.Apartment.id,
+        limit=ADMIN_PAGE_SIZE, cursor=cursor
+    )
     return templates.TemplateResponse("admin_apartments_management.html", {
         "request": request,
-        "apartments": apartments
+        "apartments": apartments,
+        "next_cursor": next_cursor
     })
 
 @router.get("/expenses", response_class=HTMLResponse)
 def expenses_management_page(
     request: Request, 
     apartment_id: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None),
     db: Session = Depends(get_db)
 ):
     """Página de gestión de gastos"""
@@ -60,7 +72,9 @@ def expenses_management_page(
     if apartment_id:
         expenses_query = expenses_query.filter(models.Expense.apartment_id == apartment_id)
     
-    expenses = expenses_query.order_by(desc(models.Expense.date)).limit(100).all()
+    expenses, next_cursor = keyset_paginate(
+        expenses_query, models.Expense.date, models.Expense.id, limit=ADMIN_PAGE_SIZE, cursor=cursor
+    )
     
     # Obtener apartamento seleccionado
     selected_apartment = None
@@ -72,7 +86,8 @@ def expenses_management_page(
         "expenses": expenses,
         "apartments": apartments,
         "selected_apartment": selected_apartment,
-        "apartment_id": apartment_id
+        "apartment_id": apartment_id,
+        "next_cursor": next_cursor
     })
 
 @router.get("/incomes", response_class=HTMLResponse)
@@ -80,6 +95,7 @@ def incomes_management_page(
     request: Request,
     apartment_id: Optional[str] = Query(None),
     status: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None),
     db: Session = Depends(get_db)
 ):
     """Página de gestión de ingresos"""
@@ -93,7 +109,9 @@ def incomes_management_page(
     if status:
         incomes_query = incomes_query.filter(models.Income.status == status)
     
-    incomes = incomes_query.order_by(desc(models.Income.date)).limit(100).all()
+    incomes, next_cursor = keyset_paginate(
+        incomes_query, models.Income.date, models.Income.id, limit=ADMIN_PAGE_SIZE, cursor=cursor
+    )
     
     # Obtener apartamento seleccionado
     selected_apartment = None
@@ -106,15 +124,23 @@ def incomes_management_page(
         "apartments": apartments,
         "selected_apartment": selected_apartment,
         "apartment_id": apartment_id,
-        "status": status
+        "status": status,
+        "next_cursor": next_cursor
     })
 
 # ============ API ENDPOINTS PARA ADMINISTRACIÓN ============
 
 @router.get("/api/apartments")
-def api_list_apartments(db: Session = Depends(get_db), _: None = Depends(require_admin_key)):
+def api_list_apartments(
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(ADMIN_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    _: None = Depends(require_admin_key)
+):
     """API: Listar apartamentos para administración"""
-    apartments = db.query(models.Apartment).order_by(desc(models.Apartment.created_at)).all()
+    apartments, next_cursor = keyset_paginate(
+        db.query(models.Apartment), models.Apartment.created_at, models.Apartment.id, limit=limit, cursor=cursor
+    )
     return {
         "apartments": [
             {
@@ -127,7 +153,8 @@ def api_list_apartments(db: Session = Depends(get_db), _: None = Depends(require
             }
             for apt in apartments
         ],
-        "total": len(apartments)
+        "total": len(apartments),
+        "next_cursor": next_cursor
     }
 
 @router.post("/api/apartments")
@@ -455,41 +482,24 @@ def api_update_income_status(
 @router.get("/api/stats")
 def api_admin_stats(db: Session = Depends(get_db), _: None = Depends(require_admin_key)):
     """API: Estadísticas rápidas para el panel de admin"""
-    
-    # Contar totales
-    total_apartments = db.query(models.Apartment).count()
-    active_apartments = db.query(models.Apartment).filter(models.Apartment.is_active == True).count()
-    total_expenses = db.query(models.Expense).count()
-    total_incomes = db.query(models.Income).count()
-    
-    # Sumas del mes actual
-    current_month = datetime.now().replace(day=1).date()
-    monthly_expenses = db.query(models.Expense).filter(models.Expense.date >= current_month).all()
-    monthly_incomes = db.query(models.Income).filter(models.Income.date >= current_month).all()
-    
-    monthly_expenses_sum = sum(float(exp.amount_gross) for exp in monthly_expenses)
-    monthly_incomes_sum = sum(float(inc.amount_gross) for inc in monthly_incomes if inc.status != "CANCELLED")
-    
-    # Ingresos por estado
-    pending_incomes = db.query(models.Income).filter(models.Income.status == "PENDING").count()
-    confirmed_incomes = db.query(models.Income).filter(models.Income.status == "CONFIRMED").count()
+    stats = stats_engine.get(db)
     
     return {
         "totals": {
-            "apartments": total_apartments,
-            "active_apartments": active_apartments,
-            "expenses": total_expenses,
-            "incomes": total_incomes
+            "apartments": stats["apartments_total"],
+            "active_apartments": stats["apartments_active"],
+            "expenses": stats["expenses_total"],
+            "incomes": stats["incomes_total"]
         },
         "monthly": {
-            "expenses_sum": monthly_expenses_sum,
-            "incomes_sum": monthly_incomes_sum,
-            "net": monthly_incomes_sum - monthly_expenses_sum,
-            "expenses_count": len(monthly_expenses),
-            "incomes_count": len(monthly_incomes)
+            "expenses_sum": stats["expenses_month_sum"],
+            "incomes_sum": stats["incomes_month_sum"],
+            "net": stats["incomes_month_sum"] - stats["expenses_month_sum"],
+            "expenses_count": stats["expenses_month_count"],
+            "incomes_count": stats["incomes_month_count"]
         },
         "incomes_by_status": {
-            "pending": pending_incomes,
-            "confirmed": confirmed_incomes
+            "pending": stats["incomes_pending"],
+            "confirmed": stats["incomes_confirmed"]
         }
     }
\ No newline at end of file
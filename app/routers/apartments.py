@@ -2,14 +2,17 @@
 from __future__ import annotations
 
 import os
+import uuid
 from typing import List, Optional
-from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import and_, func
+from sqlalchemy import and_, func, insert, select
 
 from ..db import get_db
 from .. import models, schemas
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_paginate, set_next_cursor_header
+from ..services.calendar import calendar_cache
 from ..auth_multiuser import (
     get_current_user, get_current_account, require_member_or_above,
     require_admin_or_owner, require_superadmin, filter_apartments_by_account
@@ -86,6 +89,21 @@ def create_apartment_in_account(
 
 # ---------- LEGACY ENDPOINT (MANTENER COMPATIBILIDAD) ----------
 
+def _get_or_create_default_account(db: Session) -> models.Account:
+    """Cuenta 'sistema' donde caen los apartamentos creados por endpoints legacy"""
+    default_account = db.query(models.Account).filter(models.Account.slug == "sistema").first()
+    if not default_account:
+        default_account = models.Account(
+            name="Sistema",
+            slug="sistema",
+            description="Cuenta por defecto para apartamentos legacy",
+            max_apartments=1000
+        )
+        db.add(default_account)
+        db.flush()
+    return default_account
+
+
 @router.post("", response_model=schemas.ApartmentOut, dependencies=[Depends(require_internal_key)])
 def create_apartment_legacy(payload: schemas.ApartmentCreate, db: Session = Depends(get_db)):
     """LEGACY: Crear apartamento sin cuenta (solo para superadmin)"""
@@ -97,17 +115,7 @@ def create_apartment_legacy(payload: schemas.ApartmentCreate, db: Session = Depe
         raise HTTPException(status_code=409, detail="apartment_code_already_exists")
 
     # Buscar cuenta por defecto o crear una
-    default_account = db.query(models.Account).filter(models.Account.slug == "sistema").first()
-    if not default_account:
-        from ..auth_multiuser import create_account_slug, ensure_unique_slug
-        default_account = models.Account(
-            name="Sistema",
-            slug="sistema",
-            description="Cuenta por defecto para apartamentos legacy",
-            max_apartments=1000
-        )
-        db.add(default_account)
-        db.flush()
+    default_account = _get_or_create_default_account(db)
 
     apt = models.Apartment(
         code=payload.code.strip(),
@@ -135,10 +143,13 @@ def create_apartment_legacy(payload: schemas.ApartmentCreate, db: Session = Depe
 
 @router.get("/", response_model=List[schemas.ApartmentOut])
 def list_apartments_in_account(
+    response: Response,
     current_account: models.Account = Depends(get_current_account),
     membership: models.AccountUser = Depends(require_member_or_above),
     db: Session = Depends(get_db),
-    active_only: bool = Query(True, description="Solo apartamentos activos")
+    active_only: bool = Query(True, description="Solo apartamentos activos"),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = Query(default=None, description="Valor de X-Next-Cursor de la página anterior"),
 ):
     """Listar apartamentos de la cuenta actual"""
     query = db.query(models.Apartment).filter(
@@ -148,16 +159,27 @@ def list_apartments_in_account(
     if active_only:
         query = query.filter(models.Apartment.is_active == True)
     
-    query = query.order_by(models.Apartment.created_at.desc())
-    return query.all()
+    rows, next_cursor = keyset_paginate(
+        query, models.Apartment.created_at, models.Apartment.id, limit=limit, cursor=cursor
+    )
+    set_next_cursor_header(response, next_cursor)
+    return rows
 
 # ---------- LEGACY ENDPOINT ----------
 
 @router.get("", response_model=list[schemas.ApartmentOut])
-def list_apartments_legacy(db: Session = Depends(get_db)):
+def list_apartments_legacy(
+    response: Response,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = Query(default=None, description="Valor de X-Next-Cursor de la página anterior"),
+    db: Session = Depends(get_db),
+):
     """LEGACY: Listar todos los apartamentos (solo para compatibilidad)"""
-    q = db.query(models.Apartment).order_by(models.Apartment.created_at.desc())
-    return q.all()
+    rows, next_cursor = keyset_paginate(
+        db.query(models.Apartment), models.Apartment.created_at, models.Apartment.id, limit=limit, cursor=cursor
+    )
+    set_next_cursor_header(response, next_cursor)
+    return rows
 
 # ---------- OBTENER APARTAMENTO ----------
 
@@ -217,6 +239,78 @@ def get_apartment_legacy(apartment_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="apartment_not_found")
     return apt
 
+@router.get("/{apartment_id}/calendar.ics")
+def get_apartment_calendar(
+    apartment_id: str,
+    token: str | None = Query(default=None, description="calendar_token del apartamento"),
+    if_none_match: str | None = Header(default=None, alias="If-None-Match"),
+    if_modified_since: str | None = Header(default=None, alias="If-Modified-Since"),
+):
+    """
+    Calendario iCal del apartamento (reservas y estancias de ingresos).
+    La URL lleva el calendar_token del apartamento (ver /id/{id}/calendar-url);
+    sin él, o si no coincide, 404 igual que si no existiera.
+    Sin sesión de BD: el feed sale de calendar_cache y los sondeos sin cambios
+    reciben 304.
+    """
+    feed = calendar_cache.get(apartment_id)
+    if feed is None or not feed.token_matches(token):
+        raise HTTPException(status_code=404, detail="apartment_not_found")
+
+    headers = {
+        "ETag": feed.etag,
+        "Last-Modified": feed.last_modified_http,
+        "Cache-Control": "private, max-age=0, must-revalidate",
+    }
+    if feed.not_modified(if_none_match, if_modified_since):
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f'inline; filename="{apartment_id}.ics"'
+    return Response(content=feed.body, media_type="text/calendar; charset=utf-8", headers=headers)
+
+def _calendar_url_out(request: Request, apt: models.Apartment) -> dict:
+    url = request.url_for("get_apartment_calendar", apartment_id=apt.id).include_query_params(token=apt.calendar_token)
+    return {"apartment_id": apt.id, "code": apt.code, "url": str(url)}
+
+def _apartment_in_account(db: Session, apartment_id: str, account_id: str) -> models.Apartment:
+    apt = db.query(models.Apartment).filter(
+        and_(
+            models.Apartment.id == apartment_id,
+            models.Apartment.account_id == account_id
+        )
+    ).first()
+    if not apt:
+        raise HTTPException(status_code=404, detail="apartment_not_found")
+    return apt
+
+@router.get("/id/{apartment_id}/calendar-url")
+def get_apartment_calendar_url(
+    apartment_id: str,
+    request: Request,
+    current_account: models.Account = Depends(get_current_account),
+    membership: models.AccountUser = Depends(require_member_or_above),
+    db: Session = Depends(get_db)
+):
+    """URL secreta del feed iCal para pegarla en el channel manager (genera el token si falta)"""
+    apt = _apartment_in_account(db, apartment_id, current_account.id)
+    if not apt.calendar_token:
+        apt.calendar_token = models.new_calendar_token()
+        db.commit()
+    return _calendar_url_out(request, apt)
+
+@router.post("/id/{apartment_id}/calendar-url/rotate")
+def rotate_apartment_calendar_url(
+    apartment_id: str,
+    request: Request,
+    current_account: models.Account = Depends(get_current_account),
+    membership: models.AccountUser = Depends(require_admin_or_owner),
+    db: Session = Depends(get_db)
+):
+    """Nuevo token: la URL anterior deja de funcionar al momento"""
+    apt = _apartment_in_account(db, apartment_id, current_account.id)
+    apt.calendar_token = models.new_calendar_token()
+    db.commit()
+    return _calendar_url_out(request, apt)
+
 # ---------- ACTUALIZAR APARTAMENTO ----------
 
 @router.patch("/id/{apartment_id}", response_model=schemas.ApartmentOut)
@@ -345,46 +439,81 @@ def delete_apartment_legacy(apartment_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"delete_failed: {e}")
 
 @router.post("/bulk", dependencies=[Depends(require_internal_key)])
-def create_bulk_apartments(apartments: list[schemas.ApartmentCreate], db: Session = Depends(get_db)):
-    """Crear múltiples apartamentos de una vez"""
-    created_apartments = []
+def create_bulk_apartments(
+    apartments: list[schemas.ApartmentCreate],
+    account_id: str | None = Query(None, description="Cuenta destino (por defecto la cuenta 'sistema')"),
+    db: Session = Depends(get_db),
+):
+    """Crear múltiples apartamentos de una vez (una consulta de códigos + un INSERT en bloque)"""
+    if account_id:
+        account = db.query(models.Account).filter(models.Account.id == account_id).first()
+        if not account:
+            raise HTTPException(status_code=404, detail="account_not_found")
+    else:
+        account = _get_or_create_default_account(db)
+
     errors = []
-    
+    pending = {}
     for apt_data in apartments:
-        try:
-            # Verificar si ya existe
-            existing = db.query(models.Apartment).filter(models.Apartment.code == apt_data.code).first()
-            if existing:
-                errors.append(f"Apartamento {apt_data.code} ya existe")
-                continue
-            
-            apt = models.Apartment(
-                code=apt_data.code,
-                name=apt_data.name,
-                owner_email=apt_data.owner_email,
-                is_active=apt_data.is_active
+        code = apt_data.code.strip()
+        if not code:
+            errors.append("Código de apartamento vacío")
+        elif code in pending:
+            errors.append(f"Apartamento {code} repetido en la petición")
+        else:
+            pending[code] = apt_data
+
+    # Códigos ya existentes en la cuenta: una sola consulta IN
+    if pending:
+        existing_codes = set(db.scalars(
+            select(models.Apartment.code).where(
+                models.Apartment.account_id == account.id,
+                models.Apartment.code.in_(list(pending)),
             )
-            db.add(apt)
-            db.flush()  # Para obtener el ID
-            created_apartments.append({
-                "id": apt.id,
-                "code": apt.code,
-                "name": apt.name
-            })
-        except Exception as e:
-            errors.append(f"Error creando {apt_data.code}: {str(e)}")
-    
+        ))
+        for code in existing_codes:
+            errors.append(f"Apartamento {code} ya existe")
+            del pending[code]
+
+    # Límite del plan, comprobado una vez para todo el lote
+    current_count = db.query(func.count(models.Apartment.id)).filter(
+        models.Apartment.account_id == account.id
+    ).scalar()
+    available = (account.max_apartments or 0) - current_count
+    if len(pending) > available:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Límite de apartamentos alcanzado ({account.max_apartments}): "
+                   f"quedan {max(available, 0)}, se piden {len(pending)}"
+        )
+
+    records = [
+        {
+            "id": str(uuid.uuid4()),
+            "code": code,
+            "name": (apt_data.name or "").strip() or None,
+            "owner_email": apt_data.owner_email or None,
+            "account_id": account.id,
+            "is_active": True,
+        }
+        for code, apt_data in pending.items()
+    ]
+
     try:
+        if records:
+            db.execute(insert(models.Apartment), records)
         db.commit()
-        return {
-            "success": True,
-            "created": len(created_apartments),
-            "apartments": created_apartments,
-            "errors": errors
-        }
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="apartment_code_already_exists")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"bulk_create_failed: {e}")
 
-
-
+    return {
+        "success": True,
+        "account_id": account.id,
+        "created": len(records),
+        "apartments": [{"id": r["id"], "code": r["code"], "name": r["name"]} for r in records],
+        "errors": errors
+    }
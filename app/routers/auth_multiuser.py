@@ -28,7 +28,7 @@ router = APIRouter(prefix="/api/v1/auth", tags=["Autenticación"])
 # ---------- REGISTRO ----------
 
 @router.post("/register", response_model=LoginResponse)
-async def register_user_with_account(
+def register_user_with_account(
     user_data: RegisterRequest,
     db: Session = Depends(get_db)
 ):
@@ -113,7 +113,7 @@ async def register_user_with_account(
 # ---------- LOGIN ----------
 
 @router.post("/login", response_model=LoginResponse)
-async def login_user(
+def login_user(
     user_data: LoginRequest,
     db: Session = Depends(get_db)
 ):
@@ -158,7 +158,7 @@ async def login_user(
 # ---------- LOGIN CON FORM (COMPATIBILIDAD) ----------
 
 @router.post("/token", response_model=LoginResponse)
-async def login_for_access_token(
+def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
@@ -195,7 +195,7 @@ async def login_for_access_token(
 # ---------- INFORMACIÓN DEL USUARIO ACTUAL ----------
 
 @router.get("/me", response_model=LoginResponse)
-async def get_current_user_info(
+def get_current_user_info(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -221,7 +221,7 @@ async def get_current_user_info(
 # ---------- CAMBIO DE CUENTA ----------
 
 @router.post("/switch-account/{account_id}")
-async def switch_account(
+def switch_account(
     account_id: str,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -257,7 +257,7 @@ async def switch_account(
 # ---------- LOGOUT ----------
 
 @router.post("/logout")
-async def logout_user(
+def logout_user(
     current_user: User = Depends(get_current_user)
 ):
     """Logout del usuario (invalidar token del lado del cliente)"""
@@ -269,7 +269,7 @@ async def logout_user(
 # ---------- REGISTRO RÁPIDO PARA DEMO ----------
 
 @router.post("/quick-register")
-async def quick_register(
+def quick_register(
     email: str = Form(...),
     full_name: str = Form(...),
     account_name: str = Form(...),
@@ -0,0 +1,62 @@
+# app/routers/availability.py
+from __future__ import annotations
+
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+from ..db import get_read_db
+from .. import models
+from ..auth_multiuser import get_current_account, require_member_or_above
+from ..services.availability import availability_engine
+
+router = APIRouter(prefix="/api/v1/availability", tags=["availability"])
+
+
+@router.get("/occupancy")
+def get_occupancy(
+    year: int = Query(default_factory=lambda: date.today().year, ge=2000, le=2100),
+    current_account: models.Account = Depends(get_current_account),
+    membership: models.AccountUser = Depends(require_member_or_above),
+    db: Session = Depends(get_read_db),
+):
+    """Ocupación, ADR y RevPAR por apartamento y mes de todo el portfolio de la cuenta"""
+    apartments = db.query(models.Apartment).filter(
+        models.Apartment.account_id == current_account.id
+    ).order_by(models.Apartment.code).all()
+    return availability_engine.occupancy_report(db, apartments, year)
+
+
+@router.get("/{apartment_code}")
+def check_availability(
+    apartment_code: str,
+    check_in: date = Query(...),
+    check_out: date = Query(...),
+    current_account: models.Account = Depends(get_current_account),
+    membership: models.AccountUser = Depends(require_member_or_above),
+    db: Session = Depends(get_read_db),
+):
+    """¿Está libre el apartamento entre check_in y check_out (noche de salida excluida)?"""
+    if check_out <= check_in:
+        raise HTTPException(status_code=400, detail="check_out_must_be_after_check_in")
+
+    apt = db.query(models.Apartment).filter(
+        and_(
+            models.Apartment.code == apartment_code,
+            models.Apartment.account_id == current_account.id
+        )
+    ).first()
+    if not apt:
+        raise HTTPException(status_code=404, detail="apartment_not_found_in_account")
+
+    conflicts = availability_engine.conflicts(db, apt.id, check_in, check_out)
+    return {
+        "apartment_id": apt.id,
+        "code": apt.code,
+        "check_in": check_in.isoformat(),
+        "check_out": check_out.isoformat(),
+        "available": not conflicts,
+        "conflicts": conflicts,
+    }
@@ -4,29 +4,35 @@ Chat integrado con IA para gestión de gastos
 """
 from __future__ import annotations
 
-import os
-import tempfile
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
 
 from ..db import get_db
 from .. import models
 from ..auth_multiuser import get_current_account, require_member_or_above
+from ..services.llm_gateway import LLMBudgetExceeded
 
 # Importar utilidades del bot
 try:
-    from ..bot.Llm_Untils import extract_expense_json
-    from ..bot.Ocr_untils import extract_text_from_image
+    from ..bot.Llm_Untils import extract_expense_json_async
+    from ..bot.Ocr_untils import extract_text_from_image, extract_text_and_words_from_image, run_ocr
     from ..bot.Multiuser_Utils import get_apartment_by_code
 except ImportError:
     # Fallbacks si no están disponibles
-    def extract_expense_json(text: str, apartment_code: str) -> dict:
+    async def extract_expense_json_async(text: str, apartment_code: str, account_id: str | None = None) -> dict:
         return {}
     
     def extract_text_from_image(image_path: str) -> str:
         return ""
+
+    def extract_text_and_words_from_image(image_path: str) -> tuple:
+        return "", []
+
+    async def run_ocr(func, *args):
+        return func(*args)
     
     def get_apartment_by_code(user_id: int, apartment_code: str) -> Optional[dict]:
         return None
@@ -123,22 +129,23 @@ async def chat_file(
                 "action": "apartment_not_found"
             }
         
-        # Guardar archivo temporalmente
-        file_suffix = ".pdf" if is_pdf else ".jpg"
-        with tempfile.NamedTemporaryFile(suffix=file_suffix, delete=False) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file.flush()
-            
-            # Extraer texto con OCR (funciona para imágenes y PDFs)
+        # UploadLimitMiddleware ya rechazó lo que pasa de UPLOAD_MAX_BYTES antes
+        # de parsear; el fichero que guardó Starlette (en memoria hasta
+        # UPLOAD_SPOOL_BYTES) va directo al OCR y se libera al salir del with
+        upload = file.file
+
+        with upload:
+            # Extraer texto con OCR (funciona para imágenes y PDFs) en el pool
+            # de hilos del OCR: en el event loop pararía todas las peticiones
+            words = None
             if is_pdf:
                 try:
                     from ..bot.Ocr_untils import extract_text_from_pdf
-                    ocr_text = extract_text_from_pdf(tmp_file.name)
+                    ocr_text = await run_ocr(extract_text_from_pdf, upload)
                 except ImportError:
-                    ocr_text = extract_text_from_image(tmp_file.name)  # Fallback
+                    ocr_text = await run_ocr(extract_text_from_image, upload)  # Fallback
             else:
-                ocr_text = extract_text_from_image(tmp_file.name)
+                ocr_text, words = await run_ocr(extract_text_and_words_from_image, upload)
             
             if not ocr_text:
                 file_type = "PDF" if is_pdf else "imagen"
@@ -148,7 +155,10 @@ async def chat_file(
                 }
             
             # Procesar con IA
-            expense_data = extract_expense_json(ocr_text, apartment.code)
+            # Devolver la conexión al pool mientras se espera al LLM (segundos)
+            account_id, code = current_account.id, apartment.code
+            db.rollback()
+            expense_data = await extract_expense_json_async(ocr_text, code, account_id=account_id, words=words)
             
             if not expense_data or not expense_data.get("amount_gross"):
                 file_type = "PDF" if is_pdf else "imagen"
@@ -177,13 +187,12 @@ async def chat_file(
                     "response": f"❌ **Error registrando gasto:** {response_message}",
                     "action": "creation_failed"
                 }
-        
-        # Limpiar archivo temporal
-        try:
-            os.unlink(tmp_file.name)
-        except:
-            pass
             
+    except LLMBudgetExceeded as e:
+        return {
+            "response": f"⛔ {e}. Vuelve a intentarlo mañana o registra el gasto manualmente.",
+            "action": "llm_budget_exceeded"
+        }
     except Exception as e:
         return {
             "response": f"❌ Error procesando imagen: {str(e)}",
@@ -268,7 +277,10 @@ async def handle_expense_creation(
     
     try:
         # Usar IA para extraer datos del mensaje
-        expense_data = extract_expense_json(message, apartment.code)
+        # Devolver la conexión al pool mientras se espera al LLM (segundos)
+        account_id, code = current_account.id, apartment.code
+        db.rollback()
+        expense_data = await extract_expense_json_async(message, code, account_id=account_id)
         
         if not expense_data or not expense_data.get("amount_gross"):
             return {
@@ -314,6 +326,11 @@ El gasto ya aparece en tu dashboard 📊""",
                 "action": "creation_failed"
             }
             
+    except LLMBudgetExceeded as e:
+        return {
+            "response": f"⛔ {e}. Vuelve a intentarlo mañana o registra el gasto manualmente.",
+            "action": "llm_budget_exceeded"
+        }
     except Exception as e:
         return {
             "response": f"❌ Error procesando el gasto: {str(e)}",
@@ -471,12 +488,17 @@ async def create_expense_from_data(
             status=expense_data.get("status", "PENDING")
         )
         
-        db.add(expense)
-        db.commit()
-        db.refresh(expense)
+        # La escritura va al threadpool: en el event loop la cola de escritura
+        # de SQLite no puede esperar turno (ver SQLiteWriteQueue)
+        def _save():
+            db.add(expense)
+            db.commit()
+            db.refresh(expense)
+
+        await run_in_threadpool(_save)
         
         return True, "Gasto creado exitosamente"
         
     except Exception as e:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         return False, str(e)
\ No newline at end of file
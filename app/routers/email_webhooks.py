@@ -7,12 +7,14 @@ from datetime import datetime
 from typing import Dict, Any
 
 from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
-from ..db import get_db
+from ..db import SessionLocal, get_db
 from ..services.email_reservation_processor import EmailReservationProcessor
 from ..auth import get_current_admin_user, get_current_user_optional
+from ..idempotency import IdempotencyGuard, idempotency
 from .. import models, schemas
 
 router = APIRouter(prefix="/webhooks/email", tags=["email_webhooks"])
@@ -22,7 +24,8 @@ router = APIRouter(prefix="/webhooks/email", tags=["email_webhooks"])
 async def receive_reservation_email(
     request: Request,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    idem: IdempotencyGuard = Depends(idempotency),
 ):
     """
     Endpoint para recibir emails de reservas desde servicios como SendGrid, Mailgun, etc.
@@ -37,6 +40,9 @@ async def receive_reservation_email(
         "timestamp": "2024-01-15T10:30:00Z"
     }
     """
+    if idem.replay is not None:
+        return idem.replay
+
     try:
         # Obtener datos del webhook
         webhook_data = await request.json()
@@ -64,16 +70,15 @@ async def receive_reservation_email(
             sender,
             subject,
             message_id,
-            db
         )
         
-        return JSONResponse(
-            status_code=200,
-            content={
-                "message": "Email received and queued for processing",
-                "message_id": message_id
-            }
-        )
+        content = {
+            "message": "Email received and queued for processing",
+            "message_id": message_id
+        }
+        # Escritura en el threadpool (la cola de escritura SQLite no espera en el loop)
+        await run_in_threadpool(idem.save, db, content)
+        return JSONResponse(status_code=200, content=content)
         
     except Exception as e:
         return JSONResponse(
@@ -86,7 +91,8 @@ async def receive_reservation_email(
 async def process_manual_email(
     email_data: Dict[str, Any],
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user_optional)
+    current_user: models.User = Depends(get_current_user_optional),
+    idem: IdempotencyGuard = Depends(idempotency),
 ):
     """
     Endpoint para procesar emails manualmente (para testing o casos especiales)
@@ -99,6 +105,9 @@ async def process_manual_email(
         "message_id": "optional-custom-id"
     }
     """
+    if idem.replay is not None:
+        return idem.replay
+
     try:
         sender = email_data.get('sender', '')
         subject = email_data.get('subject', '')
@@ -109,8 +118,13 @@ async def process_manual_email(
             raise HTTPException(status_code=400, detail="Email content is required")
         
         # Procesar email
-        processor = EmailReservationProcessor(db)
-        result = processor.process_email(content, sender, subject, message_id)
+        def _process():
+            processor = EmailReservationProcessor(db)
+            result = processor.process_email(content, sender, subject, message_id)
+            idem.save(db, result)
+            return result
+
+        result = await run_in_threadpool(_process)
         
         return result
         
@@ -231,7 +245,6 @@ async def sendgrid_webhook(
             sender,
             subject,
             message_id,
-            db
         )
         
         return JSONResponse(status_code=200, content={"message": "Email processed"})
@@ -274,7 +287,6 @@ async def mailgun_webhook(
             sender,
             subject,
             message_id,
-            db
         )
         
         return JSONResponse(status_code=200, content={"message": "Email processed"})
@@ -287,7 +299,7 @@ async def mailgun_webhook(
 
 
 @router.get("/processed")
-async def get_processed_emails(
+def get_processed_emails(
     limit: int = 50,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user_optional)
@@ -335,7 +347,7 @@ async def get_processed_emails(
 
 
 @router.post("/check-pending")
-async def check_pending_reservations(
+def check_pending_reservations(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_admin_user)
 ):
@@ -356,22 +368,28 @@ async def check_pending_reservations(
         raise HTTPException(status_code=500, detail=f"Error checking pending reservations: {str(e)}")
 
 
-async def process_reservation_email_task(
+def process_reservation_email_task(
     email_content: str,
     sender: str,
     subject: str,
     message_id: str,
-    db: Session
 ):
     """
-    Tarea en background para procesar emails de reservas
+    Tarea en background para procesar emails de reservas.
+    Abre su propia sesión: la de la petición ya está cerrada cuando corre la
+    tarea y reutilizarla dejaba una conexión del pool sin devolver. Es
+    síncrona para que Starlette la ejecute en el threadpool y no en el loop.
     """
+    db = SessionLocal()
     try:
         processor = EmailReservationProcessor(db)
         result = processor.process_email(email_content, sender, subject, message_id)
         
         # Log del resultado (en producción usar logging apropiado)
         print(f"Email processed: {message_id} - {result}")
+        return result
         
     except Exception as e:
-        print(f"Error processing email {message_id}: {str(e)}")
\ No newline at end of file
+        print(f"Error processing email {message_id}: {str(e)}")
+    finally:
+        db.close()
\ No newline at end of file
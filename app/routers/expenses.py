@@ -2,7 +2,7 @@
 from __future__ import annotations
 
 import os
-from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import and_
@@ -10,6 +10,9 @@ from sqlalchemy import and_
 from ..db import get_db
 from .. import models, schemas
 from ..auth_multiuser import get_current_account, require_member_or_above
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_paginate, set_next_cursor_header
+from ..services.expense_import import BULK_MAX_ROWS, import_expenses
+from ..idempotency import IdempotencyGuard, idempotency
 
 router = APIRouter(prefix="/api/v1/expenses", tags=["expenses"])
 
@@ -22,6 +25,23 @@ def require_internal_key(
     if not admin or provided != admin:
         raise HTTPException(status_code=403, detail="Forbidden")
 
+def _to_out(expense: models.Expense) -> schemas.ExpenseOut:
+    return schemas.ExpenseOut(
+        id=expense.id,
+        apartment_id=expense.apartment_id,
+        date=expense.date,
+        amount_gross=expense.amount_gross,
+        currency=expense.currency,
+        category=expense.category,
+        description=expense.description,
+        vendor=expense.vendor,
+        invoice_number=expense.invoice_number,
+        source=expense.source,
+        vat_rate=expense.vat_rate,
+        file_url=expense.file_url,
+        status=expense.status,
+    )
+
 # ---------- NUEVO ENDPOINT MULTIUSUARIO ----------
 
 @router.post("/", response_model=schemas.ExpenseOut)
@@ -29,9 +49,12 @@ def create_expense_multiuser(
     payload: schemas.ExpenseIn, 
     current_account: models.Account = Depends(get_current_account),
     membership: models.AccountUser = Depends(require_member_or_above),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    idem: IdempotencyGuard = Depends(idempotency),
 ):
     """Crear gasto en la cuenta actual (sistema multiusuario)"""
+    if idem.replay is not None:
+        return idem.replay
     
     # Verificar que el apartamento existe y pertenece a la cuenta actual
     apt = db.query(models.Apartment).filter(
@@ -65,8 +88,10 @@ def create_expense_multiuser(
 
     try:
         db.add(expense)
+        db.flush()
+        response = _to_out(expense)
+        idem.save(db, response)
         db.commit()
-        db.refresh(expense)
     except SQLAlchemyError as ex:
         db.rollback()
         raise HTTPException(
@@ -74,26 +99,46 @@ def create_expense_multiuser(
             detail=f"db_error: {str(ex.orig) if hasattr(ex, 'orig') else str(ex)}"
         )
 
-    return schemas.ExpenseOut(
-        id=expense.id,
-        apartment_id=expense.apartment_id,
-        date=expense.date,
-        amount_gross=expense.amount_gross,
-        currency=expense.currency,
-        category=expense.category,
-        description=expense.description,
-        vendor=expense.vendor,
-        invoice_number=expense.invoice_number,
-        source=expense.source,
-        vat_rate=expense.vat_rate,
-        file_url=expense.file_url,
-        status=expense.status,
-    )
+    return response
+
+@router.post("/bulk", response_model=schemas.ExpenseBulkOut)
+def create_expenses_bulk(
+    payload: schemas.ExpenseBulkIn,
+    current_account: models.Account = Depends(get_current_account),
+    membership: models.AccountUser = Depends(require_member_or_above),
+    db: Session = Depends(get_db),
+    idem: IdempotencyGuard = Depends(idempotency),
+):
+    """Crear miles de gastos en una petición; los errores se devuelven por fila"""
+    if idem.replay is not None:
+        return idem.replay
+    if len(payload.items) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"too_many_rows: max {BULK_MAX_ROWS}")
+
+    try:
+        result = import_expenses(db, current_account.id, payload.items, atomic=payload.atomic)
+        idem.save(db, result)
+        db.commit()
+    except SQLAlchemyError as ex:
+        db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail=f"db_error: {str(ex.orig) if hasattr(ex, 'orig') else str(ex)}"
+        )
+
+    return schemas.ExpenseBulkOut(**result)
 
 # ---------- LEGACY ENDPOINT ----------
 
 @router.post("", response_model=schemas.ExpenseOut, dependencies=[Depends(require_internal_key)])
-def create_expense(payload: schemas.ExpenseIn, db: Session = Depends(get_db)):
+def create_expense(
+    payload: schemas.ExpenseIn,
+    db: Session = Depends(get_db),
+    idem: IdempotencyGuard = Depends(idempotency),
+):
+    if idem.replay is not None:
+        return idem.replay
+
     # 1) existe apartment?
     apt = (
         db.query(models.Apartment)
@@ -121,39 +166,33 @@ def create_expense(payload: schemas.ExpenseIn, db: Session = Depends(get_db)):
 
     try:
         db.add(e)
+        db.flush()
+        response = _to_out(e)
+        idem.save(db, response)
         db.commit()
-        db.refresh(e)
     except SQLAlchemyError as ex:
         db.rollback()
         # Devuelve el mensaje para ver exactamente qué columna/dato falla
         raise HTTPException(status_code=400, detail=f"db_error: {str(ex.orig) if hasattr(ex, 'orig') else str(ex)}")
 
-    return schemas.ExpenseOut(
-        id=e.id,
-        apartment_id=e.apartment_id,
-        date=e.date,
-        amount_gross=e.amount_gross,  # <-- mismo nombre
-        currency=e.currency,
-        category=e.category,
-        description=e.description,
-        vendor=e.vendor,
-        invoice_number=e.invoice_number,
-        source=e.source,
-        vat_rate=e.vat_rate,
-        file_url=e.file_url,
-        status=e.status,
-    )
+    return response
 
 @router.get("", response_model=list[schemas.ExpenseOut])
 def list_expenses(
+    response: Response,
     apartment_id: str | None = None,
+    limit: int = Query(default=200, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = Query(default=None, description="Valor de X-Next-Cursor de la página anterior"),
     db: Session = Depends(get_db),
 ):
     q = db.query(models.Expense)
     if apartment_id:
         q = q.filter(models.Expense.apartment_id == apartment_id)
 
-    rows = q.order_by(models.Expense.date.desc()).limit(200).all()
+    rows, next_cursor = keyset_paginate(
+        q, models.Expense.date, models.Expense.id, limit=limit, cursor=cursor
+    )
+    set_next_cursor_header(response, next_cursor)
 
     return [
         schemas.ExpenseOut(
@@ -324,16 +363,24 @@ def delete_expense(expense_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=f"delete_error: {str(ex.orig) if hasattr(ex, 'orig') else str(ex)}")
 
 @router.get("/by-apartment/{apartment_id}", response_model=list[schemas.ExpenseOut])
-def get_expenses_by_apartment(apartment_id: str, db: Session = Depends(get_db)):
-    """Obtener todos los gastos de un apartamento específico"""
+def get_expenses_by_apartment(
+    apartment_id: str,
+    response: Response,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = Query(default=None, description="Valor de X-Next-Cursor de la página anterior"),
+    db: Session = Depends(get_db),
+):
+    """Obtener los gastos de un apartamento específico, paginados por cursor"""
     # Verificar que el apartamento existe
     apt = db.query(models.Apartment).filter(models.Apartment.id == apartment_id).first()
     if not apt:
         raise HTTPException(status_code=404, detail="apartment_not_found")
     
-    expenses = db.query(models.Expense).filter(
-        models.Expense.apartment_id == apartment_id
-    ).order_by(models.Expense.date.desc()).all()
+    expenses, next_cursor = keyset_paginate(
+        db.query(models.Expense).filter(models.Expense.apartment_id == apartment_id),
+        models.Expense.date, models.Expense.id, limit=limit, cursor=cursor,
+    )
+    set_next_cursor_header(response, next_cursor)
     
     return [
         schemas.ExpenseOut(
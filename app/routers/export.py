@@ -0,0 +1,41 @@
+# app/routers/export.py
+from __future__ import annotations
+
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from .. import models
+from ..auth_multiuser import get_current_account, require_member_or_above
+from ..services.export import EXPORT_DATASETS, EXPORT_FORMATS, stream_export
+
+router = APIRouter(prefix="/api/v1/export", tags=["export"])
+
+
+@router.get("/{dataset}")
+def export_dataset(
+    dataset: str,
+    format: str = Query("csv", description="csv | jsonl | xlsx"),
+    apartment_id: str | None = Query(None),
+    date_from: date | None = Query(None),
+    date_to: date | None = Query(None),
+    current_account: models.Account = Depends(get_current_account),
+    membership: models.AccountUser = Depends(require_member_or_above),
+):
+    """Descarga completa (sin límite de filas) de gastos, ingresos o reservas de la cuenta actual"""
+    if dataset not in EXPORT_DATASETS:
+        raise HTTPException(status_code=404, detail="unknown_dataset")
+    fmt = format.lower()
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="invalid_format")
+
+    filename = f"{dataset}_{current_account.slug}_{date.today().isoformat()}.{fmt}"
+    return StreamingResponse(
+        stream_export(
+            dataset, fmt, current_account.id,
+            apartment_id=apartment_id, date_from=date_from, date_to=date_to,
+        ),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
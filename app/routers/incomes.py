@@ -4,12 +4,15 @@ from __future__ import annotations
 from datetime import datetime, timezone, timedelta
 from typing import Optional
 
-from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from ..db import get_db
+from ..db import get_db, get_read_db
 from .. import models, schemas
 from ..auth import get_current_user_optional
+from ..idempotency import IdempotencyGuard, idempotency
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_paginate, set_next_cursor_header
 
 router = APIRouter(prefix="/api/v1/incomes", tags=["incomes"])
 
@@ -67,9 +70,12 @@ def _to_detailed_out(row: models.Income) -> dict:
 
 @router.get("", response_model=list[schemas.IncomeOut])
 def list_incomes(
+    response: Response,
     reservation_id: Optional[str] = Query(default=None),
     apartment_id: Optional[str] = Query(default=None),
     status: Optional[str] = Query(default=None),  # PENDING | CONFIRMED | CANCELLED
+    limit: int = Query(default=200, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(default=None, description="Valor de X-Next-Cursor de la página anterior"),
     db: Session = Depends(get_db),
 ):
     q = db.query(models.Income)
@@ -83,7 +89,10 @@ def list_incomes(
     if status:
         q = q.filter(models.Income.status == status)
 
-    rows = q.order_by(models.Income.created_at.desc()).limit(200).all()
+    rows, next_cursor = keyset_paginate(
+        q, models.Income.created_at, models.Income.id, limit=limit, cursor=cursor
+    )
+    set_next_cursor_header(response, next_cursor)
     return [_to_out(r) for r in rows]
 
 
@@ -92,7 +101,11 @@ def list_incomes(
 def create_income_from_reservation(
     payload: schemas.IncomeFromReservationIn,
     db: Session = Depends(get_db),
+    idem: IdempotencyGuard = Depends(idempotency),
 ):
+    if idem.replay is not None:
+        return idem.replay
+
     # 1) Buscar la reserva
     r = db.query(models.Reservation).filter(
         models.Reservation.id == payload.reservation_id
@@ -121,10 +134,12 @@ def create_income_from_reservation(
         source=payload.source or "reservation",
     )
     db.add(inc)
+    db.flush()
+    response = _to_out(inc)
+    idem.save(db, response)
     db.commit()
-    db.refresh(inc)
 
-    return _to_out(inc)
+    return response
 
 
 @router.post("/{income_id}/cancel", response_model=schemas.IncomeOut,
@@ -178,7 +193,8 @@ def list_reservation_incomes(
     apartment_id: Optional[str] = Query(default=None),
     status: Optional[str] = Query(default=None),
     source: Optional[str] = Query(default=None),
-    limit: int = Query(default=50, le=200),
+    limit: int = Query(default=50, ge=1, le=200),
+    cursor: Optional[str] = Query(default=None, description="next_cursor de la página anterior"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user_optional)
 ):
@@ -206,87 +222,185 @@ def list_reservation_incomes(
     if source:
         q = q.filter(models.Income.source == source)
 
-    total = q.count()
-    rows = q.order_by(models.Income.created_at.desc()).limit(limit).all()
+    # COUNT solo en la primera página: en las siguientes recorrería otra vez
+    # toda la tabla filtrada (el cliente ya lo tiene)
+    total = q.count() if not cursor else None
+    rows, next_cursor = keyset_paginate(
+        q, models.Income.created_at, models.Income.id, limit=limit, cursor=cursor
+    )
     
     return {
         "reservations": [_to_detailed_out(r) for r in rows],
         "total": total,
-        "showing": len(rows)
+        "showing": len(rows),
+        "next_cursor": next_cursor
     }
 
 
+INCOME_SOURCES = ["BOOKING", "AIRBNB", "WEB", "MANUAL"]
+STATS_GROUP_DIMENSIONS = ("apartment", "month", "source", "status")
+
+
+def _income_aggregates():
+    """COUNT/SUM condicionales por estado, calculados en SQL en una sola pasada"""
+    status = models.Income.status
+    amount = models.Income.amount_gross
+    return [
+        func.count().label("count"),
+        func.count().filter(status == "CONFIRMED").label("confirmed"),
+        func.count().filter(status == "PENDING").label("pending"),
+        func.count().filter(status == "CANCELLED").label("cancelled"),
+        func.coalesce(func.sum(amount).filter(status != "CANCELLED"), 0).label("amount"),
+        func.coalesce(func.sum(amount).filter(status == "CONFIRMED"), 0).label("confirmed_amount"),
+        func.coalesce(func.sum(amount).filter(status == "PENDING"), 0).label("pending_amount"),
+    ]
+
+
+def _income_stats_breakdown(db: Session, filters: list, dimensions: list[str]) -> list[dict]:
+    """Desglose arbitrario (apartment, month, source, status) sobre los mismos filtros"""
+    columns = []
+    group_by = []
+    query_needs_apartment = "apartment" in dimensions
+    for dim in dimensions:
+        if dim == "apartment":
+            columns += [models.Income.apartment_id.label("apartment_id"), models.Apartment.code.label("apartment_code")]
+            group_by += [models.Income.apartment_id, models.Apartment.code]
+        elif dim == "month":
+            year_col = func.extract("year", models.Income.date)
+            month_col = func.extract("month", models.Income.date)
+            columns += [year_col.label("year"), month_col.label("month")]
+            group_by += [year_col, month_col]
+        elif dim == "source":
+            columns.append(models.Income.source.label("source"))
+            group_by.append(models.Income.source)
+        elif dim == "status":
+            columns.append(models.Income.status.label("status"))
+            group_by.append(models.Income.status)
+
+    q = db.query(*columns, *_income_aggregates())
+    if query_needs_apartment:
+        q = q.outerjoin(models.Apartment, models.Income.apartment_id == models.Apartment.id)
+    rows = q.filter(*filters).group_by(*group_by).order_by(*group_by).all()
+
+    breakdown = []
+    for row in rows:
+        item = {}
+        if query_needs_apartment:
+            item["apartment_id"] = row.apartment_id
+            item["apartment_code"] = row.apartment_code
+        if "month" in dimensions:
+            item["month"] = f"{int(row.year):04d}-{int(row.month):02d}"
+        if "source" in dimensions:
+            item["source"] = row.source
+        if "status" in dimensions:
+            item["status"] = row.status
+        item.update({
+            "count": row.count,
+            "amount": float(row.amount),
+            "confirmed": row.confirmed,
+            "pending": row.pending,
+            "cancelled": row.cancelled,
+            "confirmed_amount": float(row.confirmed_amount),
+            "pending_amount": float(row.pending_amount),
+        })
+        breakdown.append(item)
+    return breakdown
+
+
 @router.get("/stats")
 def get_income_stats(
     apartment_id: Optional[str] = Query(default=None),
     days: int = Query(default=30, le=365),
-    db: Session = Depends(get_db),
+    group_by: Optional[str] = Query(
+        default=None,
+        description="Desglose opcional separado por comas: apartment, month, source, status",
+    ),
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(get_current_user_optional)
 ):
     """
     Estadísticas de ingresos por reservas
     """
     from_date = datetime.now() - timedelta(days=days)
-    
-    q = db.query(models.Income).filter(
-        models.Income.created_at >= from_date
-    )
+    today = datetime.now().date()
+
+    dimensions = []
+    if group_by:
+        dimensions = [d.strip().lower() for d in group_by.split(",") if d.strip()]
+        invalid = [d for d in dimensions if d not in STATS_GROUP_DIMENSIONS]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"invalid_group_by: {', '.join(invalid)}")
+        dimensions = list(dict.fromkeys(dimensions))
+
+    filters = [models.Income.created_at >= from_date]
 
     # Filtrar por apartamentos del usuario si no es admin
     if current_user and not current_user.is_admin:
         user_apartment_ids = [apt.id for apt in current_user.apartments]
         if not user_apartment_ids:
             return {"error": "No apartments found for user"}
-        q = q.filter(models.Income.apartment_id.in_(user_apartment_ids))
+        filters.append(models.Income.apartment_id.in_(user_apartment_ids))
 
     if apartment_id:
-        q = q.filter(models.Income.apartment_id == apartment_id)
+        filters.append(models.Income.apartment_id == apartment_id)
 
-    all_incomes = q.all()
-    
-    # Estadísticas generales
-    total_reservations = len(all_incomes)
-    confirmed_reservations = len([i for i in all_incomes if i.status == "CONFIRMED"])
-    pending_reservations = len([i for i in all_incomes if i.status == "PENDING"])
-    cancelled_reservations = len([i for i in all_incomes if i.status == "CANCELLED"])
-    
-    total_amount = sum(float(i.amount_gross) for i in all_incomes if i.status != "CANCELLED")
-    confirmed_amount = sum(float(i.amount_gross) for i in all_incomes if i.status == "CONFIRMED")
-    pending_amount = sum(float(i.amount_gross) for i in all_incomes if i.status == "PENDING")
-    
-    # Por fuente
-    by_source = {}
-    for source in ["BOOKING", "AIRBNB", "WEB", "MANUAL"]:
-        source_incomes = [i for i in all_incomes if i.source == source]
-        by_source[source] = {
-            "count": len(source_incomes),
-            "amount": sum(float(i.amount_gross) for i in source_incomes if i.status != "CANCELLED"),
-            "confirmed": len([i for i in source_incomes if i.status == "CONFIRMED"]),
-            "pending": len([i for i in source_incomes if i.status == "PENDING"]),
-            "cancelled": len([i for i in source_incomes if i.status == "CANCELLED"])
-        }
-    
-    # Próximos check-ins
-    upcoming_checkins = [
-        i for i in all_incomes 
-        if i.check_in_date and i.check_in_date >= datetime.now().date() and i.status == "CONFIRMED"
-    ]
-    
-    return {
+    # Una sola consulta agrupada por fuente con agregados condicionales por estado
+    upcoming = func.count().filter(
+        models.Income.check_in_date >= today,
+        models.Income.status == "CONFIRMED",
+    ).label("upcoming")
+    rows = (
+        db.query(models.Income.source, *_income_aggregates(), upcoming)
+        .filter(*filters)
+        .group_by(models.Income.source)
+        .all()
+    )
+
+    summary = {
+        "total_reservations": 0,
+        "confirmed_reservations": 0,
+        "pending_reservations": 0,
+        "cancelled_reservations": 0,
+        "total_amount": 0.0,
+        "confirmed_amount": 0.0,
+        "pending_amount": 0.0
+    }
+    by_source = {
+        source: {"count": 0, "amount": 0.0, "confirmed": 0, "pending": 0, "cancelled": 0}
+        for source in INCOME_SOURCES
+    }
+    upcoming_checkins = 0
+
+    for row in rows:
+        summary["total_reservations"] += row.count
+        summary["confirmed_reservations"] += row.confirmed
+        summary["pending_reservations"] += row.pending
+        summary["cancelled_reservations"] += row.cancelled
+        summary["total_amount"] += float(row.amount)
+        summary["confirmed_amount"] += float(row.confirmed_amount)
+        summary["pending_amount"] += float(row.pending_amount)
+        upcoming_checkins += row.upcoming
+
+        if row.source in by_source:
+            by_source[row.source] = {
+                "count": row.count,
+                "amount": float(row.amount),
+                "confirmed": row.confirmed,
+                "pending": row.pending,
+                "cancelled": row.cancelled
+            }
+
+    response = {
         "period_days": days,
         "from_date": from_date.date().isoformat(),
-        "summary": {
-            "total_reservations": total_reservations,
-            "confirmed_reservations": confirmed_reservations,
-            "pending_reservations": pending_reservations,
-            "cancelled_reservations": cancelled_reservations,
-            "total_amount": total_amount,
-            "confirmed_amount": confirmed_amount,
-            "pending_amount": pending_amount
-        },
+        "summary": summary,
         "by_source": by_source,
-        "upcoming_checkins": len(upcoming_checkins)
+        "upcoming_checkins": upcoming_checkins
     }
+    if dimensions:
+        response["group_by"] = dimensions
+        response["breakdown"] = _income_stats_breakdown(db, filters, dimensions)
+    return response
 
 
 @router.get("/upcoming-checkins")
@@ -343,8 +457,15 @@ def get_upcoming_checkins(
 # ============ NUEVAS RUTAS CRUD PARA ADMINISTRACIÓN ============
 
 @router.post("", response_model=schemas.IncomeOut, dependencies=[Depends(require_internal_key)])
-def create_income(payload: schemas.IncomeCreate, db: Session = Depends(get_db)):
+def create_income(
+    payload: schemas.IncomeCreate,
+    db: Session = Depends(get_db),
+    idem: IdempotencyGuard = Depends(idempotency),
+):
     """Crear nuevo ingreso"""
+    if idem.replay is not None:
+        return idem.replay
+
     # Verificar que el apartamento existe
     apt = db.query(models.Apartment).filter(models.Apartment.id == payload.apartment_id).first()
     if not apt:
@@ -375,13 +496,15 @@ def create_income(payload: schemas.IncomeCreate, db: Session = Depends(get_db)):
     
     try:
         db.add(income)
+        db.flush()
+        response = _to_out(income)
+        idem.save(db, response)
         db.commit()
-        db.refresh(income)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=f"create_error: {str(e)}")
     
-    return _to_out(income)
+    return response
 
 @router.get("/{income_id}", response_model=schemas.IncomeOut)
 def get_income(income_id: str, db: Session = Depends(get_db)):
@@ -531,16 +654,22 @@ def delete_income(income_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=f"delete_error: {str(e)}")
 
 @router.get("/by-apartment/{apartment_id}")
-def get_incomes_by_apartment(apartment_id: str, db: Session = Depends(get_db)):
-    """Obtener todos los ingresos de un apartamento específico"""
+def get_incomes_by_apartment(
+    apartment_id: str,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(default=None, description="next_cursor de la página anterior"),
+    db: Session = Depends(get_db),
+):
+    """Obtener los ingresos de un apartamento específico, paginados por cursor"""
     # Verificar que el apartamento existe
     apt = db.query(models.Apartment).filter(models.Apartment.id == apartment_id).first()
     if not apt:
         raise HTTPException(status_code=404, detail="apartment_not_found")
     
-    incomes = db.query(models.Income).filter(
-        models.Income.apartment_id == apartment_id
-    ).order_by(models.Income.date.desc()).all()
+    incomes, next_cursor = keyset_paginate(
+        db.query(models.Income).filter(models.Income.apartment_id == apartment_id),
+        models.Income.date, models.Income.id, limit=limit, cursor=cursor,
+    )
     
     return {
         "apartment": {
@@ -549,6 +678,7 @@ def get_incomes_by_apartment(apartment_id: str, db: Session = Depends(get_db)):
             "name": apt.name
         },
         "incomes": [_to_detailed_out(income) for income in incomes],
-        "total": len(incomes)
+        "total": len(incomes),
+        "next_cursor": next_cursor
     }
 
@@ -11,6 +11,7 @@ from sqlalchemy.orm import Session
 
 from ..db import get_db
 from .. import models
+from ..services.stats import stats_engine
 
 # Initialize templates
 templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), "..", "templates"))
@@ -21,10 +22,11 @@ router = APIRouter(prefix="/management", tags=["management"])
 def management_dashboard(request: Request, db: Session = Depends(get_db)):
     """Interfaz web de gestión principal"""
     
-    # Obtener estadísticas básicas
-    total_apartments = db.query(models.Apartment).count()
-    total_expenses = db.query(models.Expense).count()
-    total_incomes = db.query(models.Income).count()
+    # Obtener estadísticas básicas (cacheadas, una sola consulta)
+    stats = stats_engine.get(db)
+    total_apartments = stats["apartments_total"]
+    total_expenses = stats["expenses_total"]
+    total_incomes = stats["incomes_total"]
     
     # Obtener apartamentos activos para los selects
     active_apartments = db.query(models.Apartment).filter(
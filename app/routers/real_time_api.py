@@ -9,8 +9,10 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
-from ..db import get_db
+from ..db import get_read_db
 from .. import models
+from ..services.stats import stats_engine
+from ..pagination import keyset_paginate
 
 router = APIRouter(prefix="/api/realtime", tags=["realtime"])
 
@@ -25,8 +27,9 @@ def require_admin_key(key: str = Query(..., description="Admin key")):
 def get_incomes_realtime(
     key: str = Query(...),
     apartment_id: str = Query(None),
-    limit: int = Query(50, le=200),
-    db: Session = Depends(get_db),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str = Query(None, description="next_cursor de la página anterior"),
+    db: Session = Depends(get_read_db),
     _: bool = Depends(require_admin_key)
 ):
     """Obtener ingresos con información completa para actualización en tiempo real"""
@@ -41,7 +44,9 @@ def get_incomes_realtime(
         if apartment_id:
             query = query.filter(models.Income.apartment_id == apartment_id)
         
-        incomes = query.order_by(models.Income.created_at.desc()).limit(limit).all()
+        incomes, next_cursor = keyset_paginate(
+            query, models.Income.created_at, models.Income.id, limit=limit, cursor=cursor
+        )
         
         result = []
         for income in incomes:
@@ -74,9 +79,12 @@ def get_incomes_realtime(
             "success": True,
             "incomes": result,
             "total": len(result),
+            "next_cursor": next_cursor,
             "timestamp": datetime.now().isoformat()
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching incomes: {str(e)}")
 
@@ -84,8 +92,9 @@ def get_incomes_realtime(
 def get_expenses_realtime(
     key: str = Query(...),
     apartment_id: str = Query(None),
-    limit: int = Query(50, le=200),
-    db: Session = Depends(get_db),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str = Query(None, description="next_cursor de la página anterior"),
+    db: Session = Depends(get_read_db),
     _: bool = Depends(require_admin_key)
 ):
     """Obtener gastos con información completa para actualización en tiempo real"""
@@ -100,7 +109,9 @@ def get_expenses_realtime(
         if apartment_id:
             query = query.filter(models.Expense.apartment_id == apartment_id)
         
-        expenses = query.order_by(models.Expense.created_at.desc()).limit(limit).all()
+        expenses, next_cursor = keyset_paginate(
+            query, models.Expense.created_at, models.Expense.id, limit=limit, cursor=cursor
+        )
         
         result = []
         for expense in expenses:
@@ -131,22 +142,29 @@ def get_expenses_realtime(
             "success": True,
             "expenses": result,
             "total": len(result),
+            "next_cursor": next_cursor,
             "timestamp": datetime.now().isoformat()
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching expenses: {str(e)}")
 
 @router.get("/apartments")
 def get_apartments_realtime(
     key: str = Query(...),
-    db: Session = Depends(get_db),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str = Query(None, description="next_cursor de la página anterior"),
+    db: Session = Depends(get_read_db),
     _: bool = Depends(require_admin_key)
 ):
     """Obtener apartamentos con estadísticas para actualización en tiempo real"""
     
     try:
-        apartments = db.query(models.Apartment).order_by(models.Apartment.created_at.desc()).all()
+        apartments, next_cursor = keyset_paginate(
+            db.query(models.Apartment), models.Apartment.created_at, models.Apartment.id, limit=limit, cursor=cursor
+        )
         
         result = []
         for apartment in apartments:
@@ -193,74 +211,46 @@ def get_apartments_realtime(
             "success": True,
             "apartments": result,
             "total": len(result),
+            "next_cursor": next_cursor,
             "timestamp": datetime.now().isoformat()
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching apartments: {str(e)}")
 
 @router.get("/dashboard-stats")
 def get_dashboard_stats_realtime(
     key: str = Query(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     _: bool = Depends(require_admin_key)
 ):
     """Obtener estadísticas del dashboard optimizadas para tiempo real"""
     
     try:
-        # Estadísticas generales
-        total_apartments = db.query(models.Apartment).filter(models.Apartment.is_active == True).count()
-        total_expenses = db.query(models.Expense).count()
-        total_incomes = db.query(models.Income).count()
-        
-        # Estadísticas del mes actual
-        current_month = datetime.now().replace(day=1)
-        
-        monthly_expenses = db.query(func.sum(models.Expense.amount_gross)).filter(
-            models.Expense.date >= current_month.date()
-        ).scalar() or 0
-        
-        monthly_incomes_confirmed = db.query(func.sum(models.Income.amount_gross)).filter(
-            models.Income.date >= current_month.date(),
-            models.Income.status == "CONFIRMED"
-        ).scalar() or 0
-        
-        monthly_incomes_pending = db.query(func.sum(models.Income.amount_gross)).filter(
-            models.Income.date >= current_month.date(),
-            models.Income.status == "PENDING"
-        ).scalar() or 0
-        
-        # Actividad reciente (últimos 7 días)
-        week_ago = datetime.now() - timedelta(days=7)
-        
-        recent_expenses = db.query(models.Expense).filter(
-            models.Expense.created_at >= week_ago
-        ).count()
-        
-        recent_incomes = db.query(models.Income).filter(
-            models.Income.created_at >= week_ago
-        ).count()
+        stats = stats_engine.get(db)
         
         return {
             "success": True,
             "totals": {
-                "active_apartments": total_apartments,
-                "total_expenses": total_expenses,
-                "total_incomes": total_incomes
+                "active_apartments": stats["apartments_active"],
+                "total_expenses": stats["expenses_total"],
+                "total_incomes": stats["incomes_total"]
             },
             "monthly": {
-                "expenses_sum": float(monthly_expenses),
-                "incomes_confirmed": float(monthly_incomes_confirmed),
-                "incomes_pending": float(monthly_incomes_pending),
-                "incomes_sum": float(monthly_incomes_confirmed + monthly_incomes_pending),
-                "net": float(monthly_incomes_confirmed - monthly_expenses)
+                "expenses_sum": stats["expenses_month_sum"],
+                "incomes_confirmed": stats["incomes_month_confirmed"],
+                "incomes_pending": stats["incomes_month_pending"],
+                "incomes_sum": stats["incomes_month_confirmed"] + stats["incomes_month_pending"],
+                "net": stats["incomes_month_confirmed"] - stats["expenses_month_sum"]
             },
             "recent_activity": {
-                "expenses_week": recent_expenses,
-                "incomes_week": recent_incomes
+                "expenses_week": stats["expenses_week"],
+                "incomes_week": stats["incomes_week"]
             },
             "timestamp": datetime.now().isoformat(),
-            "month": current_month.strftime("%Y-%m")
+            "month": stats["month"]
         }
         
     except Exception as e:
@@ -1,32 +1,20 @@
 ﻿# app/routers/reservations.py
 from __future__ import annotations
 
-import hashlib, json, uuid, traceback
-from fastapi import APIRouter, Depends, Header, HTTPException, BackgroundTasks
+import traceback
+from fastapi import APIRouter, Depends, Header, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from ..db import get_db
 from .. import models, schemas
-from ..services.events import notify_ses_reservation_created
+from ..services.availability import find_overlapping_stays, lock_apartment_stays
+from ..services.events import enqueue_ses_reservation_created
+from ..services.outbox import outbox_dispatcher
+from ..idempotency import IdempotencyGuard, idempotency
 
 router = APIRouter(prefix="/api/v1/reservations", tags=["reservations"])
 
 
-def _hash_body_safe(pyd_model: schemas.ReservationIn) -> str:
-    """
-    Genera un hash estable del cuerpo. Convierte fechas a ISO con Pydantic v2
-    para evitar 'Object of type date is not JSON serializable'.
-    """
-    try:
-        data = pyd_model.model_dump(mode="json")  # fechas -> "YYYY-MM-DD"
-    except Exception:
-        # último salvavidas
-        data = json.loads(pyd_model.model_dump_json())
-    return hashlib.sha256(
-        json.dumps(data, sort_keys=True, separators=(",", ":"), default=str).encode()
-    ).hexdigest()
-
-
 def _make_response(reservation_id) -> dict:
     # Siempre devolvemos string para que case con el schema/JSON
     return {"reservation_id": str(reservation_id)}
@@ -35,31 +23,26 @@ def _make_response(reservation_id) -> dict:
 @router.post("", response_model=schemas.ReservationOut)
 def create_reservation(
     payload: schemas.ReservationIn,
-    background: BackgroundTasks,
     db: Session = Depends(get_db),
-    x_idempotency_key: str | None = Header(default=None, alias="X-Idempotency-Key"),
+    idem: IdempotencyGuard = Depends(idempotency),
 ):
-    body_hash = _hash_body_safe(payload)
-
     try:
-        # Idempotencia: misma key + mismo hash => misma respuesta
-        if x_idempotency_key:
-            idem = (
-                db.query(models.IdempotencyKey)
-                .filter(models.IdempotencyKey.key == x_idempotency_key)
-                .first()
-            )
-            if idem:
-                if idem.request_hash != body_hash:
-                    raise HTTPException(
-                        status_code=409,
-                        detail="Idempotency-Key en uso con otro cuerpo",
-                    )
-                # Asegura forma de respuesta
-                if isinstance(idem.response_json, dict) and "reservation_id" in idem.response_json:
-                    return idem.response_json
-                # Si por lo que sea no está bien guardado, no reinsertamos: devolvemos seguro
-                return _make_response(idem.response_json)
+        # Idempotencia: misma key + mismo cuerpo => misma respuesta
+        if idem.replay is not None:
+            return idem.replay
+
+        if payload.check_out <= payload.check_in:
+            raise HTTPException(status_code=400, detail="check_out_must_be_after_check_in")
+
+        # No permitir solapes con otras estancias del apartamento: se comprueba
+        # en la BD con el apartamento bloqueado hasta el commit, así dos altas
+        # simultáneas no pasan las dos
+        if payload.apartment_id:
+            lock_apartment_stays(db, payload.apartment_id)
+            conflicts = find_overlapping_stays(db, payload.apartment_id, payload.check_in, payload.check_out)
+            if conflicts:
+                db.rollback()
+                raise HTTPException(status_code=409, detail=f"reservation_overlaps: {', '.join(conflicts)}")
 
         # Crear reserva
         r = models.Reservation(
@@ -69,42 +52,19 @@ def create_reservation(
             channel=payload.channel,
             email_contact=payload.email,
             phone_contact=payload.phone,
-	    apartment_id=payload.apartment_id,
+            apartment_id=payload.apartment_id,
         )
         db.add(r)
-        db.commit()
-        db.refresh(r)
+        db.flush()
 
         response = _make_response(r.id)
 
-        # Guarda registro de idempotencia si nos pasaron clave
-        if x_idempotency_key:
-            try:
-                idem = models.IdempotencyKey(
-                    key=x_idempotency_key,
-                    request_hash=body_hash,
-                    response_json=response,
-                )
-                db.add(idem)
-                db.commit()
-            except IntegrityError:
-                # carrera: ya existe la clave → no pasa nada
-                db.rollback()
-
-        # Disparo a SES.HOSPEDAJES en background (no bloquea la respuesta)
-        background.add_task(
-            notify_ses_reservation_created,
-            {
-                "reservation_id": str(r.id),
-                "check_in": r.check_in.isoformat(),
-                "check_out": r.check_out.isoformat(),
-                "guests": r.guests,
-                "channel": r.channel,
-                "email": r.email_contact,
-                "phone": r.phone_contact,
-            },
-            x_idempotency_key or str(uuid.uuid4()),
-        )
+        # Respuesta idempotente y evento para SES.HOSPEDAJES en la misma
+        # transacción que la reserva: el outbox lo entrega aunque reiniciemos
+        idem.save(db, response)
+        enqueue_ses_reservation_created(db, r)
+        db.commit()
+        outbox_dispatcher.wake()
 
         return response
 
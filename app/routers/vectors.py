@@ -6,10 +6,11 @@ from typing import List
 from fastapi import APIRouter, Depends, HTTPException, Header, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from openai import OpenAI
 
 from ..db import get_db
 from .. import models
+from ..services.llm import EMBEDDING_MODEL
+from ..services.llm_gateway import llm_gateway
 
 logger = logging.getLogger("vectors")
 router = APIRouter(prefix="/admin/vectors", tags=["vectors"])
@@ -22,12 +23,9 @@ def require_internal_key(x_internal_key: str | None = Header(default=None, alias
         raise HTTPException(status_code=403, detail="Forbidden")
 
 # --- Embeddings helper ---
-client = OpenAI()
-
 def embed_text(text: str) -> List[float]:
     try:
-        resp = client.embeddings.create(model="text-embedding-3-small", input=text[:3000])
-        return resp.data[0].embedding
+        return llm_gateway.embed_sync(text[:3000], model=EMBEDDING_MODEL)
     except Exception as e:
         logger.exception("Error generando embedding:")
         raise HTTPException(status_code=500, detail=f"embedding_error: {e}")
@@ -58,7 +56,7 @@ def insert_vector(
         db.execute(q, {
             "id": expense_id,
             "apartment_id": apartment_id,
-            "model": "text-embedding-3-small",
+            "model": EMBEDDING_MODEL,
             "embedding": emb,
             "text_snippet": text_snippet[:1000],
             "vendor": vendor,
@@ -109,7 +107,7 @@ def backfill_vectors(apartment_id: str | None = None, db: Session = Depends(get_
         """), {
             "id": str(e.id),
             "apartment_id": str(e.apartment_id),
-            "model": "text-embedding-3-small",
+            "model": EMBEDDING_MODEL,
             "embedding": emb,
             "text_snippet": text_snippet[:1000],
             "vendor": e.vendor,
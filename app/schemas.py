@@ -212,6 +212,26 @@ class ExpenseOut(BaseModel):
     file_url: Optional[str] = None
     status: Optional[str] = None
 
+class ExpenseBulkRow(ExpenseIn):
+    """Fila de importación masiva: el apartamento puede venir por id o por código"""
+    apartment_id: Optional[str] = None
+    apartment_code: Optional[str] = None
+
+class ExpenseBulkIn(BaseModel):
+    # Filas sin validar: cada una se valida por separado para devolver errores por fila
+    items: List[Dict[str, Any]] = Field(..., min_length=1)
+    atomic: bool = False  # True: si alguna fila falla no se inserta ninguna
+
+class ExpenseBulkError(BaseModel):
+    index: int
+    errors: List[str]
+
+class ExpenseBulkOut(BaseModel):
+    received: int
+    inserted: int
+    ids: List[str] = []
+    errors: List[ExpenseBulkError] = []
+
 # ---------- INGRESOS ----------
 class IncomeFromReservationIn(BaseModel):
     reservation_id: str
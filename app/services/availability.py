@@ -0,0 +1,362 @@
+# app/services/availability.py
+"""
+Motor de disponibilidad y ocupación por apartamento.
+
+Cada apartamento tiene un índice de estancias (noches [check_in, check_out)
+en ordinales de día) construido a partir de:
+- Reservation.check_in/check_out (no canceladas)
+- Income.check_in_date/check_out_date (no cancelados y sin reserva asociada
+  ya contada)
+
+Sobre las estancias ordenadas se precalculan dos funciones escalonadas con
+integral acumulada (ocupado sí/no y tarifa por noche), de modo que noches
+ocupadas e ingresos de cualquier ventana salen con dos bisect: la ocupación,
+ADR y RevPAR de todo el portfolio para un año cuestan milisegundos.
+
+Los índices se cargan por apartamento bajo demanda y, tras cada commit que
+toca Reservation/Income, se descarta solo el índice de los apartamentos
+afectados: la siguiente lectura lo recarga con las mismas reglas que la
+carga inicial (p. ej. el ingreso de una reserva sin total_amount sale de sus
+incomes), en vez de parchear el índice con otra versión de esas reglas.
+
+Los índices son por proceso y caducan a los AVAILABILITY_INDEX_TTL segundos,
+así que solo sirven para consultas y reportes. Las altas comprueban los
+solapes contra la BD dentro de su transacción (lock_apartment_stays +
+find_overlapping_stays).
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date
+
+from sqlalchemy import event, inspect, or_, select, update
+from sqlalchemy.orm import Session
+
+from .. import models
+
+AVAILABILITY_INDEX_TTL = float(os.getenv("AVAILABILITY_INDEX_TTL", "300"))
+
+
+class _StepFunction:
+    """Función constante a trozos sobre días con integral acumulada"""
+
+    def __init__(self, deltas: dict[int, float], clamp_to_one: bool = False):
+        self.xs: list[int] = []
+        self.values: list[float] = []
+        self.prefix: list[float] = [0.0]
+        level = 0.0
+        for x in sorted(deltas):
+            level += deltas[x]
+            self.xs.append(x)
+            self.values.append(min(1.0, level) if clamp_to_one and level > 1e-9 else max(level, 0.0))
+        for i in range(len(self.xs) - 1):
+            self.prefix.append(self.prefix[-1] + self.values[i] * (self.xs[i + 1] - self.xs[i]))
+
+    def _cumulative(self, x: int) -> float:
+        i = bisect_right(self.xs, x) - 1
+        if i < 0:
+            return 0.0
+        return self.prefix[i] + self.values[i] * (x - self.xs[i])
+
+    def integral(self, start: int, end: int) -> float:
+        if not self.xs or end <= start:
+            return 0.0
+        return self._cumulative(end) - self._cumulative(start)
+
+
+class ApartmentIndex:
+    """Estancias de un apartamento ordenadas por inicio"""
+
+    def __init__(self, stays: list[tuple[int, int, float, str]]):
+        # (inicio, fin, ingreso, id) con inicio/fin en date.toordinal()
+        self.stays = sorted(stays)
+        self._derived = None
+
+    def _build(self):
+        stays = self.stays
+        starts = [s[0] for s in stays]
+        prefix_max_end = []
+        current = None
+        occupancy, rate = defaultdict(float), defaultdict(float)
+        for start, end, revenue, _ in stays:
+            current = end if current is None else max(current, end)
+            prefix_max_end.append(current)
+            if end <= start:
+                continue
+            occupancy[start] += 1
+            occupancy[end] -= 1
+            per_night = revenue / (end - start)
+            rate[start] += per_night
+            rate[end] -= per_night
+        self._derived = (
+            stays,
+            starts,
+            prefix_max_end,
+            _StepFunction(occupancy, clamp_to_one=True),
+            _StepFunction(rate),
+        )
+        return self._derived
+
+    def conflicts(self, start: int, end: int) -> list[str]:
+        """Ids de las estancias que se solapan con [start, end)"""
+        stays, starts, prefix_max_end, _, _ = self._derived or self._build()
+        found = []
+        i = bisect_left(starts, end) - 1
+        while i >= 0 and prefix_max_end[i] > start:
+            if stays[i][1] > start:
+                found.append(stays[i][3])
+            i -= 1
+        return found[::-1]
+
+    def occupied_nights(self, start: int, end: int) -> float:
+        *_, occupancy, _ = self._derived or self._build()
+        return occupancy.integral(start, end)
+
+    def revenue(self, start: int, end: int) -> float:
+        *_, rate = self._derived or self._build()
+        return rate.integral(start, end)
+
+
+class AvailabilityEngine:
+    def __init__(self, ttl_seconds: float = AVAILABILITY_INDEX_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._indexes: dict[str, tuple[ApartmentIndex, float]] = {}
+        self.loads = 0
+
+    # ---------- CARGA ----------
+
+    def _load_stays(self, db: Session, apartment_ids: list[str]) -> dict[str, list[tuple]]:
+        stays: dict[str, list[tuple]] = {apt_id: [] for apt_id in apartment_ids}
+        if not apartment_ids:
+            return stays
+
+        reservations = db.execute(
+            select(
+                models.Reservation.id, models.Reservation.apartment_id,
+                models.Reservation.check_in, models.Reservation.check_out,
+                models.Reservation.total_amount,
+            ).where(
+                models.Reservation.apartment_id.in_(apartment_ids),
+                models.Reservation.status != "CANCELLED",
+            )
+        ).all()
+        incomes = db.execute(
+            select(
+                models.Income.id, models.Income.apartment_id, models.Income.reservation_id,
+                models.Income.check_in_date, models.Income.check_out_date,
+                models.Income.amount_gross,
+            ).where(
+                models.Income.apartment_id.in_(apartment_ids),
+                models.Income.status != "CANCELLED",
+            )
+        ).all()
+
+        # Ingreso de una reserva sin total_amount = suma de sus incomes
+        linked_revenue = defaultdict(float)
+        for inc in incomes:
+            if inc.reservation_id:
+                linked_revenue[inc.reservation_id] += float(inc.amount_gross or 0)
+
+        counted = set()
+        for r in reservations:
+            revenue = float(r.total_amount) if r.total_amount is not None else linked_revenue.get(r.id, 0.0)
+            stays[r.apartment_id].append((r.check_in.toordinal(), r.check_out.toordinal(), revenue, r.id))
+            counted.add(r.id)
+
+        for inc in incomes:
+            if inc.reservation_id in counted or not inc.check_in_date or not inc.check_out_date:
+                continue
+            stays[inc.apartment_id].append((
+                inc.check_in_date.toordinal(), inc.check_out_date.toordinal(),
+                float(inc.amount_gross or 0), str(inc.id),
+            ))
+        return stays
+
+    def indexes(self, db: Session, apartment_ids: list[str]) -> dict[str, ApartmentIndex]:
+        now = time.monotonic()
+        with self._lock:
+            result, missing = {}, []
+            for apt_id in apartment_ids:
+                entry = self._indexes.get(apt_id)
+                if entry and now - entry[1] < self.ttl_seconds:
+                    result[apt_id] = entry[0]
+                else:
+                    missing.append(apt_id)
+
+        if missing:
+            loaded = self._load_stays(db, missing)
+            with self._lock:
+                for apt_id, stays in loaded.items():
+                    index = ApartmentIndex(stays)
+                    self._indexes[apt_id] = (index, now)
+                    result[apt_id] = index
+                self.loads += 1
+        return result
+
+    def index(self, db: Session, apartment_id: str) -> ApartmentIndex:
+        return self.indexes(db, [apartment_id])[apartment_id]
+
+    # ---------- CONSULTAS ----------
+
+    def conflicts(self, db: Session, apartment_id: str, check_in: date, check_out: date) -> list[str]:
+        return self.index(db, apartment_id).conflicts(check_in.toordinal(), check_out.toordinal())
+
+    def occupancy_report(self, db: Session, apartments: list[models.Apartment], year: int) -> dict:
+        """Ocupación, ADR y RevPAR por apartamento y mes, y totales del portfolio"""
+        months = [(date(year, m, 1).toordinal(), date(year + (m == 12), m % 12 + 1, 1).toordinal()) for m in range(1, 13)]
+        indexes = self.indexes(db, [a.id for a in apartments])
+
+        portfolio = [[0.0, 0.0, 0] for _ in months]  # noches ocupadas, ingresos, noches disponibles
+        items = []
+        for apt in apartments:
+            index = indexes[apt.id]
+            monthly = []
+            for i, (start, end) in enumerate(months):
+                nights = end - start
+                occupied = index.occupied_nights(start, end)
+                revenue = index.revenue(start, end)
+                portfolio[i][0] += occupied
+                portfolio[i][1] += revenue
+                portfolio[i][2] += nights
+                monthly.append(_metrics(i + 1, nights, occupied, revenue))
+            items.append({"apartment_id": apt.id, "code": apt.code, "months": monthly,
+                          "year": _metrics(None, *_sum_months(monthly))})
+
+        totals = [_metrics(i + 1, available, occupied, revenue) for i, (occupied, revenue, available) in enumerate(portfolio)]
+        return {
+            "year": year,
+            "apartments": items,
+            "portfolio": {"months": totals, "year": _metrics(None, *_sum_months(totals))},
+        }
+
+    # ---------- MANTENIMIENTO ----------
+
+    def invalidate(self, apartment_ids=None):
+        with self._lock:
+            if apartment_ids is None:
+                self._indexes.clear()
+            else:
+                for apt_id in apartment_ids:
+                    self._indexes.pop(apt_id, None)
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            return {"apartments_indexed": len(self._indexes), "loads": self.loads, "ttl_seconds": self.ttl_seconds}
+
+
+# ---------- ALTAS: COMPROBACIÓN EN BD ----------
+
+def lock_apartment_stays(db: Session, apartment_id: str):
+    """
+    Serializa las altas de estancias de un apartamento hasta el final de la
+    transacción: otra alta concurrente espera aquí y ve la estancia ya creada.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        # SQLite ignora FOR UPDATE: se toma el turno de SQLiteWriteQueue y una
+        # escritura sin cambios toma ya el lock de escritura de la BD. Va por
+        # Core para no disparar las invalidaciones de caché del ORM
+        from ..db import sqlite_write_queue
+        if sqlite_write_queue is not None:
+            sqlite_write_queue.acquire(db)
+        apartments = models.Apartment.__table__
+        db.connection().execute(
+            update(apartments).where(apartments.c.id == apartment_id).values(id=apartments.c.id)
+        )
+    else:
+        db.execute(select(models.Apartment.id).where(models.Apartment.id == apartment_id).with_for_update())
+
+
+def find_overlapping_stays(db: Session, apartment_id: str, check_in: date, check_out: date) -> list[str]:
+    """Ids de las estancias de la BD que se solapan con [check_in, check_out) (mismas reglas que el índice)"""
+    active_reservations = select(models.Reservation.id).where(
+        models.Reservation.apartment_id == apartment_id,
+        models.Reservation.status != "CANCELLED",
+    )
+    reservation_ids = db.scalars(
+        active_reservations.where(
+            models.Reservation.check_in < check_out,
+            models.Reservation.check_out > check_in,
+        ).order_by(models.Reservation.check_in)
+    ).all()
+    income_ids = db.scalars(
+        select(models.Income.id).where(
+            models.Income.apartment_id == apartment_id,
+            models.Income.status != "CANCELLED",
+            models.Income.check_in_date < check_out,
+            models.Income.check_out_date > check_in,
+            or_(models.Income.reservation_id.is_(None), models.Income.reservation_id.not_in(active_reservations)),
+        ).order_by(models.Income.check_in_date)
+    ).all()
+    return [str(i) for i in (*reservation_ids, *income_ids)]
+
+
+def _metrics(month, available: int, occupied: float, revenue: float) -> dict:
+    data = {
+        "nights_available": available,
+        "nights_occupied": round(occupied),
+        "occupancy": round(occupied / available, 4) if available else 0.0,
+        "revenue": round(revenue, 2),
+        "adr": round(revenue / occupied, 2) if occupied else 0.0,
+        "revpar": round(revenue / available, 2) if available else 0.0,
+    }
+    if month is not None:
+        data = {"month": month, **data}
+    return data
+
+
+def _sum_months(monthly: list[dict]) -> tuple[int, float, float]:
+    return (
+        sum(m["nights_available"] for m in monthly),
+        sum(m["nights_occupied"] for m in monthly),
+        sum(m["revenue"] for m in monthly),
+    )
+
+
+availability_engine = AvailabilityEngine()
+
+
+# ---------- MANTENIMIENTO TRAS COMMIT ----------
+
+@event.listens_for(Session, "after_flush")
+def _collect_stay_changes(session, flush_context):
+    pending = session.info.setdefault("_availability_changes", set())
+    for obj in session.new:
+        if isinstance(obj, (models.Reservation, models.Income)) and obj.apartment_id:
+            pending.add(obj.apartment_id)
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, (models.Reservation, models.Income)):
+            # Incluye el apartamento anterior si se ha movido la estancia
+            history = inspect(obj).attrs.apartment_id.history
+            for apt_id in (obj.apartment_id, *history.deleted):
+                if apt_id:
+                    pending.add(apt_id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bulk_stay_changes(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, (models.Reservation, models.Income)):
+        orm_execute_state.session.info["_availability_reset"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_stay_changes(session):
+    pending = session.info.pop("_availability_changes", None)
+    if session.info.pop("_availability_reset", False):
+        availability_engine.invalidate()
+        return
+    if pending:
+        availability_engine.invalidate(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_stay_changes(session):
+    session.info.pop("_availability_changes", None)
+    session.info.pop("_availability_reset", None)
@@ -0,0 +1,295 @@
+# app/services/calendar.py
+"""
+Feeds iCal (RFC 5545) por apartamento para channel managers y limpieza.
+
+Los eventos salen de Reservation (no canceladas) y de los Income con fechas
+de estancia que no pertenecen a una reserva ya incluida. El .ics generado se
+guarda en memoria por apartamento junto a su ETag y Last-Modified:
+
+- Los sondeos repetidos se sirven de la caché (o con 304) sin abrir sesión.
+- Cualquier commit que toque Reservation/Income/Apartment invalida solo los
+  apartamentos afectados; los DML masivos vacían la caché entera.
+- El feed exige el calendar_token del apartamento en la URL (comparado en
+  tiempo constante); va guardado en la entrada de caché para no consultar
+  la BD en cada sondeo.
+- CALENDAR_CACHE_TTL acota lo que puede durar una entrada cuando la escritura
+  ocurre en otro proceso. Al regenerar, si el contenido no cambia se conservan
+  ETag y Last-Modified para que los clientes sigan recibiendo 304.
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..db import SessionLocal
+
+CALENDAR_CACHE_TTL = float(os.getenv("CALENDAR_CACHE_TTL", "300"))
+CALENDAR_PAST_DAYS = int(os.getenv("CALENDAR_PAST_DAYS", "90"))
+CALENDAR_PRODID = "-//SES.GASTOS//Calendario apartamentos//ES"
+
+
+@dataclass
+class CalendarFeed:
+    body: bytes
+    etag: str
+    last_modified: datetime
+    built_at: float
+    token: str | None = None
+
+    def token_matches(self, token: str | None) -> bool:
+        if not self.token or not token:
+            return False
+        return hmac.compare_digest(self.token.encode(), token.encode())
+
+    @property
+    def last_modified_http(self) -> str:
+        return format_datetime(self.last_modified, usegmt=True)
+
+    def not_modified(self, if_none_match: str | None, if_modified_since: str | None) -> bool:
+        """Evalúa las cabeceras condicionales (If-None-Match tiene prioridad)"""
+        if if_none_match:
+            tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+            return "*" in tags or self.etag in tags
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return self.last_modified.replace(microsecond=0) <= since
+        return False
+
+
+# ---------- GENERACIÓN ----------
+
+def _escape(text: str) -> str:
+    return (
+        text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n")
+    )
+
+
+def _fold(line: str) -> str:
+    """Corta líneas a 75 octetos como pide RFC 5545 (sin partir caracteres UTF-8)"""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line
+    parts, current, size = [], "", 0
+    for ch in line:
+        width = len(ch.encode("utf-8"))
+        if size + width > (75 if not parts else 74):
+            parts.append(current)
+            current, size = "", 0
+        current += ch
+        size += width
+    parts.append(current)
+    return "\r\n ".join(parts)
+
+
+def _load_events(db: Session, apartment_id: str) -> list[dict]:
+    since = date.today() - timedelta(days=CALENDAR_PAST_DAYS)
+    reservations = db.execute(
+        select(
+            models.Reservation.id, models.Reservation.check_in, models.Reservation.check_out,
+            models.Reservation.channel, models.Reservation.guests, models.Reservation.booking_reference,
+        ).where(
+            models.Reservation.apartment_id == apartment_id,
+            models.Reservation.status != "CANCELLED",
+            models.Reservation.check_out >= since,
+        )
+    ).all()
+    incomes = db.execute(
+        select(
+            models.Income.id, models.Income.reservation_id, models.Income.check_in_date,
+            models.Income.check_out_date, models.Income.source, models.Income.guests_count,
+            models.Income.booking_reference,
+        ).where(
+            models.Income.apartment_id == apartment_id,
+            models.Income.status != "CANCELLED",
+            models.Income.check_in_date.is_not(None),
+            models.Income.check_out_date >= since,
+        )
+    ).all()
+
+    events = []
+    counted = set()
+    for r in reservations:
+        counted.add(r.id)
+        events.append({
+            "uid": f"reservation-{r.id}",
+            "start": r.check_in,
+            "end": r.check_out,
+            "summary": f"Reserva ({r.channel})" if r.channel else "Reserva",
+            "guests": r.guests,
+            "reference": r.booking_reference,
+        })
+    for inc in incomes:
+        if inc.reservation_id in counted:
+            continue
+        events.append({
+            "uid": f"income-{inc.id}",
+            "start": inc.check_in_date,
+            "end": inc.check_out_date,
+            "summary": f"Reserva ({inc.source})" if inc.source else "Reserva",
+            "guests": inc.guests_count,
+            "reference": inc.booking_reference,
+        })
+    events.sort(key=lambda e: (e["start"], e["uid"]))
+    return events
+
+
+def render_ics(apartment: models.Apartment, events: list[dict]) -> bytes:
+    # DTSTAMP fijo (inicio del día) para que el contenido, y con él el ETag,
+    # solo cambie cuando cambian las estancias
+    stamp = datetime.combine(date.today(), datetime.min.time()).strftime("%Y%m%dT%H%M%SZ")
+    name = apartment.name or apartment.code
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{CALENDAR_PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(name)}",
+    ]
+    for e in events:
+        description = []
+        if e["guests"]:
+            description.append(f"Huéspedes: {e['guests']}")
+        if e["reference"]:
+            description.append(f"Referencia: {e['reference']}")
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{e['uid']}@ses-gastos",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{e['start'].strftime('%Y%m%d')}",
+            f"DTEND;VALUE=DATE:{e['end'].strftime('%Y%m%d')}",
+            f"SUMMARY:{_escape(e['summary'])}",
+        ]
+        if description:
+            lines.append(f"DESCRIPTION:{_escape(chr(10).join(description))}")
+        lines += ["TRANSP:OPAQUE", "END:VEVENT"]
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(_fold(line) for line in lines) + "\r\n").encode("utf-8")
+
+
+# ---------- CACHÉ ----------
+
+class CalendarCache:
+    def __init__(self, ttl_seconds: float = CALENDAR_CACHE_TTL, session_factory=SessionLocal):
+        self.ttl_seconds = ttl_seconds
+        self.session_factory = session_factory
+        self._lock = threading.Lock()
+        self._feeds: dict[str, CalendarFeed] = {}
+        # Última versión conocida aunque haya caducado: permite conservar ETag
+        self._previous: dict[str, CalendarFeed] = {}
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, apartment_id: str) -> CalendarFeed | None:
+        """Feed del apartamento; None si no existe. Solo consulta la BD si no hay caché válida"""
+        now = time.monotonic()
+        with self._lock:
+            feed = self._feeds.get(apartment_id)
+            if feed is not None and now - feed.built_at < self.ttl_seconds:
+                self.hits += 1
+                return feed
+
+        db = self.session_factory()
+        try:
+            apartment = db.get(models.Apartment, apartment_id)
+            if apartment is None:
+                return None
+            body = render_ics(apartment, _load_events(db, apartment_id))
+            token = apartment.calendar_token
+        finally:
+            db.close()
+
+        etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        with self._lock:
+            previous = self._feeds.get(apartment_id) or self._previous.get(apartment_id)
+            if previous is not None and previous.etag == etag:
+                last_modified = previous.last_modified
+            else:
+                last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+            feed = CalendarFeed(body, etag, last_modified, now, token)
+            self._feeds[apartment_id] = feed
+            self._previous.pop(apartment_id, None)
+            self.builds += 1
+        return feed
+
+    def invalidate(self, apartment_ids=None):
+        with self._lock:
+            if apartment_ids is None:
+                self._previous.update(self._feeds)
+                self._feeds.clear()
+                return
+            for apt_id in apartment_ids:
+                feed = self._feeds.pop(apt_id, None)
+                if feed is not None:
+                    self._previous[apt_id] = feed
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            return {
+                "apartments_cached": len(self._feeds),
+                "hits": self.hits,
+                "builds": self.builds,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+calendar_cache = CalendarCache()
+
+
+# ---------- INVALIDACIÓN TRAS COMMIT ----------
+
+def _affected_apartment(obj) -> set[str]:
+    if isinstance(obj, models.Apartment):
+        return {obj.id}
+    if isinstance(obj, (models.Reservation, models.Income)):
+        # Incluye el apartamento anterior si se ha movido la estancia
+        history = inspect(obj).attrs.apartment_id.history
+        return {apt_id for apt_id in (obj.apartment_id, *history.deleted) if apt_id}
+    return set()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_calendar_changes(session, flush_context):
+    pending = session.info.setdefault("_calendar_invalidate", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        pending |= _affected_apartment(obj)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bulk_calendar_changes(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, (models.Reservation, models.Income, models.Apartment)):
+        orm_execute_state.session.info["_calendar_reset"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_calendar_changes(session):
+    pending = session.info.pop("_calendar_invalidate", None)
+    if session.info.pop("_calendar_reset", False):
+        calendar_cache.invalidate()
+    elif pending:
+        calendar_cache.invalidate(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_calendar_changes(session):
+    session.info.pop("_calendar_invalidate", None)
+    session.info.pop("_calendar_reset", None)
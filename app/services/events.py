@@ -1,23 +1,99 @@
-﻿import os, httpx
+# app/services/events.py
+"""
+Eventos hacia sistemas externos.
+
+Las rutas no hacen llamadas HTTP: encolan un OutboxEvent en su propia
+transacción (enqueue_*) y el dispatcher de services/outbox.py los entrega
+con reintentos usando los handlers de HANDLERS.
+"""
+from __future__ import annotations
+
+import os
+
+import httpx
+from sqlalchemy.orm import Session
+
+from .. import models
 
 SES_URL = os.getenv("SES_BASE_URL", "").rstrip("/")
+SES_ENDPOINT = "ses"
+
+RESERVATION_CREATED = "reservation.created"
 
-def notify_ses_reservation_created(payload: dict):
+
+def enqueue_event(
+    db: Session,
+    event_type: str,
+    endpoint: str,
+    payload: dict,
+    idempotency_key: str | None = None,
+) -> models.OutboxEvent:
+    """Añade el evento a la sesión; se guarda con el commit de quien llama"""
+    event = models.OutboxEvent(
+        event_type=event_type,
+        endpoint=endpoint,
+        payload=payload,
+        idempotency_key=idempotency_key,
+    )
+    db.add(event)
+    return event
+
+
+def enqueue_ses_reservation_created(
+    db: Session,
+    reservation: models.Reservation,
+) -> models.OutboxEvent | None:
     # Si no hay URL configurada, no hacemos nada
     if not SES_URL:
-        return
-    try:
-        with httpx.Client(timeout=6.0) as client:
-            r = client.post(f"{SES_URL}/api/bookings", json={
-                "check_in": payload["check_in"],
-                "check_out": payload["check_out"],
-                "guests": payload["guests"],
-                "channel": payload.get("channel", "manual"),
-                "email": payload.get("email"),
-                "phone": payload.get("phone"),
-            })
-            r.raise_for_status()
-            booking_id = r.json().get("booking_id")
-            client.post(f"{SES_URL}/api/bookings/{booking_id}/links")
-    except Exception as e:
-        print(f"[SES] notify failed: {e}")
+        return None
+    return enqueue_event(
+        db,
+        RESERVATION_CREATED,
+        SES_ENDPOINT,
+        {
+            "reservation_id": str(reservation.id),
+            "check_in": reservation.check_in.isoformat(),
+            "check_out": reservation.check_out.isoformat(),
+            "guests": reservation.guests,
+            "channel": reservation.channel,
+            "email": reservation.email_contact,
+            "phone": reservation.phone_contact,
+        },
+        # Idempotency-Key hacia SES: el id de la reserva, nunca la clave del
+        # cliente (la clave con ámbito lleva email/ids y es interna del store)
+        str(reservation.id),
+    )
+
+
+# ---------- HANDLERS (los ejecuta el dispatcher) ----------
+
+async def deliver_ses_reservation_created(client: httpx.AsyncClient, payload: dict, idempotency_key: str | None):
+    """
+    Crea el booking en SES.HOSPEDAJES y después sus enlaces.
+
+    El booking_id se guarda en el payload en cuanto se obtiene: si falla el
+    segundo POST, el reintento no vuelve a crear el booking.
+    """
+    if not SES_URL:
+        raise RuntimeError("SES_BASE_URL no configurada")
+    headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
+
+    if not payload.get("booking_id"):
+        r = await client.post(f"{SES_URL}/api/bookings", headers=headers, json={
+            "check_in": payload["check_in"],
+            "check_out": payload["check_out"],
+            "guests": payload["guests"],
+            "channel": payload.get("channel") or "manual",
+            "email": payload.get("email"),
+            "phone": payload.get("phone"),
+        })
+        r.raise_for_status()
+        payload["booking_id"] = r.json().get("booking_id")
+
+    r = await client.post(f"{SES_URL}/api/bookings/{payload['booking_id']}/links", headers=headers)
+    r.raise_for_status()
+
+
+HANDLERS = {
+    RESERVATION_CREATED: deliver_ses_reservation_created,
+}
@@ -0,0 +1,127 @@
+# app/services/expense_import.py
+"""
+Importación masiva de gastos (POST /api/v1/expenses/bulk e import_bank_csv.py).
+
+1. Validación de todas las filas en una pasada de pydantic (TypeAdapter sobre
+   la lista completa), recogiendo los errores por índice de fila.
+2. Resolución de apartamentos (por id o por código) con una sola consulta
+   limitada a la cuenta.
+3. Inserción en bloque: COPY en PostgreSQL (psycopg 3) y executemany en el
+   resto de motores.
+"""
+from __future__ import annotations
+
+import os
+import uuid
+from collections import defaultdict
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import insert, or_, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from .. import models, schemas
+from .stats import mark_stats_dirty
+
+BULK_MAX_ROWS = int(os.getenv("EXPENSES_BULK_MAX_ROWS", "5000"))
+
+# Orden de columnas para COPY / executemany
+_COLUMNS = (
+    "id", "apartment_id", "date", "amount_gross", "currency", "category",
+    "description", "vendor", "invoice_number", "source", "vat_rate",
+    "file_url", "status",
+)
+
+_ROWS_ADAPTER = TypeAdapter(list[schemas.ExpenseBulkRow])
+
+
+def validate_rows(raw_rows: list[dict]) -> tuple[dict[int, schemas.ExpenseBulkRow], dict[int, list[str]]]:
+    """Devuelve ({índice: fila válida}, {índice: [errores]})"""
+    errors: dict[int, list[str]] = defaultdict(list)
+    try:
+        valid_idx = list(range(len(raw_rows)))
+        parsed = _ROWS_ADAPTER.validate_python(raw_rows)
+    except ValidationError as exc:
+        for err in exc.errors(include_url=False):
+            index, *field = err["loc"]
+            errors[index].append(f"{'.'.join(str(f) for f in field) or 'row'}: {err['msg']}")
+        # Segunda pasada solo con las filas sin errores: ya no puede fallar
+        valid_idx = [i for i in range(len(raw_rows)) if i not in errors]
+        parsed = _ROWS_ADAPTER.validate_python([raw_rows[i] for i in valid_idx])
+
+    rows = {}
+    for index, row in zip(valid_idx, parsed):
+        if not row.apartment_id and not row.apartment_code:
+            errors[index].append("apartment_id_or_code_required")
+        else:
+            rows[index] = row
+    return rows, dict(errors)
+
+
+def resolve_apartments(db: Session, account_id: str, rows) -> tuple[set[str], dict[str, str]]:
+    """Una consulta para todos los apartamentos referenciados: (ids válidos, código -> id)"""
+    ids = {r.apartment_id for r in rows if r.apartment_id}
+    codes = {r.apartment_code for r in rows if r.apartment_code and not r.apartment_id}
+    if not ids and not codes:
+        return set(), {}
+
+    found = db.execute(
+        select(models.Apartment.id, models.Apartment.code).where(
+            models.Apartment.account_id == account_id,
+            or_(models.Apartment.id.in_(ids), models.Apartment.code.in_(codes)),
+        )
+    ).all()
+    return {r.id for r in found}, {r.code: r.id for r in found}
+
+
+def insert_expenses(db: Session, records: list[dict]) -> None:
+    """Inserta en la transacción de la sesión; el commit lo hace quien llama"""
+    if not records:
+        return
+    conn = db.connection()
+    if conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg":
+        raw = conn.connection.driver_connection
+        statement = f"COPY {models.Expense.__tablename__} ({', '.join(_COLUMNS)}) FROM STDIN"
+        try:
+            with raw.cursor() as cur:
+                with cur.copy(statement) as copy:
+                    for record in records:
+                        copy.write_row([record[c] for c in _COLUMNS])
+        except conn.dialect.loaded_dbapi.Error as ex:
+            # Mismo tipo de error que el camino ORM para que el router lo trate igual
+            raise DBAPIError(statement, None, ex) from ex
+        mark_stats_dirty(db)
+    else:
+        db.execute(insert(models.Expense), records)
+
+
+def import_expenses(db: Session, account_id: str, raw_rows: list[dict], atomic: bool = False) -> dict:
+    """Valida, resuelve apartamentos e inserta. Devuelve el dict de ExpenseBulkOut."""
+    rows, errors = validate_rows(raw_rows)
+    apartment_ids, code_to_id = resolve_apartments(db, account_id, rows.values())
+
+    records = []
+    for index, row in sorted(rows.items()):
+        if row.apartment_id:
+            apartment_id = row.apartment_id if row.apartment_id in apartment_ids else None
+        else:
+            apartment_id = code_to_id.get(row.apartment_code)
+        if apartment_id is None:
+            errors.setdefault(index, []).append("apartment_not_found_in_account")
+            continue
+
+        record = row.model_dump(include=set(_COLUMNS))
+        record["id"] = str(uuid.uuid4())
+        record["apartment_id"] = apartment_id
+        records.append(record)
+
+    if atomic and errors:
+        records = []
+    insert_expenses(db, records)
+
+    return {
+        "received": len(raw_rows),
+        "inserted": len(records),
+        "ids": [r["id"] for r in records],
+        "errors": [{"index": i, "errors": errs} for i, errs in sorted(errors.items())],
+    }
@@ -0,0 +1,261 @@
+# app/services/export.py
+"""
+Exportación en streaming de gastos, ingresos y reservas (CSV, JSONL, XLSX).
+
+Las filas se leen con `yield_per` (cursor de servidor en PostgreSQL) y se
+serializan por lotes, de modo que la memoria usada no depende del número de
+filas exportadas. El XLSX se genera con `zipfile` de la librería estándar
+escribiendo la hoja fila a fila, sin dependencias extra.
+
+Los textos que empiezan por =, +, -, @, tabulador o retorno de carro se
+exportan con un apóstrofo delante (CSV y XLSX): descripciones, proveedores o
+nombres de huésped vienen del OCR, de emails o de los usuarios, y Excel los
+ejecutaría como fórmulas.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable, Iterator
+from xml.sax.saxutils import escape
+
+from sqlalchemy import select
+
+from .. import models
+from ..db import ReadSessionLocal
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# dataset -> (modelo, columnas exportadas, columna de fecha para filtros)
+EXPORT_DATASETS = {
+    "expenses": (
+        models.Expense,
+        ("id", "date", "apartment_code", "amount_gross", "currency", "category",
+         "description", "vendor", "invoice_number", "vat_rate", "source", "status",
+         "created_at"),
+        "date",
+    ),
+    "incomes": (
+        models.Income,
+        ("id", "date", "apartment_code", "amount_gross", "currency", "status",
+         "source", "guest_name", "guest_email", "booking_reference",
+         "check_in_date", "check_out_date", "guests_count", "created_at"),
+        "date",
+    ),
+    "reservations": (
+        models.Reservation,
+        ("id", "check_in", "check_out", "apartment_code", "guests", "channel",
+         "guest_name", "email_contact", "phone_contact", "status",
+         "booking_reference", "total_amount", "currency", "created_at"),
+        "check_in",
+    ),
+}
+
+
+def _export_query(dataset: str, account_id: str, apartment_id=None, date_from=None, date_to=None):
+    model, fields, date_field = EXPORT_DATASETS[dataset]
+    columns = [
+        models.Apartment.code.label("apartment_code") if name == "apartment_code" else getattr(model, name)
+        for name in fields
+    ]
+    date_col = getattr(model, date_field)
+
+    stmt = (
+        select(*columns)
+        .join(models.Apartment, model.apartment_id == models.Apartment.id)
+        .where(models.Apartment.account_id == account_id)
+    )
+    if apartment_id:
+        stmt = stmt.where(model.apartment_id == apartment_id)
+    if date_from:
+        stmt = stmt.where(date_col >= date_from)
+    if date_to:
+        stmt = stmt.where(date_col <= date_to)
+    return stmt.order_by(date_col, model.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def iter_export_rows(dataset: str, account_id: str, **filters) -> Iterator[tuple]:
+    """
+    Itera las filas del dataset de la cuenta con un cursor de servidor.
+
+    Abre su propia sesión (la de la dependencia ya está cerrada cuando
+    StreamingResponse consume el generador) y la cierra al terminar o si el
+    cliente corta la descarga.
+    """
+    db = ReadSessionLocal()
+    try:
+        result = db.execute(_export_query(dataset, account_id, **filters))
+        for partition in result.partitions():
+            yield from partition
+    finally:
+        db.close()
+
+
+def _plain(value):
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, bool, int, float, str)):
+        return value
+    return str(value)  # UUID y similares
+
+
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _safe_cell(value):
+    """Neutraliza la inyección de fórmulas en hojas de cálculo (solo textos)"""
+    value = _plain(value)
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+# ---------- FORMATOS ----------
+
+def stream_csv(fields: Iterable[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    """CSV en UTF-8 con BOM para que Excel respete los acentos"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(fields)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(["" if v is None else _safe_cell(v) for v in row])
+        if i % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def stream_jsonl(fields: Iterable[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    """Un objeto JSON por línea; importes como string para no perder precisión"""
+    fields = list(fields)
+    chunk = []
+    for row in rows:
+        record = {
+            k: (str(v) if isinstance(v, Decimal) else _plain(v))
+            for k, v in zip(fields, row)
+        }
+        chunk.append(json.dumps(record, ensure_ascii=False))
+        if len(chunk) >= EXPORT_BATCH_SIZE:
+            yield ("\n".join(chunk) + "\n").encode("utf-8")
+            chunk = []
+    if chunk:
+        yield ("\n".join(chunk) + "\n").encode("utf-8")
+
+
+class _ChunkSink:
+    """Destino no 'seekable' para zipfile: acumula bytes hasta que se vacían"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+_XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_workbook(sheet_name: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def _xlsx_row(values) -> str:
+    cells = []
+    for v in values:
+        if v is None:
+            cells.append("<c/>")
+        elif isinstance(v, (int, float, Decimal)) and not isinstance(v, bool):
+            cells.append(f"<c><v>{v}</v></c>")
+        else:
+            cells.append(f'<c t="inlineStr"><is><t>{escape(str(_safe_cell(v)))}</t></is></c>')
+    return "<row>" + "".join(cells) + "</row>"
+
+
+def stream_xlsx(fields: Iterable[str], rows: Iterable[tuple], sheet_name: str = "export") -> Iterator[bytes]:
+    """
+    Hoja única con celdas inline (sin sharedStrings) escrita en streaming.
+    Fechas como texto ISO para no depender de estilos.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in _XLSX_STATIC.items():
+            zf.writestr(name, content)
+        zf.writestr("xl/workbook.xml", _xlsx_workbook(sheet_name))
+        yield sink.drain()
+
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(fields).encode("utf-8"))
+            for i, row in enumerate(rows, 1):
+                sheet.write(_xlsx_row(row).encode("utf-8"))
+                if i % EXPORT_BATCH_SIZE == 0:
+                    yield sink.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+
+_WRITERS = {"csv": stream_csv, "jsonl": stream_jsonl, "xlsx": stream_xlsx}
+
+
+def stream_export(dataset: str, fmt: str, account_id: str, **filters) -> Iterator[bytes]:
+    """Generador de bytes listo para StreamingResponse"""
+    _, fields, _ = EXPORT_DATASETS[dataset]
+    rows = iter_export_rows(dataset, account_id, **filters)
+    if fmt == "xlsx":
+        return stream_xlsx(fields, rows, sheet_name=dataset)
+    return _WRITERS[fmt](fields, rows)
@@ -0,0 +1,238 @@
+# app/services/llm.py
+"""
+Proveedores de LLM y embeddings intercambiables.
+
+Todo el código que habla con OpenAI (extracción de gastos del bot y del
+chat, embeddings de /admin/vectors) pasa por get_llm_provider(), que elige
+la implementación con LLM_PROVIDER:
+
+- openai  (por defecto): cliente real; la clave solo se exige al primer uso.
+- fake:   respuestas deterministas sin red, con latencia configurable
+          (LLM_FAKE_LATENCY_MS) para pruebas de carga.
+- record: llama al cliente real y guarda cada respuesta en el cassette
+          (LLM_CASSETTE, JSONL).
+- replay: responde solo desde el cassette; una petición no grabada es un
+          error (CassetteMiss), nunca una llamada a la red.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = 1536
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+LLM_CASSETTE = os.getenv("LLM_CASSETTE", "llm_cassette.jsonl")
+LLM_FAKE_LATENCY_MS = float(os.getenv("LLM_FAKE_LATENCY_MS", "0"))
+LLM_FAKE_JITTER_MS = float(os.getenv("LLM_FAKE_JITTER_MS", "0"))
+
+
+class CassetteMiss(LookupError):
+    """La petición no está grabada en el cassette (modo replay)"""
+
+
+class LLMProvider:
+    name = "base"
+
+    def complete(self, messages: list[dict], model: str = OPENAI_MODEL, temperature: float = 0) -> str:
+        raise NotImplementedError
+
+    def embed(self, text: str, model: str = EMBEDDING_MODEL) -> list[float]:
+        raise NotImplementedError
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self, api_key: str | None = None):
+        self._api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    api_key = self._api_key or os.getenv("OPENAI_API_KEY")
+                    if not api_key:
+                        raise RuntimeError("OPENAI_API_KEY no configurada")
+                    from openai import OpenAI
+                    # Sin reintentos propios: los hace la pasarela (services/llm_gateway.py)
+                    self._client = OpenAI(api_key=api_key, max_retries=0)
+        return self._client
+
+    def complete(self, messages, model=OPENAI_MODEL, temperature=0):
+        resp = self.client.chat.completions.create(model=model, messages=messages, temperature=temperature)
+        return resp.choices[0].message.content or ""
+
+    def embed(self, text, model=EMBEDDING_MODEL):
+        resp = self.client.embeddings.create(model=model, input=text)
+        return resp.data[0].embedding
+
+
+# ---------- FAKE DETERMINISTA ----------
+
+_AMOUNT_RE = re.compile(r"(?<![\d.,])(\d{1,6}(?:[.,]\d{3})*[.,]\d{2})(?!\d)")
+_DATE_RE = re.compile(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})\b|\b(\d{4})-(\d{2})-(\d{2})\b")
+_INVOICE_RE = re.compile(r"(?:factura|invoice|n[ºo°]\.?|ticket)\s*[:#]?\s*([A-Z0-9][A-Z0-9/-]{2,})", re.IGNORECASE)
+_OCR_BLOCK_RE = re.compile(r"<<<\s*(.*?)\s*>>>", re.DOTALL)
+
+
+def _parse_amount(raw: str) -> float:
+    # El separador decimal es el último: 1.234,56 (europeo) o 1,234.56
+    if raw[-3] == ",":
+        return float(raw.replace(".", "").replace(",", "."))
+    return float(raw.replace(",", ""))
+
+
+def _fake_expense(text: str) -> dict:
+    """Extracción "razonable" sin LLM: el mayor importe, la primera fecha y la primera línea como proveedor"""
+    data = {}
+    amounts = [_parse_amount(a) for a in _AMOUNT_RE.findall(text)]
+    if amounts:
+        data["amount_gross"] = max(amounts)
+    m = _DATE_RE.search(text)
+    if m:
+        if m.group(4):
+            data["date"] = f"{m.group(4)}-{m.group(5)}-{m.group(6)}"
+        else:
+            year = int(m.group(3)) + (2000 if len(m.group(3)) == 2 else 0)
+            day, month = int(m.group(1)), int(m.group(2))
+            if 1 <= month <= 12 and 1 <= day <= 31:
+                data["date"] = f"{year:04d}-{month:02d}-{day:02d}"
+    m = _INVOICE_RE.search(text)
+    if m:
+        data["invoice_number"] = m.group(1)
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if lines:
+        data["vendor"] = lines[0][:80]
+        data["description"] = " ".join(lines[:3])[:200]
+    return data
+
+
+class FakeProvider(LLMProvider):
+    name = "fake"
+
+    def __init__(self, latency_ms: float = LLM_FAKE_LATENCY_MS, jitter_ms: float = LLM_FAKE_JITTER_MS):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls = 0
+
+    def _sleep(self, key: str):
+        self.calls += 1
+        if self.latency_ms or self.jitter_ms:
+            # Jitter determinista por petición: dos ejecuciones iguales tardan lo mismo
+            jitter = random.Random(key).uniform(-self.jitter_ms, self.jitter_ms)
+            time.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+
+    def complete(self, messages, model=OPENAI_MODEL, temperature=0):
+        prompt = messages[-1]["content"] if messages else ""
+        self._sleep(prompt)
+        blocks = _OCR_BLOCK_RE.findall(prompt)
+        if len(blocks) > 1:
+            # Prompt de lote (extract_expense_json_batch_async): un objeto por bloque
+            return json.dumps({"items": [_fake_expense(block) for block in blocks]}, ensure_ascii=False)
+        return json.dumps(_fake_expense(blocks[0] if blocks else prompt), ensure_ascii=False)
+
+    def embed(self, text, model=EMBEDDING_MODEL):
+        self._sleep(text)
+        rng = random.Random(hashlib.sha256(text.encode()).digest())
+        vector = [rng.gauss(0, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+
+# ---------- CASSETTE (RECORD / REPLAY) ----------
+
+def _request_key(kind: str, model: str, payload) -> str:
+    raw = json.dumps([kind, model, payload], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class CassetteProvider(LLMProvider):
+    """Graba (record) o reproduce (replay) respuestas en un fichero JSONL"""
+
+    def __init__(self, path: str = LLM_CASSETTE, mode: str = "replay", inner: LLMProvider | None = None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"modo de cassette no válido: {mode}")
+        self.path = path
+        self.mode = mode
+        self.name = mode
+        self.inner = inner or (OpenAIProvider() if mode == "record" else None)
+        self._lock = threading.Lock()
+        self._entries: dict[str, object] = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]] = entry["response"]
+
+    def _lookup(self, kind: str, model: str, payload, call):
+        key = _request_key(kind, model, payload)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        if self.mode == "replay":
+            raise CassetteMiss(f"{kind} no grabado en {self.path} ({key[:12]})")
+
+        response = call()
+        with self._lock:
+            self._entries[key] = response
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "kind": kind, "model": model, "response": response},
+                                   ensure_ascii=False) + "\n")
+        return response
+
+    def complete(self, messages, model=OPENAI_MODEL, temperature=0):
+        return self._lookup("complete", model, {"messages": messages, "temperature": temperature},
+                            lambda: self.inner.complete(messages, model=model, temperature=temperature))
+
+    def embed(self, text, model=EMBEDDING_MODEL):
+        return self._lookup("embed", model, text, lambda: self.inner.embed(text, model=model))
+
+
+# ---------- SELECCIÓN ----------
+
+_provider: LLMProvider | None = None
+_provider_lock = threading.Lock()
+
+
+def _build_provider(kind: str) -> LLMProvider:
+    if kind == "fake":
+        return FakeProvider()
+    if kind in ("record", "replay"):
+        return CassetteProvider(LLM_CASSETTE, mode=kind)
+    if kind == "openai":
+        return OpenAIProvider()
+    raise ValueError(f"LLM_PROVIDER no válido: {kind}")
+
+
+def get_llm_provider() -> LLMProvider:
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = _build_provider(LLM_PROVIDER)
+                print(f"[LLM] 🤖 Proveedor: {_provider.name}")
+    return _provider
+
+
+def set_llm_provider(provider: LLMProvider | None):
+    """Sustituye el proveedor del proceso (benchmarks, scripts); None vuelve al de LLM_PROVIDER"""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,332 @@
+# app/services/llm_gateway.py
+"""
+Pasarela única de llamadas al LLM para todo el proceso.
+
+Bots de Telegram, /api/v1/chat/* y /admin/vectors/* comparten:
+- Un semáforo global (LLM_MAX_CONCURRENCY) de llamadas en vuelo.
+- Token buckets de peticiones y tokens por minuto según el tier de OpenAI
+  (LLM_RPM / LLM_TPM para chat, LLM_EMBED_RPM / LLM_EMBED_TPM para embeddings):
+  en vez de provocar 429 en ráfagas, las llamadas esperan su turno.
+- Presupuesto diario de tokens por cuenta (LLM_ACCOUNT_DAILY_TOKENS, 0 = sin
+  límite) y contadores de uso por cuenta, en memoria del proceso.
+- Coalescencia: peticiones idénticas en vuelo esperan un único resultado.
+- Reintentos con backoff ante 429/errores transitorios del proveedor: son
+  la única capa de reintentos (el cliente OpenAI va con max_retries=0), cada
+  intento vuelve a pasar por los cubos y el backoff no ocupa plaza del
+  semáforo.
+
+La pasarela vive en su propio event loop (hilo daemon) para poder
+coordinar llamadas que llegan desde hilos y loops distintos: las rutas async
+usan `await llm_gateway.complete(...)` y el código síncrono
+`llm_gateway.complete_sync(...)`. El proveedor real es el de services/llm.py.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from ..metrics import metrics_registry
+from .llm import EMBEDDING_MODEL, OPENAI_MODEL, get_llm_provider
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_RPM = float(os.getenv("LLM_RPM", "500"))
+LLM_TPM = float(os.getenv("LLM_TPM", "200000"))
+LLM_EMBED_RPM = float(os.getenv("LLM_EMBED_RPM", "3000"))
+LLM_EMBED_TPM = float(os.getenv("LLM_EMBED_TPM", "1000000"))
+LLM_ACCOUNT_DAILY_TOKENS = int(os.getenv("LLM_ACCOUNT_DAILY_TOKENS", "0"))
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "300"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+
+
+class LLMBudgetExceeded(RuntimeError):
+    def __init__(self, account_id: str, used: int, budget: int):
+        super().__init__(f"Presupuesto diario de IA agotado para la cuenta {account_id} ({used}/{budget} tokens)")
+        self.account_id = account_id
+        self.used = used
+        self.budget = budget
+
+
+def estimate_tokens(text: str) -> int:
+    # Aproximación de OpenAI: ~4 caracteres por token
+    return max(1, math.ceil(len(text or "") / 4))
+
+
+def _is_retryable(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return exc.__class__.__name__ in ("RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError")
+
+
+class TokenBucket:
+    """Cubo de capacidad `per_minute` que se rellena de forma continua"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.waited_seconds = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        if self.capacity <= 0:
+            return  # sin límite
+        amount = min(amount, self.capacity)  # una petición enorme no debe bloquear para siempre
+        async with self._lock:  # FIFO: nadie se cuela mientras otro espera
+            self._refill()
+            if self.tokens < amount:
+                wait = (amount - self.tokens) / self.rate
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= amount
+
+
+class _Usage:
+    __slots__ = ("day", "tokens", "requests", "coalesced", "errors", "total_tokens", "total_requests")
+
+    def __init__(self):
+        self.day = None
+        self.tokens = 0
+        self.requests = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.total_tokens = 0
+        self.total_requests = 0
+
+    def roll(self, today):
+        if self.day != today:
+            self.day, self.tokens, self.requests = today, 0, 0
+
+    def to_dict(self) -> dict:
+        return {
+            "day": self.day.isoformat() if self.day else None,
+            "tokens_today": self.tokens,
+            "requests_today": self.requests,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "total_tokens": self.total_tokens,
+            "total_requests": self.total_requests,
+        }
+
+
+class LLMGateway:
+    def __init__(self, provider_getter=get_llm_provider, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 daily_budget: int = LLM_ACCOUNT_DAILY_TOKENS):
+        self.provider_getter = provider_getter
+        self.max_concurrency = max_concurrency
+        self.daily_budget = daily_budget
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._semaphore: asyncio.Semaphore | None = None
+        self._buckets: dict[str, tuple[TokenBucket, TokenBucket]] = {}
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._usage: dict[str, _Usage] = {}
+        self._usage_lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.retries = 0
+        self._calls: dict[str, list] = {}  # kind -> [llamadas, tokens prompt, tokens respuesta, segundos]
+
+    # ---------- LOOP PROPIO ----------
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._start_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    ready = threading.Event()
+
+                    def _run():
+                        asyncio.set_event_loop(loop)
+                        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                        self._buckets = {
+                            "complete": (TokenBucket(LLM_RPM), TokenBucket(LLM_TPM)),
+                            "embed": (TokenBucket(LLM_EMBED_RPM), TokenBucket(LLM_EMBED_TPM)),
+                        }
+                        ready.set()
+                        loop.run_forever()
+
+                    self._thread = threading.Thread(target=_run, name="llm-gateway", daemon=True)
+                    self._thread.start()
+                    ready.wait()
+                    self._loop = loop
+        return self._loop
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    # ---------- PRESUPUESTO / USO ----------
+
+    def _usage_for(self, account_id: str | None) -> _Usage:
+        key = account_id or "_system"
+        with self._usage_lock:
+            usage = self._usage.get(key)
+            if usage is None:
+                usage = self._usage[key] = _Usage()
+            usage.roll(datetime.now(timezone.utc).date())
+            return usage
+
+    def _check_budget(self, account_id: str | None, estimate: int):
+        if not account_id or self.daily_budget <= 0:
+            return
+        usage = self._usage_for(account_id)
+        if usage.tokens + estimate > self.daily_budget:
+            raise LLMBudgetExceeded(account_id, usage.tokens, self.daily_budget)
+
+    def _charge(self, account_id: str | None, tokens: int):
+        usage = self._usage_for(account_id)
+        with self._usage_lock:
+            usage.tokens += tokens
+            usage.requests += 1
+            usage.total_tokens += tokens
+            usage.total_requests += 1
+
+    # ---------- EJECUCIÓN ----------
+
+    def _record_call(self, kind: str, model: str, seconds: float, prompt_tokens: int, completion_tokens: int):
+        with self._usage_lock:
+            totals = self._calls.setdefault(kind, [0, 0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += completion_tokens
+            totals[3] += seconds
+        metrics_registry.record_llm_call(kind, model, seconds, prompt_tokens, completion_tokens)
+
+    async def _execute(self, kind: str, model: str, call, prompt_tokens: int, account_id: str | None):
+        requests_bucket, tokens_bucket = self._buckets[kind]
+        expected = prompt_tokens + (LLM_COMPLETION_TOKENS_ESTIMATE if kind == "complete" else 0)
+
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            # Cada intento es una petición más para el proveedor: pasa por los cubos
+            await requests_bucket.acquire(1)
+            await tokens_bucket.acquire(expected)
+            try:
+                async with self._semaphore:
+                    self.in_flight += 1
+                    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                    try:
+                        started = time.perf_counter()
+                        result = await asyncio.get_running_loop().run_in_executor(self._executor, call)
+                    finally:
+                        self.in_flight -= 1
+                completion_tokens = estimate_tokens(result) if isinstance(result, str) else 0
+                self._record_call(kind, model, time.perf_counter() - started, prompt_tokens, completion_tokens)
+                return result
+            except Exception as e:
+                if attempt >= LLM_MAX_RETRIES or not _is_retryable(e):
+                    self._usage_for(account_id).errors += 1
+                    raise
+                self.retries += 1
+                delay = LLM_RETRY_BASE_SECONDS * 2 ** attempt * random.uniform(0.8, 1.2)
+                print(f"[LLM] ⏳ {e.__class__.__name__}, reintento {attempt + 1} en {delay:.1f}s")
+                # El backoff se espera sin ocupar plaza del semáforo
+                await asyncio.sleep(delay)
+
+    async def _coalesced(self, kind: str, model: str, key_payload, call, prompt_tokens: int, account_id: str | None):
+        key = hashlib.sha256(
+            json.dumps([kind, key_payload], sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self._usage_for(account_id).coalesced += 1
+            return await asyncio.shield(pending)
+
+        self._check_budget(account_id, prompt_tokens)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._execute(kind, model, call, prompt_tokens, account_id)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # marcado como recuperado si nadie más esperaba
+            raise
+        else:
+            future.set_result(result)
+            completion_tokens = estimate_tokens(result) if isinstance(result, str) else 0
+            self._charge(account_id, prompt_tokens + completion_tokens)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def _complete_coro(self, messages, model, temperature, account_id):
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+        provider = self.provider_getter()
+        return self._coalesced(
+            "complete", model, [model, temperature, messages],
+            lambda: provider.complete(messages, model=model, temperature=temperature),
+            prompt_tokens, account_id,
+        )
+
+    def _embed_coro(self, text, model, account_id):
+        provider = self.provider_getter()
+        return self._coalesced(
+            "embed", model, [model, text], lambda: provider.embed(text, model=model), estimate_tokens(text), account_id,
+        )
+
+    # ---------- API PÚBLICA ----------
+
+    async def complete(self, messages: list[dict], model: str = OPENAI_MODEL, temperature: float = 0,
+                       account_id: str | None = None) -> str:
+        return await asyncio.wrap_future(self._submit(self._complete_coro(messages, model, temperature, account_id)))
+
+    async def embed(self, text: str, model: str = EMBEDDING_MODEL, account_id: str | None = None) -> list[float]:
+        return await asyncio.wrap_future(self._submit(self._embed_coro(text, model, account_id)))
+
+    def complete_sync(self, messages: list[dict], model: str = OPENAI_MODEL, temperature: float = 0,
+                      account_id: str | None = None) -> str:
+        return self._submit(self._complete_coro(messages, model, temperature, account_id)).result()
+
+    def embed_sync(self, text: str, model: str = EMBEDDING_MODEL, account_id: str | None = None) -> list[float]:
+        return self._submit(self._embed_coro(text, model, account_id)).result()
+
+    def usage(self, account_id: str) -> dict:
+        data = self._usage_for(account_id).to_dict()
+        data["daily_budget"] = self.daily_budget or None
+        return data
+
+    def stats(self) -> dict:
+        with self._usage_lock:
+            accounts = {k: u.to_dict() for k, u in self._usage.items()}
+            calls = {
+                kind: {"calls": n, "prompt_tokens": prompt, "completion_tokens": completion,
+                       "avg_prompt_tokens": round(prompt / n, 1), "avg_ms": round(seconds / n * 1000, 1)}
+                for kind, (n, prompt, completion, seconds) in self._calls.items()
+            }
+        buckets = {
+            kind: {"rpm": rb.capacity, "tpm": tb.capacity,
+                   "waited_seconds": round(rb.waited_seconds + tb.waited_seconds, 3)}
+            for kind, (rb, tb) in self._buckets.items()
+        }
+        return {
+            "provider": self.provider_getter().name,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "inflight_keys": len(self._inflight),
+            "retries": self.retries,
+            "daily_budget": self.daily_budget or None,
+            "buckets": buckets,
+            "calls": calls,
+            "accounts": accounts,
+        }
+
+
+llm_gateway = LLMGateway()
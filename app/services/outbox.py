@@ -0,0 +1,243 @@
+# app/services/outbox.py
+"""
+Dispatcher del outbox de eventos (tabla outbox_events).
+
+- Reclama lotes de eventos vencidos con SELECT ... FOR UPDATE SKIP LOCKED
+  (en PostgreSQL varios procesos pueden drenar a la vez) y los marca como
+  PROCESSING con un lease: si el proceso muere, el evento se vuelve a
+  reclamar cuando vence el lease.
+- Entrega cada lote en paralelo con un único httpx.AsyncClient (pool de
+  conexiones) y un semáforo por endpoint para no saturar a cada destino.
+- Reintenta con backoff exponencial + jitter hasta OUTBOX_MAX_ATTEMPTS; los
+  4xx (salvo 408/429) no se reintentan. Un evento cuyo lease vence en el
+  último intento (el proceso murió entregándolo) pasa a FAILED al
+  reclamarlo, no se reintenta indefinidamente.
+
+Se arranca en el startup de la app (OUTBOX_DISPATCHER=1) o como proceso
+aparte:  python -m app.services.outbox
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from sqlalchemy import func, select
+
+from .. import models
+from ..db import SessionLocal
+from .events import HANDLERS
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_HTTP_TIMEOUT = float(os.getenv("OUTBOX_HTTP_TIMEOUT", "6"))
+OUTBOX_ENDPOINT_CONCURRENCY = int(os.getenv("OUTBOX_ENDPOINT_CONCURRENCY", "4"))
+
+
+def _endpoint_limits() -> dict[str, int]:
+    """OUTBOX_ENDPOINT_LIMITS="ses=2,otro=8" sobrescribe la concurrencia por endpoint"""
+    limits = {}
+    for item in os.getenv("OUTBOX_ENDPOINT_LIMITS", "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip().isdigit():
+            limits[name.strip()] = int(value)
+    return limits
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status >= 500 or status in (408, 429)
+    return True
+
+
+class OutboxDispatcher:
+    def __init__(self, session_factory=SessionLocal, handlers: dict | None = None):
+        self.session_factory = session_factory
+        self.handlers = handlers if handlers is not None else HANDLERS
+        self.batch_size = OUTBOX_BATCH_SIZE
+        self.max_attempts = OUTBOX_MAX_ATTEMPTS
+        self._limits = _endpoint_limits()
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._client: httpx.AsyncClient | None = None
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    # ---------- BD (síncrono, se ejecuta en un hilo) ----------
+
+    def _claim_batch(self) -> list[dict]:
+        db = self.session_factory()
+        try:
+            now = _utcnow()
+            events = db.scalars(
+                select(models.OutboxEvent)
+                .where(
+                    models.OutboxEvent.status.in_(("PENDING", "PROCESSING")),
+                    models.OutboxEvent.next_attempt_at <= now,
+                )
+                .order_by(models.OutboxEvent.next_attempt_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+
+            claimed = []
+            for event in events:
+                if event.status == "PROCESSING" and event.attempts >= self.max_attempts:
+                    event.status = "FAILED"
+                    event.last_error = f"Lease vencido en el intento {event.attempts} (el proceso no terminó la entrega)"
+                    self.failed += 1
+                    print(f"[OUTBOX] ❌ Evento {event.id} ({event.event_type}) descartado: {event.last_error}")
+                    continue
+                event.status = "PROCESSING"
+                event.attempts += 1
+                event.next_attempt_at = now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+                claimed.append({
+                    "id": event.id,
+                    "event_type": event.event_type,
+                    "endpoint": event.endpoint,
+                    "payload": dict(event.payload or {}),
+                    "idempotency_key": event.idempotency_key,
+                    "attempts": event.attempts,
+                })
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    def _record_results(self, results: list[tuple[dict, Exception | None]]):
+        db = self.session_factory()
+        try:
+            now = _utcnow()
+            for claimed, error in results:
+                event = db.get(models.OutboxEvent, claimed["id"])
+                if event is None:
+                    continue
+                event.payload = claimed["payload"]  # conserva el progreso parcial del handler
+                if error is None:
+                    event.status = "SENT"
+                    event.sent_at = now
+                    event.last_error = None
+                    self.sent += 1
+                    continue
+
+                event.last_error = f"{error.__class__.__name__}: {error}"[:1000]
+                if not _is_retryable(error) or event.attempts >= self.max_attempts:
+                    event.status = "FAILED"
+                    self.failed += 1
+                    print(f"[OUTBOX] ❌ Evento {event.id} ({event.event_type}) descartado tras {event.attempts} intentos: {event.last_error}")
+                else:
+                    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (event.attempts - 1))
+                    event.status = "PENDING"
+                    event.next_attempt_at = now + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+                    self.retried += 1
+            db.commit()
+        finally:
+            db.close()
+
+    # ---------- ENTREGA ----------
+
+    def _semaphore(self, endpoint: str) -> asyncio.Semaphore:
+        if endpoint not in self._semaphores:
+            self._semaphores[endpoint] = asyncio.Semaphore(self._limits.get(endpoint, OUTBOX_ENDPOINT_CONCURRENCY))
+        return self._semaphores[endpoint]
+
+    async def _deliver(self, claimed: dict) -> tuple[dict, Exception | None]:
+        handler = self.handlers.get(claimed["event_type"])
+        if handler is None:
+            return claimed, ValueError(f"sin handler para {claimed['event_type']}")
+        async with self._semaphore(claimed["endpoint"]):
+            try:
+                await handler(self._client, claimed["payload"], claimed["idempotency_key"])
+                return claimed, None
+            except Exception as e:
+                return claimed, e
+
+    async def run_once(self) -> int:
+        """Reclama y entrega un lote. Devuelve cuántos eventos procesó."""
+        batch = await asyncio.to_thread(self._claim_batch)
+        if not batch:
+            return 0
+        results = await asyncio.gather(*(self._deliver(e) for e in batch))
+        await asyncio.to_thread(self._record_results, list(results))
+        return len(batch)
+
+    async def run_forever(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        total_limit = max(OUTBOX_ENDPOINT_CONCURRENCY, *self._limits.values(), 1) * 4
+        async with httpx.AsyncClient(
+            timeout=OUTBOX_HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=total_limit, max_keepalive_connections=total_limit),
+        ) as client:
+            self._client = client
+            print("[OUTBOX] 🚚 Dispatcher iniciado")
+            while True:
+                try:
+                    processed = await self.run_once()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[OUTBOX] ❌ Error en el dispatcher: {e}")
+                    processed = 0
+                if processed >= self.batch_size:
+                    continue  # hay cola: seguir drenando sin esperar
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    def wake(self):
+        """Despierta al dispatcher tras encolar (seguro desde hilos del threadpool)"""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        db = self.session_factory()
+        try:
+            counts = dict(db.execute(
+                select(models.OutboxEvent.status, func.count()).group_by(models.OutboxEvent.status)
+            ).all())
+        finally:
+            db.close()
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "by_status": counts,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+outbox_dispatcher = OutboxDispatcher()
+
+
+if __name__ == "__main__":
+    asyncio.run(outbox_dispatcher.run_forever())
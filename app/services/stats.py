@@ -0,0 +1,167 @@
+# app/services/stats.py
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, select, true
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..db import engine as primary_engine
+
+_WATCHED_MODELS = (models.Apartment, models.Expense, models.Income)
+_AMOUNT_KEYS = {"expenses_month_sum", "incomes_month_sum", "incomes_month_confirmed", "incomes_month_pending"}
+
+
+class StatsEngine:
+    """
+    Totales globales (apartamentos, gastos, ingresos) calculados en una sola
+    consulta con agregados condicionales.
+
+    El resultado se cachea en memoria durante `ttl_seconds` y se invalida en
+    cuanto cualquier sesión confirma cambios sobre Apartment, Expense o Income.
+    La caché es por proceso: entre procesos el TTL acota la desactualización.
+    Solo se rellena desde la primaria: la invalidación llega con los commits
+    de la primaria y un cálculo en la réplica (con retraso) podría guardar
+    datos anteriores a ese commit durante todo el TTL. Con una sesión de
+    réplica se sirve la caché si está fresca y si no se calcula sin guardar.
+    """
+
+    def __init__(self, ttl_seconds: float | None = None):
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv("STATS_CACHE_TTL", "30"))
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._cached: dict | None = None
+        self._cached_at = 0.0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- CONSULTA ----------
+
+    def _build_query(self, month_start, week_ago):
+        apt = models.Apartment
+        exp = models.Expense
+        inc = models.Income
+
+        apartments = select(
+            func.count().label("apartments_total"),
+            func.count().filter(apt.is_active == True).label("apartments_active"),
+        ).select_from(apt).subquery("a")
+
+        expenses = select(
+            func.count().label("expenses_total"),
+            func.count().filter(exp.date >= month_start).label("expenses_month_count"),
+            func.coalesce(func.sum(exp.amount_gross).filter(exp.date >= month_start), 0).label("expenses_month_sum"),
+            func.count().filter(exp.created_at >= week_ago).label("expenses_week"),
+        ).select_from(exp).subquery("e")
+
+        in_month = inc.date >= month_start
+        incomes = select(
+            func.count().label("incomes_total"),
+            func.count().filter(inc.status == "PENDING").label("incomes_pending"),
+            func.count().filter(inc.status == "CONFIRMED").label("incomes_confirmed"),
+            func.count().filter(in_month).label("incomes_month_count"),
+            func.coalesce(func.sum(inc.amount_gross).filter(in_month, inc.status != "CANCELLED"), 0).label("incomes_month_sum"),
+            func.coalesce(func.sum(inc.amount_gross).filter(in_month, inc.status == "CONFIRMED"), 0).label("incomes_month_confirmed"),
+            func.coalesce(func.sum(inc.amount_gross).filter(in_month, inc.status == "PENDING"), 0).label("incomes_month_pending"),
+            func.count().filter(inc.created_at >= week_ago).label("incomes_week"),
+        ).select_from(inc).subquery("i")
+
+        return select(apartments, expenses, incomes).select_from(
+            apartments.join(expenses, true()).join(incomes, true())
+        )
+
+    def compute(self, db: Session) -> dict:
+        """Ejecuta la consulta consolidada (un único round trip)"""
+        now = datetime.now()
+        month_start = now.replace(day=1).date()
+        week_ago = now - timedelta(days=7)
+
+        row = db.execute(self._build_query(month_start, week_ago)).mappings().one()
+        stats = {
+            key: float(value or 0) if key in _AMOUNT_KEYS else int(value or 0)
+            for key, value in row.items()
+        }
+        stats["month"] = month_start.strftime("%Y-%m")
+        stats["generated_at"] = now.isoformat()
+        return stats
+
+    # ---------- CACHÉ ----------
+
+    def get(self, db: Session) -> dict:
+        with self._lock:
+            if self._cached is not None and time.monotonic() - self._cached_at < self.ttl_seconds:
+                self.hits += 1
+                return dict(self._cached)
+            generation = self._generation
+            self.misses += 1
+
+        stats = self.compute(db)
+        if db.get_bind() is not primary_engine:
+            return dict(stats)
+
+        with self._lock:
+            # Si hubo una escritura mientras calculábamos, no guardamos un dato ya viejo
+            if generation == self._generation:
+                self._cached = stats
+                self._cached_at = time.monotonic()
+        return dict(stats)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._cached = None
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            return {
+                "ttl_seconds": self.ttl_seconds,
+                "cached": self._cached is not None,
+                "age_seconds": round(time.monotonic() - self._cached_at, 3) if self._cached else None,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+stats_engine = StatsEngine()
+
+
+# ---------- INVALIDACIÓN AL ESCRIBIR ----------
+
+@event.listens_for(Session, "after_flush")
+def _mark_stats_dirty(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, _WATCHED_MODELS):
+            mark_stats_dirty(session)
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_stats_dirty_bulk(orm_execute_state):
+    # INSERT/UPDATE/DELETE masivos (session.execute(insert(Model), rows))
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, _WATCHED_MODELS):
+        mark_stats_dirty(orm_execute_state.session)
+
+
+def mark_stats_dirty(session):
+    """Para escrituras fuera del ORM (p.ej. COPY): invalida la caché al hacer commit"""
+    session.info["_stats_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_stats_on_commit(session):
+    if session.info.pop("_stats_dirty", False):
+        stats_engine.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_stats_flag(session):
+    session.info.pop("_stats_dirty", None)
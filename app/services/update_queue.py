@@ -0,0 +1,165 @@
+# app/services/update_queue.py
+"""
+Cola de updates del webhook de Telegram (POST /webhook/telegram).
+
+El webhook solo encola y responde 200 al momento; el OCR, el LLM y las
+llamadas a la API las hace después un pool de workers. Así Telegram no
+agota su timeout con recibos lentos ni reenvía el update (gastos
+duplicados).
+
+- Orden por chat: los updates de un mismo chat se procesan de uno en uno y
+  en el orden de llegada; chats distintos van en paralelo (hasta
+  WEBHOOK_WORKERS a la vez). Un chat con mucho trabajo cede el turno tras
+  cada update para no acaparar los workers.
+- Deduplicación por update_id con un buffer circular de los últimos
+  WEBHOOK_DEDUPE_SIZE ids: memoria acotada, y los reenvíos de Telegram
+  llegan siempre poco después del original.
+- WEBHOOK_QUEUE_MAX updates pendientes como máximo: por encima se responde
+  503 y Telegram reintenta más tarde.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_MAX = int(os.getenv("WEBHOOK_QUEUE_MAX", "1000"))
+WEBHOOK_DEDUPE_SIZE = int(os.getenv("WEBHOOK_DEDUPE_SIZE", "2048"))
+WEBHOOK_UPDATE_TIMEOUT = float(os.getenv("WEBHOOK_UPDATE_TIMEOUT", "300"))
+
+
+class UpdateQueueFull(RuntimeError):
+    pass
+
+
+class UpdateIdRing:
+    """Últimos `size` update_id vistos (deque + set: comprobación O(1), memoria fija)"""
+
+    def __init__(self, size: int = WEBHOOK_DEDUPE_SIZE):
+        self.size = max(1, size)
+        self._order: deque = deque()
+        self._ids: set = set()
+
+    def __contains__(self, update_id) -> bool:
+        return update_id in self._ids
+
+    def add(self, update_id) -> bool:
+        """False si ya estaba (duplicado)"""
+        if update_id in self._ids:
+            return False
+        if len(self._order) >= self.size:
+            self._ids.discard(self._order.popleft())
+        self._order.append(update_id)
+        self._ids.add(update_id)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+
+class ChatUpdateQueue:
+    def __init__(self, handler: Callable[[Any], Awaitable[None]], workers: int = WEBHOOK_WORKERS,
+                 max_pending: int = WEBHOOK_QUEUE_MAX, dedupe_size: int = WEBHOOK_DEDUPE_SIZE,
+                 timeout: float = WEBHOOK_UPDATE_TIMEOUT):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.seen = UpdateIdRing(dedupe_size)
+        self._chats: dict[Hashable, deque] = {}   # pendientes por chat
+        self._ready: asyncio.Queue | None = None  # chats con trabajo y sin worker asignado
+        self._tasks: list[asyncio.Task] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.pending = 0
+        self.in_progress = 0
+        self.counters = {"queued": 0, "duplicate": 0, "rejected": 0, "processed": 0, "failed": 0, "timeout": 0}
+        self.max_wait_seconds = 0.0
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Primer uso o loop nuevo (reinicio de la app): estado ligado al loop desde cero
+            self._loop, self._ready, self._tasks, self._chats = loop, asyncio.Queue(), [], {}
+            self.pending = self.in_progress = 0
+        if len(self._tasks) == self.workers and all(not t.done() for t in self._tasks):
+            return
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._worker(len(self._tasks))))
+
+    def submit(self, update_id, chat_key: Hashable, item) -> str:
+        """Encola sin esperar: "queued" o "duplicate"; UpdateQueueFull si no cabe"""
+        if update_id is not None and update_id in self.seen:
+            self.counters["duplicate"] += 1
+            return "duplicate"
+        if self.pending >= self.max_pending:
+            # Sin marcarlo como visto: el reintento de Telegram debe poder entrar
+            self.counters["rejected"] += 1
+            raise UpdateQueueFull(f"{self.pending} updates pendientes")
+        if update_id is not None:
+            self.seen.add(update_id)
+
+        self._ensure_workers()
+        chat = self._chats.get(chat_key)
+        if chat is None:
+            # Chat sin trabajo: pasa a la cola de listos. Si ya tiene (o un
+            # worker lo está procesando) basta con añadirlo a su cola
+            chat = self._chats[chat_key] = deque()
+            self._ready.put_nowait(chat_key)
+        chat.append((time.monotonic(), item))
+        self.pending += 1
+        self.counters["queued"] += 1
+        return "queued"
+
+    async def _worker(self, number: int):
+        while True:
+            chat_key = await self._ready.get()
+            chat = self._chats[chat_key]
+            enqueued_at, item = chat.popleft()
+            self.pending -= 1
+            self.in_progress += 1
+            self.max_wait_seconds = max(self.max_wait_seconds, time.monotonic() - enqueued_at)
+            try:
+                await asyncio.wait_for(self.handler(item), timeout=self.timeout)
+                self.counters["processed"] += 1
+            except asyncio.TimeoutError:
+                self.counters["timeout"] += 1
+                print(f"[WEBHOOK] ⏱️ Update del chat {chat_key} cancelado tras {self.timeout:.0f}s")
+            except Exception as e:
+                self.counters["failed"] += 1
+                print(f"[WEBHOOK] ❌ Error procesando update del chat {chat_key}: {e}")
+            finally:
+                self.in_progress -= 1
+                if chat:
+                    self._ready.put_nowait(chat_key)  # al final de la cola: turno para otros chats
+                else:
+                    del self._chats[chat_key]
+
+    async def join(self, timeout: float | None = None):
+        """Espera a que no quede nada pendiente ni en curso (tests, benchmarks, apagado)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending or self.in_progress:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": len([t for t in self._tasks if not t.done()]),
+            "pending": self.pending,
+            "in_progress": self.in_progress,
+            "chats_waiting": len(self._chats),
+            "dedupe_ids": len(self.seen),
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+            **self.counters,
+        }
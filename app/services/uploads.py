@@ -0,0 +1,144 @@
+# app/services/uploads.py
+"""
+Ficheros de facturas (subidas del chat y descargas de Telegram) sin pasar
+por disco.
+
+- Subidas HTTP (multipart): UploadLimitMiddleware corta el cuerpo antes de
+  que Starlette lo parsee: 413 si Content-Length ya supera el límite, y si
+  no viene (chunked) cuenta los bytes según llegan y responde 413 al pasar
+  UPLOAD_MAX_BYTES (más un margen para cabeceras y campos del formulario).
+  Nada grande llega a escribirse.
+- Starlette guarda cada fichero del multipart en un SpooledTemporaryFile;
+  configure_multipart_spool sube su umbral de 1 MB a UPLOAD_SPOOL_BYTES
+  para que las fotos normales se queden en memoria. Las rutas pasan
+  `file.file` tal cual al OCR (sin copiarlo otra vez).
+- Telegram: spool_telegram_file descarga a un SpooledTemporaryFile propio
+  (en memoria hasta UPLOAD_SPOOL_BYTES, luego un temporal anónimo que el
+  sistema borra al cerrarlo), con el límite aplicado mientras se escribe.
+  Usar siempre con `with`.
+- Ocr_untils acepta estos objetos directamente (imágenes y PDFs).
+"""
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # cabeceras multipart y campos de texto del formulario
+
+
+class UploadTooLarge(ValueError):
+    def __init__(self, size: int | None, limit: int):
+        self.size = size
+        self.limit = limit
+        shown = f"{limit / (1024 * 1024):.0f} MB" if limit >= 1024 * 1024 else f"{limit // 1024} KB"
+        super().__init__(f"El fichero supera el máximo de {shown}")
+
+
+class _LimitedSpool:
+    """SpooledTemporaryFile que cuenta bytes al escribir y corta al pasar el límite"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(self.size, self.max_bytes)
+        return self.file.write(data)
+
+    def finish(self):
+        self.file.seek(0)
+        return self.file
+
+
+def _check_declared(size: int | None, max_bytes: int):
+    if size is not None and size > max_bytes:
+        raise UploadTooLarge(size, max_bytes)
+
+
+async def spool_telegram_file(tg_file, max_bytes: int = UPLOAD_MAX_BYTES):
+    """telegram.File → fichero binario rebobinado, sin download_to_drive"""
+    _check_declared(getattr(tg_file, "file_size", None), max_bytes)
+    spool = _LimitedSpool(max_bytes)
+    try:
+        await tg_file.download_to_memory(out=spool)
+    except BaseException:
+        spool.file.close()
+        raise
+    return spool.finish()
+
+
+def configure_multipart_spool(size: int = UPLOAD_SPOOL_BYTES):
+    """Umbral de memoria de los ficheros que Starlette parsea (1 MB por defecto)"""
+    from starlette.formparsers import MultiPartParser
+    attr = "spool_max_size" if hasattr(MultiPartParser, "spool_max_size") else "max_file_size"
+    setattr(MultiPartParser, attr, size)
+
+
+class UploadLimitMiddleware:
+    """Rechaza con 413 los multipart de más de max_bytes sin leerlos enteros"""
+
+    def __init__(self, app, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limit = max_bytes + UPLOAD_FORM_OVERHEAD
+
+    async def _reject(self, send, size: int | None):
+        print(f"[UPLOAD] ❌ Subida rechazada ({size or '?'} bytes, máximo {self.max_bytes})")
+        body = json.dumps({"detail": "file_too_large", "message": str(UploadTooLarge(size, self.max_bytes))}).encode()
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.limit:
+            await self._reject(send, int(declared))
+            return
+
+        received = 0
+        too_large = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            if too_large:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    # El parser ve una desconexión y deja de leer; la respuesta
+                    # (un 400 de FastAPI) se cambia por el 413 en limited_send
+                    too_large = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def limited_send(message):
+            nonlocal started
+            if too_large and not started:
+                if message["type"] == "http.response.start":
+                    started = True
+                    await self._reject(send, received)
+                return
+            if too_large:
+                return
+            await send(message)
+
+        await self.app(scope, limited_receive, limited_send)
+        if too_large and not started:
+            await self._reject(send, received)
@@ -0,0 +1,160 @@
+# app/slow_queries.py
+"""
+Registro de consultas lentas y captura de planes.
+
+El hook after_cursor_execute de app/metrics.py pasa aquí cada sentencia que
+supera SLOW_QUERY_MS. Se guardan en un buffer circular (SLOW_QUERY_BUFFER)
+con parámetros, duración y la ruta que la originó, y se pueden volver a
+lanzar con EXPLAIN sobre el mismo engine desde /admin/slow-queries:
+
+- PostgreSQL: EXPLAIN (ANALYZE, BUFFERS) para lecturas; las escrituras solo
+  con EXPLAIN (sin ejecutarlas).
+- SQLite: EXPLAIN QUERY PLAN.
+
+El EXPLAIN se ejecuta siempre en una transacción que se deshace al terminar.
+"""
+from __future__ import annotations
+
+import itertools
+import os
+import threading
+from collections import deque
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from uuid import UUID
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+SLOW_QUERY_BUFFER = int(os.getenv("SLOW_QUERY_BUFFER", "200"))
+SLOW_QUERY_MAX_CHARS = int(os.getenv("SLOW_QUERY_MAX_CHARS", "20000"))
+
+_READ_PREFIXES = ("select", "with", "values")
+
+
+def _json_safe(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value if not isinstance(value, str) or len(value) <= 500 else value[:500] + "…"
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, dict):
+        return {str(k): _json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    return repr(value)[:500]
+
+
+class SlowQuery:
+    __slots__ = ("id", "statement", "parameters", "executemany", "duration_ms",
+                 "route", "at", "dialect", "engine")
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "duration_ms": round(self.duration_ms, 3),
+            "route": self.route,
+            "at": self.at.isoformat(),
+            "dialect": self.dialect,
+            "executemany": self.executemany,
+            "statement": self.statement,
+            "parameters": _json_safe(self.parameters),
+        }
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, size: int = SLOW_QUERY_BUFFER):
+        self.threshold_ms = threshold_ms
+        self._entries: deque[SlowQuery] = deque(maxlen=size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def observe(self, conn, statement: str, parameters, executemany: bool, seconds: float, route: str | None):
+        duration_ms = seconds * 1000
+        if self.threshold_ms <= 0 or duration_ms < self.threshold_ms:
+            return
+        if statement.lstrip()[:7].lower() == "explain":
+            return
+
+        entry = SlowQuery()
+        entry.statement = statement[:SLOW_QUERY_MAX_CHARS]
+        # En executemany solo se guarda el primer juego de parámetros
+        if executemany and isinstance(parameters, (list, tuple)) and parameters:
+            parameters = parameters[0]
+        entry.parameters = dict(parameters) if isinstance(parameters, dict) else (
+            tuple(parameters) if parameters is not None else None)
+        entry.executemany = executemany
+        entry.duration_ms = duration_ms
+        entry.route = route or "<background>"
+        entry.at = datetime.now(timezone.utc)
+        entry.dialect = conn.dialect.name
+        entry.engine = conn.engine
+        with self._lock:
+            entry.id = next(self._ids)
+            self._entries.append(entry)
+            self.recorded += 1
+        print(f"[SLOW SQL] 🐢 {duration_ms:.0f}ms {entry.route}: {' '.join(statement.split())[:200]}")
+
+    def list(self, limit: int = 50) -> list[dict]:
+        with self._lock:
+            entries = list(self._entries)[-limit:]
+        return [e.to_dict() for e in reversed(entries)]
+
+    def get(self, query_id: int) -> SlowQuery | None:
+        with self._lock:
+            for entry in self._entries:
+                if entry.id == query_id:
+                    return entry
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            buffered = len(self._entries)
+        return {
+            "threshold_ms": self.threshold_ms,
+            "buffer_size": self._entries.maxlen,
+            "buffered": buffered,
+            "recorded": self.recorded,
+        }
+
+
+slow_query_log = SlowQueryLog()
+
+
+def explain(entry: SlowQuery, analyze: bool = True) -> dict:
+    """Plan de una consulta capturada, con sus parámetros originales"""
+    is_read = entry.statement.lstrip()[:6].lower().startswith(_READ_PREFIXES)
+    if entry.dialect == "postgresql":
+        analyze = analyze and is_read
+        options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+        explain_sql = f"EXPLAIN ({options}) {entry.statement}"
+    elif entry.dialect == "sqlite":
+        analyze = False
+        explain_sql = f"EXPLAIN QUERY PLAN {entry.statement}"
+    else:
+        analyze = False
+        explain_sql = f"EXPLAIN {entry.statement}"
+
+    with entry.engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            rows = conn.exec_driver_sql(explain_sql, entry.parameters or ()).fetchall()
+        finally:
+            trans.rollback()
+
+    if entry.dialect == "sqlite":
+        # (id, parent, notused, detail) -> árbol indentado como el CLI de sqlite
+        depth, plan = {0: -1}, []
+        for row in rows:
+            depth[row[0]] = depth.get(row[1], -1) + 1
+            plan.append("  " * depth[row[0]] + str(row[3]))
+    else:
+        plan = [str(row[0]) for row in rows]
+
+    return {"query": entry.to_dict(), "analyze": analyze, "plan": plan}
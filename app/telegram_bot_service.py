@@ -1,11 +1,23 @@
 # app/telegram_bot_service.py
 """
 Servicio de Telegram Bot integrado en FastAPI
+
+En producción el bot corre como proceso aparte (python -m app.bot_worker);
+aquí solo se guarda su último latido para /bot/status. El hilo dentro del
+web queda para desarrollo y no se arranca si hay un worker vivo (dos
+pollings con el mismo token se pisan).
+
+BOT_MODE decide si el web puede arrancar el bot:
+- thread (por defecto): hilo dentro del web, salvo si hay latido del worker.
+- worker: el bot es el servicio bot_worker; el web nunca lo arranca, aunque
+  el latido falte (reinicio del web, worker caído, varias instancias).
 """
 import os
 import asyncio
 import logging
 import threading
+import time
+from datetime import datetime, timezone
 from typing import Optional
 
 # Configurar logging
@@ -15,6 +27,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def bot_mode() -> str:
+    """BOT_MODE: thread | worker"""
+    return (os.getenv("BOT_MODE") or "thread").strip().lower()
+
 class TelegramBotService:
     """Servicio para ejecutar el bot de Telegram en background"""
     
@@ -22,6 +38,27 @@ class TelegramBotService:
         self.bot_task: Optional[asyncio.Task] = None
         self.bot_thread: Optional[threading.Thread] = None
         self.is_running = False
+        self.worker_heartbeat: Optional[dict] = None
+        self._worker_heartbeat_at: Optional[float] = None
+    
+    def record_worker_heartbeat(self, payload: dict):
+        """Latido del proceso bot_worker (POST /bot/heartbeat)"""
+        self.worker_heartbeat = dict(payload, received_at=datetime.now(timezone.utc).isoformat())
+        self._worker_heartbeat_at = time.monotonic()
+    
+    def worker_alive(self) -> bool:
+        """Worker con latido reciente (menos de 3 intervalos) y el bot hijo vivo"""
+        if not self.worker_heartbeat or self._worker_heartbeat_at is None:
+            return False
+        interval = float(self.worker_heartbeat.get("heartbeat_seconds") or 30)
+        fresh = time.monotonic() - self._worker_heartbeat_at < 3 * interval
+        return fresh and bool(self.worker_heartbeat.get("child_alive"))
+    
+    def worker_status(self) -> Optional[dict]:
+        if not self.worker_heartbeat:
+            return None
+        return dict(self.worker_heartbeat, alive=self.worker_alive(),
+                    seconds_since_heartbeat=round(time.monotonic() - self._worker_heartbeat_at, 1))
         
     def should_start_bot(self) -> bool:
         """Verificar si el bot debería iniciarse"""
@@ -41,6 +78,10 @@ class TelegramBotService:
     
     def start_bot_in_thread(self):
         """Iniciar el bot en un hilo separado"""
+        if bot_mode() == "worker":
+            logger.warning("⚠️ BOT_MODE=worker - el bot corre en el servicio bot_worker, no en el web")
+            return
+        
         if not self.should_start_bot():
             logger.warning("❌ Bot no puede iniciarse - configuración incompleta")
             return
@@ -49,6 +90,10 @@ class TelegramBotService:
             logger.info("Bot ya está ejecutándose")
             return
         
+        if self.worker_alive():
+            logger.warning("⚠️ El bot ya corre en el proceso bot_worker - no se arranca en el web")
+            return
+        
         def run_bot():
             """Función para ejecutar el bot en hilo separado"""
             try:
@@ -114,12 +159,14 @@ class TelegramBotService:
             self.is_running = False
         
         return {
+            "bot_mode": bot_mode(),
             "bot_running": self.is_running,
             "telegram_token_configured": bool(os.getenv("TELEGRAM_TOKEN")),
             "openai_key_configured": bool(os.getenv("OPENAI_API_KEY")),
             "thread_alive": thread_alive,
             "thread_name": self.bot_thread.name if self.bot_thread else None,
-            "should_start": self.should_start_bot()
+            "should_start": bot_mode() != "worker" and self.should_start_bot(),
+            "worker": self.worker_status()
         }
 
 # Instancia global del servicio
@@ -12,6 +12,9 @@ from fastapi import APIRouter, Request, HTTPException
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 
+from .services.update_queue import ChatUpdateQueue, UpdateQueueFull
+from .services.uploads import UploadTooLarge, spool_telegram_file
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -200,6 +203,21 @@ async def handle_photo(update: Update, context):
     
     apartment_code = session.get("apartment_code")
     
+    # Fotos de un álbum: se agrupan y se procesan juntas con un solo resumen
+    if update.message.media_group_id:
+        try:
+            collector = _get_album_collector()
+        except ImportError as e:
+            logger.error(f"Álbumes no disponibles: {e}")
+        else:
+            album_context = {"apartment_code": apartment_code, "apartment_id": session.get("apartment_id")}
+            if collector.add(update.message.media_group_id, update.message, album_context):
+                await update.message.reply_text(
+                    f"📚 **Recibiendo álbum para {apartment_code}**\n\n"
+                    f"⏳ Proceso todas las fotos juntas y te envío un resumen..."
+                )
+            return
+    
     # Mensaje inicial
     await update.message.reply_text(
         f"📸 **Procesando foto para {apartment_code}**\n\n"
@@ -212,18 +230,14 @@ async def handle_photo(update: Update, context):
         # Descargar la foto
         photo_file = await update.message.photo[-1].get_file()
         
-        # Crear archivo temporal
-        import tempfile
-        import os
+        # Descargar a memoria (sin temporal en disco); se libera al salir del with
+        upload = await spool_telegram_file(photo_file)
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            await photo_file.download_to_drive(temp_file.name)
-            temp_path = temp_file.name
-        
-        try:
-            # Extraer texto con OCR
-            from .bot.Ocr_untils import extract_text_from_image
-            raw_text = extract_text_from_image(temp_path)
+        with upload:
+            # Extraer texto con OCR en el pool de hilos: los workers de la cola
+            # comparten el event loop con POST /webhook/telegram
+            from .bot.Ocr_untils import extract_text_and_words_from_image, run_ocr
+            raw_text, words = await run_ocr(extract_text_and_words_from_image, upload)
             
             if not raw_text.strip():
                 await update.message.reply_text(
@@ -246,8 +260,8 @@ async def handle_photo(update: Update, context):
                 return
             
             # Procesar con IA
-            from .bot.Llm_Untils import extract_expense_json
-            expense_data = extract_expense_json(raw_text, apartment_code)
+            from .bot.Llm_Untils import extract_expense_json_async
+            expense_data = await extract_expense_json_async(raw_text, apartment_code, words=words)
             
             if not expense_data.get("amount_gross"):
                 await update.message.reply_text(
@@ -304,14 +318,9 @@ async def handle_photo(update: Update, context):
                         f"🔧 Error del servidor: HTTP {response.status_code}\n"
                         f"Intenta de nuevo o introduce manualmente."
                     )
-        
-        finally:
-            # Limpiar archivo temporal
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
                 
+    except UploadTooLarge as e:
+        await update.message.reply_text(f"❌ {e}.\n\n💡 Envía una foto o un PDF más pequeño.")
     except ImportError as e:
         await update.message.reply_text(
             f"❌ **OCR no disponible en este entorno**\n\n"
@@ -336,6 +345,48 @@ async def handle_photo(update: Update, context):
             f"Descripción"
         )
 
+_album_collector = None
+
+def _get_album_collector():
+    global _album_collector
+    if _album_collector is None:
+        from .bot.Album_Utils import AlbumCollector
+        _album_collector = AlbumCollector(_process_album)
+    return _album_collector
+
+async def _process_album(messages, album_context):
+    """Álbum completo: OCR en paralelo, extracción por lotes y alta de todos los gastos"""
+    import asyncio
+    import httpx
+    from .bot.Album_Utils import extract_album_expenses, format_album_summary
+
+    apartment_code = album_context["apartment_code"]
+    results = await extract_album_expenses(messages, apartment_code)
+    headers = {"Content-Type": "application/json", "X-Internal-Key": INTERNAL_KEY}
+
+    # El endpoint legacy (X-Internal-Key) es de uno en uno: todas las altas a la vez por un mismo cliente
+    async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
+        async def create(result):
+            if not result["expense"]:
+                return
+            expense_data = dict(result["expense"], apartment_id=album_context["apartment_id"])
+            expense_data.pop("apartment_code", None)
+            try:
+                response = await client.post(f"{API_BASE_URL}/api/v1/expenses/", json=expense_data, headers=headers)
+            except httpx.HTTPError as e:
+                result["error"] = f"error de conexión ({e})"
+                return
+            if response.status_code in [200, 201]:
+                result["created"] = True
+            else:
+                result["error"] = f"error del servidor: HTTP {response.status_code}"
+
+        await asyncio.gather(*(create(r) for r in results))
+
+    created = sum(1 for r in results if r.get("created"))
+    logger.info(f"Álbum {apartment_code}: {created}/{len(results)} gastos creados")
+    await messages[0].reply_text(format_album_summary(results, apartment_code))
+
 async def handle_text(update: Update, context):
     """Manejar texto para gastos manuales"""
     user_id = update.effective_user.id
@@ -436,9 +487,26 @@ async def handle_text(update: Update, context):
                 f"💡 **Tip:** Las fotos son más rápidas y precisas"
             )
 
+async def _process_queued_update(update: Update):
+    app = await ensure_telegram_app_initialized()
+    await app.process_update(update)
+
+# OCR, LLM y API se hacen fuera de la petición del webhook, con orden por chat
+update_queue = ChatUpdateQueue(_process_queued_update)
+
+def _chat_key(update: Update):
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return f"update:{update.update_id}"
+
 @webhook_router.post("/telegram")
 async def telegram_webhook(request: Request):
-    """Endpoint para recibir webhooks de Telegram"""
+    """
+    Endpoint para recibir webhooks de Telegram: encola el update y responde
+    al momento (Telegram reenvía si tardamos, y eso duplicaba gastos)
+    """
     try:
         # Asegurar que la aplicación esté inicializada
         app = await ensure_telegram_app_initialized()
@@ -461,10 +529,16 @@ async def telegram_webhook(request: Request):
             logger.error(f"Data recibida: {data}")
             return {"ok": False, "error": f"Parse error: {str(parse_error)}"}
         
-        # Procesar update
-        await app.process_update(update)
+        # Encolar update (los reenvíos con el mismo update_id se descartan)
+        try:
+            status = update_queue.submit(update.update_id, _chat_key(update), update)
+        except UpdateQueueFull as full:
+            logger.warning(f"Cola del webhook llena: {full}")
+            raise HTTPException(status_code=503, detail="update_queue_full")
         
-        return {"ok": True}
+        return {"ok": True, "status": status}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error procesando webhook: {e}")
         import traceback
@@ -492,7 +566,8 @@ async def telegram_info():
                 "url": webhook_info.url,
                 "has_custom_certificate": webhook_info.has_custom_certificate,
                 "pending_update_count": webhook_info.pending_update_count
-            }
+            },
+            "queue": update_queue.stats()
         }
     except Exception as e:
         logger.error(f"Error obteniendo info del bot: {e}")
@@ -501,6 +576,10 @@ async def telegram_info():
 @webhook_router.post("/telegram/setup")
 async def setup_telegram_webhook():
     """Configurar webhook de Telegram automáticamente"""
+    from .telegram_bot_service import bot_mode
+    if bot_mode() == "worker":
+        # El webhook cortaría el polling del worker (Telegram no permite ambos)
+        return {"success": False, "error": "bot_mode_worker"}
     try:
         app = await ensure_telegram_app_initialized()
         if not app:
@@ -604,18 +683,13 @@ async def handle_document(update: Update, context):
         # Descargar el PDF
         pdf_file = await document.get_file()
         
-        # Crear archivo temporal
-        import tempfile
-        import os
+        # Descargar a memoria (sin temporal en disco); se libera al salir del with
+        upload = await spool_telegram_file(pdf_file)
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            await pdf_file.download_to_drive(temp_file.name)
-            temp_path = temp_file.name
-        
-        try:
+        with upload:
             # Extraer texto con OCR
-            from .bot.Ocr_untils import extract_text_from_pdf
-            raw_text = extract_text_from_pdf(temp_path)
+            from .bot.Ocr_untils import extract_text_from_pdf, run_ocr
+            raw_text = await run_ocr(extract_text_from_pdf, upload)
             
             if not raw_text.strip():
                 await update.message.reply_text(
@@ -633,8 +707,8 @@ async def handle_document(update: Update, context):
                 return
             
             # Procesar con IA
-            from .bot.Llm_Untils import extract_expense_json
-            expense_data = extract_expense_json(raw_text, apartment_code)
+            from .bot.Llm_Untils import extract_expense_json_async
+            expense_data = await extract_expense_json_async(raw_text, apartment_code)
             
             if not expense_data.get("amount_gross"):
                 await update.message.reply_text(
@@ -694,14 +768,9 @@ async def handle_document(update: Update, context):
                         f"🔧 Error del servidor: HTTP {response.status_code}\n"
                         f"Intenta de nuevo o introduce manualmente."
                     )
-        
-        finally:
-            # Limpiar archivo temporal
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
                 
+    except UploadTooLarge as e:
+        await update.message.reply_text(f"❌ {e}.\n\n💡 Envía una foto o un PDF más pequeño.")
     except ImportError as e:
         await update.message.reply_text(
             f"❌ **OCR no disponible en este entorno**\n\n"
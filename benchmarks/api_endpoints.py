@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los endpoints principales dentro del proceso (ASGI, sin red).
+
+Lanza la app de app/main.py con httpx.ASGITransport contra una BD ya
+poblada con benchmarks/dataset.py y mide, por escenario y por tenant,
+throughput y latencias p50/p95/p99, además de la media de sentencias SQL por
+petición (cabecera X-SQL-Queries de app/metrics.py).
+
+email_webhook no pasa por HTTP: la ruta solo encola el email en una
+BackgroundTask y responde, así que se ejecuta directamente la tarea de
+procesado (process_reservation_email_task, en un hilo como la BackgroundTask) con un email de Booking.com para
+un apartamento real del tenant, contando sus sentencias SQL igual que
+MetricsMiddleware.
+
+Escenarios: login, dashboard_monthly, income_stats, realtime_incomes,
+realtime_stats, expenses_list, export_csv, email_webhook.
+
+Uso:
+    python benchmarks/dataset.py --url sqlite:////tmp/bench.db --tenants 10 200
+    python benchmarks/api_endpoints.py --url sqlite:////tmp/bench.db --requests 200 --concurrency 8
+    python benchmarks/api_endpoints.py --url ... --save baseline.json
+    python benchmarks/api_endpoints.py --url ... --baseline baseline.json   # compara con la línea base
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+import uuid
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_ADMIN_KEY = "bench-admin-key"
+
+BOOKING_EMAIL = """
+Your booking is confirmed!
+
+Booking.com confirmation number: {ref}
+Guest name: Juan Pérez
+Property: {property}
+Check-in: 15/01/2026
+Check-out: 18/01/2026
+2 guests
+Total price: €450.00
+"""
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+# ---------- ESCENARIOS ----------
+# Cada escenario recibe el tenant y devuelve (método, ruta, kwargs de httpx)
+
+def _auth(tenant: dict) -> dict:
+    return {"Authorization": f"Bearer {tenant['token']}", "X-Account-ID": tenant["account_id"]}
+
+
+SCENARIOS = {
+    "login": lambda t: ("POST", "/api/v1/auth/login", {
+        "json": {"email": t["email"], "password": t["password"]}}),
+    "dashboard_monthly": lambda t: ("GET", "/api/v1/dashboard/monthly", {
+        "params": {"year": date.today().year}, "headers": _auth(t)}),
+    "income_stats": lambda t: ("GET", "/api/v1/incomes/stats", {
+        "params": {"days": 365, "group_by": "month,source"}}),
+    "realtime_incomes": lambda t: ("GET", "/api/realtime/incomes", {
+        "params": {"key": BENCH_ADMIN_KEY, "apartment_id": t["apartment_id"], "limit": 50}}),
+    "realtime_stats": lambda t: ("GET", "/api/realtime/dashboard-stats", {
+        "params": {"key": BENCH_ADMIN_KEY}}),
+    "expenses_list": lambda t: ("GET", "/api/v1/expenses", {
+        "params": {"apartment_id": t["apartment_id"], "limit": 200}}),
+    "export_csv": lambda t: ("GET", "/api/v1/export/expenses", {
+        "params": {"format": "csv", "date_from": f"{date.today().year}-01-01"}, "headers": _auth(t)}),
+    # "CALL": se llama a la función en lugar de hacer una petición
+    "email_webhook": lambda t: ("CALL", "app.routers.email_webhooks:process_reservation_email_task", {
+        "args": (BOOKING_EMAIL.format(ref=uuid.uuid4().hex[:10].upper(), property=t["apartment_name"]),
+                 "noreply@booking.com", "Booking Confirmation", f"bench-{uuid.uuid4()}")}),
+}
+
+
+async def _call(target: str, args: tuple) -> tuple[bool, int]:
+    """Ejecuta `módulo:función` (en un hilo si es síncrona) y devuelve (ok, sentencias SQL)"""
+    import importlib
+
+    from app.metrics import RequestStats, _current_request
+
+    module, func = target.split(":")
+    stats = RequestStats()
+    token = _current_request.set(stats)
+    try:
+        func = getattr(importlib.import_module(module), func)
+        if asyncio.iscoroutinefunction(func):
+            result = await func(*args)
+        else:
+            result = await asyncio.to_thread(func, *args)  # copia el contexto: cuenta su SQL
+    finally:
+        _current_request.reset(token)
+    return bool(result and result.get("success")), stats.queries
+
+
+def load_tenants(limit_apartments: int | None = None) -> list[dict]:
+    """Tenants creados por dataset.py, con un token ya emitido (el login se mide aparte)"""
+    from sqlalchemy import func, select
+
+    from app import models
+    from app.auth_multiuser import create_access_token
+    from app.db import SessionLocal
+    from benchmarks.dataset import BENCH_PASSWORD, BENCH_SLUG_PREFIX
+
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(models.Account.id, models.Account.slug, func.count(models.Apartment.id), func.min(models.Apartment.id))
+            .join(models.Apartment, models.Apartment.account_id == models.Account.id)
+            .where(models.Account.slug.like(f"{BENCH_SLUG_PREFIX}%"))
+            .group_by(models.Account.id, models.Account.slug)
+            .order_by(func.count(models.Apartment.id))
+        ).all()
+        tenants = []
+        for account_id, slug, apartments, apartment_id in rows:
+            if limit_apartments and apartments > limit_apartments:
+                continue
+            user_id = db.scalar(select(models.AccountUser.user_id).where(models.AccountUser.account_id == account_id))
+            apartment = db.get(models.Apartment, apartment_id)
+            tenants.append({
+                "slug": slug,
+                "account_id": account_id,
+                "apartments": apartments,
+                "apartment_id": apartment_id,
+                "apartment_code": apartment.code,
+                "apartment_name": apartment.name,
+                "email": f"owner@{slug}.bench",
+                "password": BENCH_PASSWORD,
+                "token": create_access_token(data={"sub": user_id}),
+            })
+        return tenants
+    finally:
+        db.close()
+
+
+async def run_scenario(client, name: str, tenant: dict, requests: int, concurrency: int) -> dict:
+    build = SCENARIOS[name]
+    latencies, queries, errors = [], [], 0
+    remaining = [requests]
+
+    async def worker():
+        nonlocal errors
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            method, path, kwargs = build(tenant)
+            t0 = time.perf_counter()
+            try:
+                if method == "CALL":
+                    ok, sql = await _call(path, kwargs["args"])
+                    errors += not ok
+                    queries.append(sql)
+                else:
+                    r = await client.request(method, path, **kwargs)
+                    await r.aread()
+                    if r.status_code >= 400:
+                        errors += 1
+                    if "x-sql-queries" in r.headers:
+                        queries.append(int(r.headers["x-sql-queries"]))
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    # Calentamiento (cachés, pool, compilación de sentencias)
+    method, path, kwargs = build(tenant)
+    if method == "CALL":
+        await _call(path, kwargs["args"])
+    else:
+        await client.request(method, path, **kwargs)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "scenario": name,
+        "tenant": tenant["slug"],
+        "apartments": tenant["apartments"],
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "avg_sql": sum(queries) / len(queries) if queries else None,
+    }
+
+
+async def run(args) -> list[dict]:
+    import httpx
+
+    from app.main import app
+
+    tenants = load_tenants(args.max_apartments)
+    if not tenants:
+        raise SystemExit("No hay tenants bench-* en la BD: ejecuta antes benchmarks/dataset.py")
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name in args.scenarios:
+            for tenant in tenants:
+                # Los escenarios sin tenant (stats globales) solo se miden una vez
+                if name in ("income_stats", "realtime_stats") and tenant is not tenants[-1]:
+                    continue
+                requests = args.requests if name != "login" else min(args.requests, 50)  # bcrypt
+                results.append(await run_scenario(client, name, tenant, requests, args.concurrency))
+                _print_row(results[-1])
+    return results
+
+
+def _print_header():
+    print(f"{'escenario':<19}{'aptos':>6}{'req':>6}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'SQL/req':>9}")
+
+
+def _print_row(r: dict, baseline: dict | None = None):
+    sql = f"{r['avg_sql']:.1f}" if r["avg_sql"] is not None else "-"
+    line = (f"{r['scenario']:<19}{r['apartments']:>6}{r['requests']:>6}{r['errors']:>5}"
+            f"{r['rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{sql:>9}")
+    if baseline:
+        def delta(key):
+            old = baseline.get(key) or 0
+            return f"{(r[key] - old) / old * 100:+.0f}%" if old else "n/a"
+        line += f"   vs base: req/s {delta('rps')}, p95 {delta('p95_ms')}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", required=True, help="BD poblada con benchmarks/dataset.py")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="Peticiones por escenario y tenant")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-apartments", type=int, default=None, help="Ignorar tenants más grandes")
+    parser.add_argument("--save", help="Guardar resultados en JSON (línea base)")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior con la que comparar")
+    args = parser.parse_args()
+
+    # Antes de importar la app: BD, clave admin y cabeceras de métricas SQL
+    os.environ["DATABASE_URL"] = args.url
+    os.environ["ADMIN_KEY"] = BENCH_ADMIN_KEY
+    os.environ.setdefault("METRICS_DEBUG_HEADERS", "1")
+    os.environ.setdefault("SLOW_QUERY_MS", "0")
+    os.chdir(ROOT)  # app/main.py monta app/static con ruta relativa
+
+    _print_header()
+    results = asyncio.run(run(args))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            base = {(r["scenario"], r["apartments"]): r for r in json.load(f)["results"]}
+        print("\nComparación con la línea base:")
+        _print_header()
+        for r in results:
+            _print_row(r, base.get((r["scenario"], r["apartments"])))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"url": args.url.split("@")[-1], "date": date.today().isoformat(),
+                       "concurrency": args.concurrency, "results": results}, f, indent=2)
+        print(f"\n[BENCH] 💾 Resultados guardados en {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Latencia del web con y sin tráfico pesado del bot de Telegram.
+
+Levanta app/main.py con uvicorn en un subproceso (BD SQLite temporal, LLM
+fake) y mide p50/p95/p99 de --paths desde este proceso, en tres modos:
+
+- none:    sin bot.
+- thread:  trabajo de bot dentro del proceso web, en hilos (como
+           TelegramBotService.start_bot_in_thread): compite por el GIL.
+- process: el mismo trabajo en un proceso aparte (como app/bot_worker.py).
+
+El "trabajo de bot" es lo que hace cada foto sin contar Tesseract (que ya
+es un subproceso o código C): decodificar y reescalar la imagen con PIL,
+reglas de Receipt_Rules, condensado del OCR y extract_expense_json con el
+proveedor fake. También se informa de cuántos recibos procesó el bot.
+
+Con varios núcleos (o el bot en otro servicio) el modo process libera al
+web del GIL. En una sola CPU web y bot se reparten el núcleo igual, con
+hilos o con procesos; --bot-nice (BOT_WORKER_NICE) muestra lo que solo un
+proceso aparte permite: que el sistema dé prioridad al web.
+
+Uso:
+    python benchmarks/bot_isolation.py --requests 2000 --concurrency 16 --bot-threads 4
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ("none", "thread", "process")
+ADMIN_KEY = "bench-admin-key"  # /metrics exige ADMIN_KEY
+
+
+# ---------- CARGA DE BOT ----------
+
+def bot_load(threads: int, counter_file: str, seed: int = 3):
+    """Arranca `threads` hilos que procesan recibos sin parar; escribe el total en counter_file"""
+    from PIL import Image
+    from app.bot.Llm_Untils import extract_expense_json
+    from benchmarks.receipt_rules import synthetic_texts
+
+    texts = [text for _, text, _ in synthetic_texts(200, seed)]
+    photo = io.BytesIO()
+    Image.effect_noise((1600, 1200), 64).convert("RGB").save(photo, "JPEG", quality=85)
+    photo = photo.getvalue()
+    done = [0]
+    lock = threading.Lock()
+
+    def loop(n: int):
+        rng = random.Random(seed + n)
+        while True:
+            with Image.open(io.BytesIO(photo)) as image:
+                image.convert("L").resize((800, 600))
+            extract_expense_json(rng.choice(texts), "BENCH01")
+            with lock:
+                done[0] += 1
+
+    def report():
+        while True:
+            time.sleep(0.5)
+            with open(counter_file, "w") as f:
+                f.write(str(done[0]))
+
+    for n in range(threads):
+        threading.Thread(target=loop, args=(n,), daemon=True, name=f"bot-load-{n}").start()
+    threading.Thread(target=report, daemon=True).start()
+
+
+def serve(args):
+    """Subproceso: la app web (y, en modo thread, la carga de bot en el mismo proceso)"""
+    import uvicorn
+    from app.main import app
+    if args.serve_bot_threads:
+        bot_load(args.serve_bot_threads, args.counter_file)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+def run_bot_process(args):
+    if args.bot_nice and hasattr(os, "nice"):
+        os.nice(args.bot_nice)
+    bot_load(args.bot_threads, args.counter_file)
+    signal.pause() if hasattr(signal, "pause") else time.sleep(10 ** 9)
+
+
+# ---------- MEDICIÓN ----------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def measure(port: int, paths: list[str], requests: int, concurrency: int) -> list[float]:
+    import httpx
+    latencies = []
+    counter = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+        async def worker():
+            for n in counter:
+                t0 = time.perf_counter()
+                r = await client.get(paths[n % len(paths)])
+                latencies.append(time.perf_counter() - t0)
+                r.raise_for_status()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+def _wait_ready(port: int, timeout: float = 60):
+    import httpx
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("el servidor no arrancó")
+
+
+def run_mode(mode: str, args, env: dict, folder: str) -> dict:
+    from benchmarks.api_endpoints import percentile
+    port = _free_port()
+    counter_file = os.path.join(folder, f"bot-{mode}.count")
+    script = os.path.abspath(__file__)
+    server_cmd = [sys.executable, script, "--serve", "--port", str(port), "--counter-file", counter_file,
+                  "--serve-bot-threads", str(args.bot_threads if mode == "thread" else 0)]
+    procs = [subprocess.Popen(server_cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)]
+    if mode == "process":
+        procs.append(subprocess.Popen([sys.executable, script, "--bot-process", "--bot-threads", str(args.bot_threads),
+                                       "--counter-file", counter_file, "--bot-nice", str(args.bot_nice)],
+                                      cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    try:
+        _wait_ready(port)
+        asyncio.run(measure(port, args.paths, min(200, args.requests), args.concurrency))  # calentamiento
+        start_count = _read_count(counter_file)
+        started = time.perf_counter()
+        latencies = sorted(asyncio.run(measure(port, args.paths, args.requests, args.concurrency)))
+        elapsed = time.perf_counter() - started
+        receipts = _read_count(counter_file) - start_count
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return {
+        "mode": mode,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "bot_receipts_s": receipts / elapsed,
+    }
+
+
+def _read_count(path: str) -> int:
+    try:
+        with open(path) as f:
+            return int(f.read() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="p99 del web con el bot dentro del proceso, fuera o sin bot")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--paths", nargs="+", default=["/health", f"/metrics?key={ADMIN_KEY}"])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--bot-threads", type=int, default=4, help="hilos de carga de bot (recibos en paralelo)")
+    parser.add_argument("--bot-nice", type=int, default=0, help="nice del proceso bot en modo process")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--bot-process", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--serve-bot-threads", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--counter-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args)
+    if args.bot_process:
+        return run_bot_process(args)
+
+    with tempfile.TemporaryDirectory() as folder:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(folder, 'bench.db')}", LLM_PROVIDER="fake",
+                   OUTBOX_DISPATCHER="0", LLM_LOG_CALLS="0", ADMIN_KEY=ADMIN_KEY, PYTHONPATH=ROOT)
+        env.pop("OPENAI_API_KEY", None)
+        print(f"{args.requests} peticiones a {args.paths}, concurrencia {args.concurrency}, "
+              f"{args.bot_threads} hilos de bot, {os.cpu_count()} CPU, nice bot {args.bot_nice}")
+        print(f"\n{'modo':8s} {'req/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'recibos bot/s':>14s}")
+        results = []
+        for mode in args.modes:
+            r = run_mode(mode, args, env, folder)
+            results.append(r)
+            print(f"{r['mode']:8s} {r['rps']:8.0f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} {r['p99_ms']:8.1f} "
+                  f"{r['bot_receipts_s']:14.1f}")
+        print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
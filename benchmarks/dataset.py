@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Generador de datos sintéticos multi-tenant para benchmarks.
+
+Crea una cuenta "bench-*" por cada tamaño pedido, con su usuario owner,
+apartamentos y un histórico realista: calendario de reservas sin solapes
+(estancias de 1-10 noches, ~70% de ocupación), un income por reserva y
+gastos mensuales por apartamento. Inserta por lotes con executemany
+(insertmanyvalues de SQLAlchemy), así que vale igual para SQLite y
+PostgreSQL.
+
+Credenciales de cada tenant:  owner@<slug>.bench / bench-password
+
+Uso:
+    python benchmarks/dataset.py --url sqlite:////tmp/bench.db --tenants 10 200 2000 --years 2
+    python benchmarks/dataset.py --url postgresql://... --tenants 2000 --expenses-per-month 40
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_PASSWORD = "bench-password"
+BENCH_SLUG_PREFIX = "bench-"
+BATCH_SIZE = 5000
+
+CHANNELS = [("BOOKING", 0.45), ("AIRBNB", 0.35), ("WEB", 0.12), ("MANUAL", 0.08)]
+CATEGORIES = [
+    ("Limpieza", "Limpiezas Sol", 35, 90),
+    ("Suministros", "Iberdrola", 40, 160),
+    ("Suministros", "Canal de Isabel II", 15, 60),
+    ("Mantenimiento", "Reparaciones Pérez", 30, 400),
+    ("Comunidad", "Comunidad de propietarios", 50, 120),
+    ("Lavandería", "Lavandería Express", 20, 80),
+    ("Amenities", "Makro", 10, 70),
+    ("Comisiones", "Booking.com", 20, 250),
+]
+GUEST_NAMES = ["Ana García", "John Smith", "Marie Dubois", "Luca Rossi", "Carlos López",
+               "Emma Müller", "Sofía Martín", "Jan Kowalski", "Olivia Brown", "Hugo Fernández"]
+
+
+def _weighted_channel(rng: random.Random) -> str:
+    r, acc = rng.random(), 0.0
+    for channel, weight in CHANNELS:
+        acc += weight
+        if r <= acc:
+            return channel
+    return CHANNELS[-1][0]
+
+
+class _Batcher:
+    """Acumula filas por tabla y las inserta en lotes con executemany"""
+
+    def __init__(self, conn, batch_size: int = BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.pending: dict = {}
+        self.counts: dict[str, int] = {}
+
+    def add(self, table, row: dict):
+        rows = self.pending.setdefault(table, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table=None):
+        from sqlalchemy import insert
+        for t in ([table] if table is not None else list(self.pending)):
+            rows = self.pending.get(t)
+            if rows:
+                self.conn.execute(insert(t), rows)
+                self.counts[t.name] = self.counts.get(t.name, 0) + len(rows)
+                self.pending[t] = []
+
+
+def _generate_apartment(batch: _Batcher, models, rng: random.Random, apartment_id: str,
+                        start: date, end: date, expenses_per_month: int):
+    reservations, incomes, expenses = (models.Reservation.__table__, models.Income.__table__,
+                                       models.Expense.__table__)
+    today = date.today()
+    nightly = Decimal(rng.randint(55, 180))
+
+    # Calendario de reservas sin solapes
+    day = start + timedelta(days=rng.randint(0, 5))
+    while day < end:
+        nights = rng.choices(range(1, 11), weights=[8, 14, 16, 14, 10, 8, 12, 4, 3, 3])[0]
+        check_out = day + timedelta(days=nights)
+        channel = _weighted_channel(rng)
+        guest = rng.choice(GUEST_NAMES)
+        total = (nightly * nights * Decimal(rng.uniform(0.85, 1.25))).quantize(Decimal("0.01"))
+        booked_at = datetime.combine(day - timedelta(days=rng.randint(1, 90)), datetime.min.time(), timezone.utc)
+        cancelled = rng.random() < 0.04
+        reservation_id = str(uuid.uuid4())
+        reference = f"{channel[:2]}{rng.randint(10_000_000, 99_999_999)}"
+
+        batch.add(reservations, {
+            "id": reservation_id,
+            "apartment_id": apartment_id,
+            "check_in": day,
+            "check_out": check_out,
+            "guests": rng.randint(1, 5),
+            "channel": channel.lower(),
+            "guest_name": guest,
+            "status": "CANCELLED" if cancelled else "CONFIRMED",
+            "booking_reference": reference,
+            "total_amount": total,
+            "currency": "EUR",
+            "created_at": booked_at,
+        })
+        batch.add(incomes, {
+            "id": uuid.uuid4(),
+            "reservation_id": reservation_id,
+            "apartment_id": apartment_id,
+            "date": day,
+            "amount_gross": total,
+            "currency": "EUR",
+            "status": "CANCELLED" if cancelled else ("CONFIRMED" if day <= today else "PENDING"),
+            "source": channel,
+            "guest_name": guest,
+            "booking_reference": reference,
+            "check_in_date": day,
+            "check_out_date": check_out,
+            "guests_count": rng.randint(1, 5),
+            "processed_from_email": channel in ("BOOKING", "AIRBNB"),
+            "created_at": booked_at,
+        })
+        day = check_out + timedelta(days=rng.choices([0, 1, 2, 3, 5, 8], weights=[40, 20, 15, 10, 10, 5])[0])
+
+    # Gastos mensuales
+    month = date(start.year, start.month, 1)
+    while month < end:
+        for _ in range(expenses_per_month):
+            category, vendor, low, high = rng.choice(CATEGORIES)
+            spent = month + timedelta(days=rng.randint(0, 27))
+            batch.add(expenses, {
+                "id": str(uuid.uuid4()),
+                "apartment_id": apartment_id,
+                "date": spent,
+                "amount_gross": Decimal(rng.uniform(low, high)).quantize(Decimal("0.01")),
+                "currency": "EUR",
+                "category": category,
+                "description": f"{category} {spent:%m/%Y}",
+                "vendor": vendor,
+                "vat_rate": rng.choice([0, 10, 21]),
+                "source": rng.choice(["telegram", "manual", "bulk"]),
+                "created_at": datetime.combine(spent, datetime.min.time(), timezone.utc),
+            })
+        month = date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+def generate(tenants: list[int], years: float, expenses_per_month: int, seed: int) -> list[dict]:
+    """Crea los tenants en la BD de app.db (DATABASE_URL). Devuelve un resumen por tenant."""
+    from app import models
+    from app.auth_multiuser import get_password_hash
+    from app.db import Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(seed)
+    password_hash = get_password_hash(BENCH_PASSWORD)  # bcrypt es lento: un solo hash para todos
+    end = date.today() + timedelta(days=120)
+    start = end - timedelta(days=int(365 * years))
+
+    summary = []
+    for size in tenants:
+        t0 = time.perf_counter()
+        slug = f"{BENCH_SLUG_PREFIX}{size}-{uuid.uuid4().hex[:6]}"
+        account_id, user_id = str(uuid.uuid4()), str(uuid.uuid4())
+        with engine.begin() as conn:
+            batch = _Batcher(conn)
+            batch.add(models.Account.__table__, {
+                "id": account_id, "name": f"Bench {size} apartamentos", "slug": slug,
+                "is_active": True, "subscription_status": "active", "max_apartments": size,
+            })
+            batch.add(models.User.__table__, {
+                "id": user_id, "email": f"owner@{slug}.bench", "full_name": f"Owner {slug}",
+                "password_hash": password_hash, "is_active": True, "is_superadmin": False,
+            })
+            batch.flush()
+            batch.add(models.AccountUser.__table__, {
+                "id": str(uuid.uuid4()), "account_id": account_id, "user_id": user_id,
+                "role": "owner", "is_active": True,
+            })
+            apartment_ids = []
+            for i in range(size):
+                apartment_id = str(uuid.uuid4())
+                apartment_ids.append(apartment_id)
+                batch.add(models.Apartment.__table__, {
+                    "id": apartment_id, "code": f"B{size}-{i:04d}", "name": f"Apartamento {i + 1}",
+                    "account_id": account_id, "is_active": True, "max_guests": rng.randint(2, 6),
+                })
+            batch.flush()
+            for apartment_id in apartment_ids:
+                _generate_apartment(batch, models, rng, apartment_id, start, end, expenses_per_month)
+            batch.flush()
+
+        elapsed = time.perf_counter() - t0
+        rows = sum(batch.counts.values())
+        summary.append({"slug": slug, "apartments": size, "rows": batch.counts, "seconds": elapsed})
+        print(f"[BENCH] ✅ {slug}: {rows:,} filas en {elapsed:.1f}s ({rows / elapsed:,.0f} filas/s) {batch.counts}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", required=True, help="URL de la BD destino (sqlite:///... o postgresql://...)")
+    parser.add_argument("--tenants", type=int, nargs="+", default=[10, 200, 2000],
+                        help="Número de apartamentos de cada tenant")
+    parser.add_argument("--years", type=float, default=2.0, help="Años de histórico")
+    parser.add_argument("--expenses-per-month", type=int, default=8, help="Gastos por apartamento y mes")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.url
+    generate(args.tenants, args.years, args.expenses_per_month, args.seed)
+
+
+if __name__ == "__main__":
+    main()
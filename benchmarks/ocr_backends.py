@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los backends OCR de app/bot/Ocr_untils.py.
+
+Dibuja tickets sintéticos con PIL (o usa las imágenes de --dir) y mide la
+latencia por imagen de cada backend disponible (pytesseract con un
+subproceso por imagen, tesserocr con motores reutilizados). La primera
+imagen de tesserocr incluye la carga del motor, por eso se informa aparte
+(frío) del resto (caliente). Con --threads > 1 varias imágenes van en
+paralelo, como con varias fotos a la vez en el bot.
+
+Uso:
+    python benchmarks/ocr_backends.py --images 30 --threads 2
+    python benchmarks/ocr_backends.py --dir ~/facturas --words
+"""
+import argparse
+import glob
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+LINES = ["MERCADONA, S.A.", "A-46103834", "C/ MAYOR 12, MADRID", "FACTURA SIMPLIFICADA: 2231-017-{n:06d}",
+         "FECHA: {d:02d}/{m:02d}/2025 18:{d:02d}", "LECHE ENTERA      2 x 0,89   1,78", "PAN BARRA               0,60",
+         "DETERGENTE              {a},{c:02d}", "IVA   BASE   CUOTA", "10%   {a},00   {b},{c:02d}",
+         "TOTAL (€)              {t},{c:02d}", "TARJETA BANCARIA", "Gracias por su visita"]
+
+
+def render_receipt(rng: random.Random, n: int):
+    from PIL import Image, ImageDraw, ImageFont
+    try:
+        font = ImageFont.truetype("DejaVuSansMono.ttf", 22)
+    except OSError:
+        font = ImageFont.load_default()
+    values = {"n": n, "d": rng.randint(1, 28), "m": rng.randint(1, 12), "a": rng.randint(2, 60),
+              "b": rng.randint(0, 6), "c": rng.randint(0, 99), "t": rng.randint(10, 90)}
+    image = Image.new("L", (640, 40 + 36 * len(LINES)), color=255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(LINES):
+        draw.text((24, 20 + 36 * i), line.format(**values), fill=0, font=font)
+    return image
+
+
+def load_images(args):
+    from PIL import Image
+    if args.dir:
+        paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(os.path.expanduser(args.dir), f"*.{ext}")))
+        return [Image.open(p).convert("L") for p in paths[: args.images]]
+    rng = random.Random(args.seed)
+    return [render_receipt(rng, i) for i in range(args.images)]
+
+
+def available_backends(pool_size: int):
+    from app.bot import Ocr_untils
+    backends = []
+    for name, factory in (("pytesseract", Ocr_untils.PytesseractBackend),
+                          ("tesserocr", lambda: Ocr_untils.TesserocrBackend(pool_size=pool_size))):
+        try:
+            backend = factory()
+            backend.image_to_string(render_receipt(random.Random(0), 0).crop((0, 0, 320, 60)), "eng")
+        except Exception as e:
+            print(f"  {name:12s} no disponible: {type(e).__name__}: {e}")
+            continue
+        backends.append(backend)
+    return backends
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def run_backend(backend, images, lang: str, words: bool, threads: int):
+    method = backend.image_to_words if words else backend.image_to_string
+
+    def one(image):
+        started = time.perf_counter()
+        method(image, lang)
+        return time.perf_counter() - started
+
+    # En tesserocr la primera llamada por idioma carga el motor (frío)
+    cold = one(images[0])
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        warm = list(pool.map(one, images[1:] or images[:1]))
+    wall = time.perf_counter() - started
+    return cold, warm, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia por imagen de los backends OCR")
+    parser.add_argument("--images", type=int, default=30)
+    parser.add_argument("--dir", help="carpeta con fotos reales de tickets (jpg/png)")
+    parser.add_argument("--lang", default="spa+eng")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--words", action="store_true", help="medir image_to_words (cajas) en vez de texto")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    images = load_images(args)
+    if not images:
+        sys.exit("No hay imágenes")
+    print(f"{len(images)} imágenes, lang={args.lang}, hilos={args.threads}, "
+          f"{'image_to_words' if args.words else 'image_to_string'}")
+
+    backends = available_backends(args.pool_size)
+    if not backends:
+        sys.exit("Ningún backend OCR disponible (¿tesseract instalado?)")
+
+    print(f"\n{'backend':12s} {'frío ms':>9s} {'p50 ms':>8s} {'p95 ms':>8s} {'media ms':>9s} {'img/s':>7s}")
+    for backend in backends:
+        cold, warm, wall = run_backend(backend, images, args.lang, args.words, args.threads)
+        print(f"{backend.name:12s} {cold * 1000:9.1f} {percentile(warm, 50) * 1000:8.1f} "
+              f"{percentile(warm, 95) * 1000:8.1f} {statistics.mean(warm) * 1000:9.1f} {len(warm) / wall:7.1f}")
+        if hasattr(backend, "stats"):
+            print(f"{'':12s} motores: {backend.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los backends de texto PDF de app/bot/Ocr_untils.py.
+
+Recorre un corpus local de PDFs (--dir) o genera uno sintético (facturas de
+1-2 páginas y extractos largos de suministros/OTAs con decenas de páginas)
+y mide, por backend, páginas por segundo y el pico de memoria (RSS). Cada
+backend corre en un subproceso propio para que el pico de uno no contamine
+al otro. También informa de lo que elegiría PDF_TEXT_BACKEND=auto.
+
+Uso:
+    python benchmarks/pdf_text_backends.py --invoices 40 --statements 5 --statement-pages 60
+    python benchmarks/pdf_text_backends.py --dir ~/facturas_pdf
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BACKENDS = ("pdfplumber", "pdfium")
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: list[list[str]]):
+    """PDF mínimo con texto Helvetica (sin dependencias), una lista de líneas por página"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    kids = []
+    for lines in pages:
+        body = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+        stream = body.encode("cp1252", errors="replace")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n" + stream.decode("latin-1") + "\nendstream")
+        content_id = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def invoice_lines(rng: random.Random, n: int) -> list[str]:
+    base = rng.randint(20, 900) + rng.randint(0, 99) / 100
+    return ["Limpiezas Sol S.L.", "CIF B12345674", f"FACTURA N: 2025/{n:04d}",
+            f"Fecha: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2025", "Cliente: Apartamentos Centro",
+            *[f"Servicio de limpieza {i + 1}            {rng.randint(10, 90)},00" for i in range(rng.randint(3, 20))],
+            f"Base imponible  {base:.2f}", f"IVA 21%  {base * 0.21:.2f}", f"TOTAL  {base * 1.21:.2f} EUR"]
+
+
+def build_corpus(args, folder: str) -> list[str]:
+    rng = random.Random(args.seed)
+    paths = []
+    for n in range(args.invoices):
+        path = os.path.join(folder, f"factura_{n:03d}.pdf")
+        pages = [invoice_lines(rng, n)] + ([["Condiciones generales"] * 40] if rng.random() < 0.3 else [])
+        write_pdf(path, pages)
+        paths.append(path)
+    for n in range(args.statements):
+        path = os.path.join(folder, f"extracto_{n:03d}.pdf")
+        pages = [[f"{d:02d}/03/2025  Reserva {rng.randint(10000, 99999)}  Noches {rng.randint(1, 7)}  "
+                  f"Comisión {rng.randint(5, 60)},{rng.randint(0, 99):02d}  Neto {rng.randint(50, 900)},00"
+                  for d in range(1, 61)] for _ in range(args.statement_pages)]
+        write_pdf(path, pages)
+        paths.append(path)
+    return paths
+
+
+def worker(backend_name: str, paths: list[str]):
+    """Subproceso: extrae todo el corpus con un backend e imprime una línea JSON"""
+    from app.bot import Ocr_untils
+    backend = Ocr_untils._pdf_backend(backend_name)
+    if backend is None or backend.name != backend_name:
+        print(json.dumps({"backend": backend_name, "error": "no disponible"}))
+        return
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pages = chars = 0
+    started = time.perf_counter()
+    for path in paths:
+        texts = backend.extract_pages(path)
+        pages += len(texts)
+        chars += sum(len(t) for t in texts)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"backend": backend_name, "pages": pages, "chars": chars, "seconds": elapsed,
+                      "baseline_kb": baseline, "peak_kb": peak}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Páginas/s y pico de RSS de los backends de texto PDF")
+    parser.add_argument("--dir", help="carpeta con PDFs reales")
+    parser.add_argument("--invoices", type=int, default=40)
+    parser.add_argument("--statements", type=int, default=5)
+    parser.add_argument("--statement-pages", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--worker", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--paths-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        with open(args.paths_file) as f:
+            worker(args.worker, f.read().split("\n"))
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        if args.dir:
+            paths = sorted(glob.glob(os.path.join(os.path.expanduser(args.dir), "*.pdf")))
+        else:
+            paths = build_corpus(args, folder)
+        if not paths:
+            sys.exit("No hay PDFs")
+        total_bytes = sum(os.path.getsize(p) for p in paths)
+        print(f"{len(paths)} PDFs, {total_bytes / 1024 / 1024:.1f} MB")
+
+        from app.bot.Ocr_untils import choose_pdf_backend
+        chosen = {}
+        for path in paths:
+            name = choose_pdf_backend(path).name
+            chosen[name] = chosen.get(name, 0) + 1
+        print(f"auto elegiría: {chosen}")
+
+        paths_file = os.path.join(folder, "paths.txt")
+        with open(paths_file, "w") as f:
+            f.write("\n".join(paths))
+
+        print(f"\n{'backend':12s} {'páginas':>8s} {'seg':>7s} {'pág/s':>8s} {'pico RSS MB':>12s} {'+RSS MB':>8s}")
+        for name in BACKENDS:
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", name,
+                                     "--paths-file", paths_file], capture_output=True, text=True, cwd=ROOT)
+            lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+            if result.returncode != 0 or not lines:
+                print(f"{name:12s} falló: {result.stderr.strip().splitlines()[-1:] or result.returncode}")
+                continue
+            r = json.loads(lines[-1])
+            if "error" in r:
+                print(f"{name:12s} {r['error']}")
+                continue
+            print(f"{name:12s} {r['pages']:8d} {r['seconds']:7.2f} {r['pages'] / r['seconds']:8.1f} "
+                  f"{r['peak_kb'] / 1024:12.1f} {(r['peak_kb'] - r['baseline_kb']) / 1024:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
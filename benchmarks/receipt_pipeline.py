@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Benchmark del pipeline factura -> OCR -> LLM -> gasto sin red.
+
+Genera recibos PDF sintéticos (texto digital, los lee pdfplumber sin
+Tesseract) y los sube a POST /api/v1/chat/file dentro del proceso
+(httpx.ASGITransport). El LLM es el proveedor fake de app/services/llm.py
+(latencia configurable) o un cassette grabado (--provider replay). Cualquier
+intento de abrir una conexión de red hace fallar el benchmark.
+
+Uso:
+    python benchmarks/receipt_pipeline.py --receipts 1000 --concurrency 8 --llm-latency-ms 400
+    python benchmarks/receipt_pipeline.py --provider replay --cassette llm_cassette.jsonl
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VENDORS = ["Limpiezas Sol S.L.", "Ferretería Central", "Iberdrola Clientes", "Lavandería Express",
+           "Makro Autoservicio", "Fontanería Rápida", "Mercadona S.A.", "Leroy Merlin"]
+ITEMS = ["Servicio limpieza", "Bombillas LED", "Juego de toallas", "Reparación grifo", "Detergente",
+         "Sábanas 150", "Pilas AA", "Kit amenities", "Cambio cerradura", "Suministro eléctrico"]
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def receipt_pdf(lines: list[str]) -> bytes:
+    """PDF mínimo de una página con texto Helvetica (una línea por elemento)"""
+    stream = "BT /F1 11 Tf 14 TL 50 800 Td " + " ".join(f"({_pdf_escape(l)}) '" for l in lines) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        "/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def synthetic_receipt(rng: random.Random, n: int) -> tuple[bytes, float]:
+    vendor = rng.choice(VENDORS)
+    day = date.today() - timedelta(days=rng.randint(0, 200))
+    lines = [vendor, f"CIF B{rng.randint(10_000_000, 99_999_999)}", f"Factura: F{day.year}-{n:05d}",
+             f"Fecha: {day:%d/%m/%Y}", ""]
+    total = 0.0
+    for _ in range(rng.randint(1, 6)):
+        price = round(rng.uniform(1.5, 90), 2)
+        total += price
+        lines.append(f"{rng.choice(ITEMS):<24} {price:>8.2f}".replace(".", ","))
+    total = round(total * 1.21, 2)
+    lines += ["", "IVA 21% incluido", f"TOTAL EUR {total:.2f}".replace(".", ",")]
+    return receipt_pdf(lines), total
+
+
+def _block_network():
+    """Cualquier conexión que no sea un socket local hace fallar la ejecución"""
+    original = socket.socket.connect
+
+    def guarded(sock, address):
+        if sock.family == socket.AF_UNIX:
+            return original(sock, address)
+        raise RuntimeError(f"conexión de red bloqueada en el benchmark: {address}")
+
+    socket.socket.connect = guarded
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from app.main import app
+    from app.services.llm import get_llm_provider
+    from benchmarks.api_endpoints import load_tenants, percentile
+    from benchmarks.dataset import generate
+
+    generate([1], years=0.1, expenses_per_month=1, seed=args.seed)
+    tenant = load_tenants()[-1]
+    from app import models
+    from app.db import SessionLocal
+    db = SessionLocal()
+    apartment_code = db.get(models.Apartment, tenant["apartment_id"]).code
+    db.close()
+    headers = {"Authorization": f"Bearer {tenant['token']}", "X-Account-ID": tenant["account_id"]}
+
+    rng = random.Random(args.seed)
+    receipts = [synthetic_receipt(rng, n) for n in range(args.receipts)]
+    latencies, actions, amount_ok = [], {}, 0
+    queue = list(enumerate(receipts))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+        async def worker():
+            nonlocal amount_ok
+            while queue:
+                n, (pdf, total) = queue.pop()
+                t0 = time.perf_counter()
+                r = await client.post("/api/v1/chat/file", headers=headers,
+                                      data={"apartment_code": apartment_code},
+                                      files={"file": (f"recibo-{n}.pdf", pdf, "application/pdf")})
+                latencies.append(time.perf_counter() - t0)
+                body = r.json()
+                action = body.get("action", f"http_{r.status_code}")
+                actions[action] = actions.get(action, 0) + 1
+                extracted = (body.get("expense_data") or {}).get("amount_gross")
+                if extracted is not None and abs(float(extracted) - total) < 0.01:
+                    amount_ok += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    return {
+        "provider": get_llm_provider().name,
+        "receipts": len(latencies),
+        "seconds": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "actions": actions,
+        "amount_ok": amount_ok,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="BD destino (por defecto una SQLite temporal)")
+    parser.add_argument("--receipts", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--provider", choices=["fake", "replay"], default="fake")
+    parser.add_argument("--cassette", default="llm_cassette.jsonl", help="Cassette para --provider replay")
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="Latencia simulada del LLM fake")
+    parser.add_argument("--llm-jitter-ms", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    url = args.url or f"sqlite:///{tempfile.mkdtemp(prefix='receipts-bench-')}/bench.db"
+    os.environ["DATABASE_URL"] = url
+    os.environ["LLM_PROVIDER"] = args.provider
+    os.environ["LLM_CASSETTE"] = args.cassette
+    os.environ["LLM_FAKE_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["LLM_FAKE_JITTER_MS"] = str(args.llm_jitter_ms)
+    os.environ.pop("OPENAI_API_KEY", None)
+    os.environ["OUTBOX_DISPATCHER"] = "0"
+    os.chdir(ROOT)  # app/main.py monta app/static con ruta relativa
+    if not url.startswith("postgres"):
+        _block_network()  # con PostgreSQL hace falta TCP hacia la BD
+
+    r = asyncio.run(run(args))
+    print(f"\n[BENCH] proveedor={r['provider']} recibos={r['receipts']} en {r['seconds']:.1f}s "
+          f"-> {r['rps']:.1f} recibos/s | p50 {r['p50_ms']:.0f} ms, p95 {r['p95_ms']:.0f} ms, p99 {r['p99_ms']:.0f} ms")
+    print(f"[BENCH] resultados: {r['actions']} | importe correcto en {r['amount_ok']}/{r['receipts']}")
+
+
+if __name__ == "__main__":
+    main()
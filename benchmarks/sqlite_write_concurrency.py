@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark de escrituras concurrentes sobre SQLite.
+
+Compara el engine "bare" (create_engine por defecto, como antes) con el perfil
+de producción de app/db.py (WAL + pragmas + cola de escritura) insertando
+gastos desde N hilos a la vez.
+
+Uso:
+    python benchmarks/sqlite_write_concurrency.py --writers 1 4 8 16 --per-writer 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.db import Base, SQLiteWriteQueue, _create_sqlite_engine
+from app import models
+
+
+def _prepare(engine):
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        account = models.Account(name="Bench", slug=f"bench-{time.time_ns()}")
+        db.add(account)
+        db.flush()
+        apartment = models.Apartment(code="BENCH01", account_id=account.id)
+        db.add(apartment)
+        db.commit()
+        return apartment.id
+
+
+def run(profile: str, writers: int, per_writer: int, read_while_writing: bool) -> dict:
+    tmpdir = tempfile.mkdtemp(prefix="sqlite-bench-")
+    url = f"sqlite:///{tmpdir}/bench.db"
+
+    if profile == "bare":
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+        Session = sessionmaker(bind=engine, autoflush=False)
+    else:
+        engine = _create_sqlite_engine(url)
+        Session = sessionmaker(bind=engine, autoflush=False)
+        SQLiteWriteQueue().install(Session)
+
+    apartment_id = _prepare(engine)
+    errors = []
+    reads = [0]
+    stop = threading.Event()
+
+    def writer(n):
+        for i in range(per_writer):
+            db = Session()
+            try:
+                db.add(models.Expense(
+                    apartment_id=apartment_id,
+                    date=date.today(),
+                    amount_gross=Decimal("10.00") + i,
+                    currency="EUR",
+                    vendor=f"writer-{n}",
+                ))
+                db.commit()
+            except OperationalError as e:
+                db.rollback()
+                errors.append(str(e.orig))
+            finally:
+                db.close()
+
+    def reader():
+        while not stop.is_set():
+            db = Session()
+            try:
+                db.query(models.Expense).filter(models.Expense.apartment_id == apartment_id).count()
+                reads[0] += 1
+            except OperationalError as e:
+                errors.append(f"read: {e.orig}")
+            finally:
+                db.close()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    reader_thread = threading.Thread(target=reader) if read_while_writing else None
+
+    start = time.perf_counter()
+    if reader_thread:
+        reader_thread.start()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if reader_thread:
+        reader_thread.join()
+
+    engine.dispose()
+    ok = writers * per_writer - len([e for e in errors if not e.startswith("read:")])
+    return {
+        "profile": profile,
+        "writers": writers,
+        "writes_ok": ok,
+        "errors": len(errors),
+        "seconds": elapsed,
+        "writes_per_sec": ok / elapsed if elapsed else 0.0,
+        "reads": reads[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--per-writer", type=int, default=200)
+    parser.add_argument("--profiles", nargs="+", default=["bare", "production"], choices=["bare", "production"])
+    parser.add_argument("--no-reader", action="store_true", help="No lanzar un lector concurrente")
+    args = parser.parse_args()
+
+    print(f"{'perfil':<12}{'writers':>8}{'ok':>8}{'errores':>9}{'writes/s':>11}{'lecturas':>10}")
+    for writers in args.writers:
+        for profile in args.profiles:
+            r = run(profile, writers, args.per_writer, not args.no_reader)
+            print(f"{r['profile']:<12}{r['writers']:>8}{r['writes_ok']:>8}{r['errors']:>9}"
+                  f"{r['writes_per_sec']:>11.1f}{r['reads']:>10}")
+
+
+if __name__ == "__main__":
+    main()
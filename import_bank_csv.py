@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Importa un extracto bancario en CSV como gastos usando POST /api/v1/expenses/bulk.
+
+Solo se importan los cargos (importes negativos, salvo --all-rows); el importe
+se guarda en positivo. Las filas se envían en lotes y los errores se muestran
+por número de línea del CSV.
+
+Uso:
+    python import_bank_csv.py extracto.csv --apartment SES01 \\
+        --token $SES_TOKEN --account-id <uuid> \\
+        --date-col Fecha --amount-col Importe --description-col Concepto \\
+        --date-format %d/%m/%Y --decimal-comma --delimiter ";"
+"""
+import argparse
+import csv
+import os
+import sys
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import requests
+
+API_BASE = os.getenv("SES_API_BASE", "https://ses-gastos.onrender.com")
+
+
+def parse_amount(value: str, decimal_comma: bool) -> Decimal:
+    value = value.strip().replace("€", "").replace(" ", "")
+    if decimal_comma:
+        value = value.replace(".", "").replace(",", ".")
+    else:
+        value = value.replace(",", "")
+    return Decimal(value)
+
+
+def read_rows(args):
+    """Devuelve [(línea_csv, fila_para_api)] y la lista de líneas descartadas con motivo"""
+    rows, skipped = [], []
+    with open(args.file, newline="", encoding=args.encoding) as fh:
+        reader = csv.DictReader(fh, delimiter=args.delimiter)
+        for line_no, raw in enumerate(reader, start=2):
+            try:
+                amount = parse_amount(raw[args.amount_col], args.decimal_comma)
+                day = datetime.strptime(raw[args.date_col].strip(), args.date_format).date()
+            except (KeyError, InvalidOperation, ValueError) as e:
+                skipped.append((line_no, f"parse_error: {e}"))
+                continue
+
+            if amount >= 0 and not args.all_rows:
+                continue  # abono: no es un gasto
+
+            description = (raw.get(args.description_col) or "").strip() if args.description_col else ""
+            rows.append((line_no, {
+                "apartment_code": args.apartment,
+                "date": day.isoformat(),
+                "amount_gross": str(abs(amount)),
+                "currency": args.currency,
+                "category": args.category,
+                "description": description[:500] or None,
+                "vendor": (raw.get(args.vendor_col) or "").strip()[:255] or None if args.vendor_col else None,
+                "source": "bank_csv",
+                "status": "PAID",
+            }))
+    return rows, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importar extracto bancario CSV como gastos")
+    parser.add_argument("file")
+    parser.add_argument("--apartment", required=True, help="Código del apartamento")
+    parser.add_argument("--token", default=os.getenv("SES_TOKEN"), help="Bearer token (o SES_TOKEN)")
+    parser.add_argument("--account-id", default=os.getenv("SES_ACCOUNT_ID"), help="X-Account-ID (o SES_ACCOUNT_ID)")
+    parser.add_argument("--api", default=API_BASE)
+    parser.add_argument("--date-col", default="date")
+    parser.add_argument("--amount-col", default="amount")
+    parser.add_argument("--description-col", default="description")
+    parser.add_argument("--vendor-col", default=None)
+    parser.add_argument("--date-format", default="%Y-%m-%d")
+    parser.add_argument("--delimiter", default=",")
+    parser.add_argument("--encoding", default="utf-8-sig")
+    parser.add_argument("--decimal-comma", action="store_true", help="Importes con coma decimal (1.234,56)")
+    parser.add_argument("--currency", default="EUR")
+    parser.add_argument("--category", default=None)
+    parser.add_argument("--all-rows", action="store_true", help="Importar también importes positivos")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if not args.token and not args.dry_run:
+        sys.exit("❌ Falta --token (o SES_TOKEN)")
+
+    rows, skipped = read_rows(args)
+    print(f"📄 {len(rows)} cargos a importar, {len(skipped)} líneas descartadas")
+    for line_no, reason in skipped:
+        print(f"   ⚠️ línea {line_no}: {reason}")
+    if args.dry_run or not rows:
+        return
+
+    headers = {"Authorization": f"Bearer {args.token}"}
+    if args.account_id:
+        headers["X-Account-ID"] = args.account_id
+
+    inserted = failed = 0
+    for start in range(0, len(rows), args.batch_size):
+        batch = rows[start:start + args.batch_size]
+        r = requests.post(
+            f"{args.api.rstrip('/')}/api/v1/expenses/bulk",
+            json={"items": [row for _, row in batch]},
+            headers=headers,
+            timeout=120,
+        )
+        if r.status_code != 200:
+            sys.exit(f"❌ Lote desde línea {batch[0][0]}: {r.status_code} - {r.text}")
+
+        result = r.json()
+        inserted += result["inserted"]
+        for err in result["errors"]:
+            failed += 1
+            print(f"   ❌ línea {batch[err['index']][0]}: {'; '.join(err['errors'])}")
+        print(f"   ✅ Lote {start // args.batch_size + 1}: {result['inserted']}/{len(batch)} insertados")
+
+    print(f"🎉 Importación terminada: {inserted} insertados, {failed} con error")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Pruebas del dispatcher del outbox (app/services/outbox.py) contra un
+servidor HTTP local que hace de SES.HOSPEDAJES.
+
+Usa una BD SQLite temporal; no necesita red ni SES real.
+
+    python -m pytest -q test_outbox_dispatcher.py
+    python test_outbox_dispatcher.py
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+_tmpdir = tempfile.mkdtemp(prefix="outbox-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmpdir}/app.db")
+
+import httpx
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.db import Base, _create_sqlite_engine
+from app.services import events
+from app.services.outbox import OUTBOX_BACKOFF_BASE, OutboxDispatcher
+
+
+# ---------- SERVIDOR SES DE PRUEBA ----------
+
+class StubSES:
+    """Servidor local: responde a cada ruta con los códigos que se le indiquen"""
+
+    def __init__(self):
+        self.responses = {}  # "bookings" | "links" -> lista de códigos (el último se repite)
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                route = "links" if self.path.endswith("/links") else "bookings"
+                stub.requests.append((route, self.path, self.headers.get("Idempotency-Key")))
+                codes = stub.responses.get(route, [200])
+                status = codes.pop(0) if len(codes) > 1 else codes[0]
+                body = json.dumps({"booking_id": "B-1"} if route == "bookings" else {"ok": True}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def count(self, route: str) -> int:
+        return sum(1 for r in self.requests if r[0] == route)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ---------- UTILIDADES ----------
+
+def _setup(max_attempts: int = 8):
+    engine = _create_sqlite_engine(f"sqlite:///{tempfile.mkdtemp(prefix='outbox-')}/outbox.db")
+    Base.metadata.create_all(bind=engine, tables=[models.OutboxEvent.__table__])
+    Session = sessionmaker(bind=engine, autoflush=False)
+    dispatcher = OutboxDispatcher(session_factory=Session)
+    dispatcher.max_attempts = max_attempts
+    stub = StubSES()
+    events.SES_URL = stub.url
+    return Session, dispatcher, stub
+
+
+def _enqueue(Session) -> str:
+    with Session() as db:
+        event = events.enqueue_event(db, events.RESERVATION_CREATED, events.SES_ENDPOINT, {
+            "reservation_id": "R-1", "check_in": "2025-07-01", "check_out": "2025-07-05",
+            "guests": 2, "channel": "manual", "email": None, "phone": None,
+        }, idempotency_key="R-1")
+        db.commit()
+        return event.id
+
+
+def _run_once(dispatcher) -> int:
+    async def go():
+        async with httpx.AsyncClient(timeout=5) as client:
+            dispatcher._client = client
+            return await dispatcher.run_once()
+    return asyncio.run(go())
+
+
+def _event(Session, event_id) -> models.OutboxEvent:
+    with Session() as db:
+        event = db.get(models.OutboxEvent, event_id)
+        db.expunge(event)
+        return event
+
+
+def _make_due(Session, event_id):
+    with Session() as db:
+        db.get(models.OutboxEvent, event_id).next_attempt_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        db.commit()
+
+
+def _delay_seconds(event) -> float:
+    due = event.next_attempt_at
+    due = due if due.tzinfo else due.replace(tzinfo=timezone.utc)
+    return (due - datetime.now(timezone.utc)).total_seconds()
+
+
+# ---------- PRUEBAS ----------
+
+def test_success_marks_sent():
+    Session, dispatcher, stub = _setup()
+    try:
+        event_id = _enqueue(Session)
+        assert _run_once(dispatcher) == 1
+
+        event = _event(Session, event_id)
+        assert event.status == "SENT"
+        assert event.attempts == 1
+        assert event.sent_at is not None and event.last_error is None
+        assert [r[0] for r in stub.requests] == ["bookings", "links"]
+        assert stub.requests[1][1] == "/api/bookings/B-1/links"
+        assert all(r[2] == "R-1" for r in stub.requests)  # Idempotency-Key
+    finally:
+        stub.close()
+
+
+def test_retryable_5xx_backs_off_and_keeps_progress():
+    Session, dispatcher, stub = _setup()
+    try:
+        stub.responses["links"] = [503, 503, 200]
+        event_id = _enqueue(Session)
+
+        _run_once(dispatcher)
+        event = _event(Session, event_id)
+        assert event.status == "PENDING" and event.attempts == 1
+        assert "503" in event.last_error
+        assert event.payload["booking_id"] == "B-1"  # el booking ya creado no se repite
+        assert OUTBOX_BACKOFF_BASE * 0.7 < _delay_seconds(event) <= OUTBOX_BACKOFF_BASE * 1.2
+        assert _run_once(dispatcher) == 0  # aún no vence
+
+        _make_due(Session, event_id)
+        _run_once(dispatcher)
+        event = _event(Session, event_id)
+        assert event.status == "PENDING" and event.attempts == 2
+        assert OUTBOX_BACKOFF_BASE * 2 * 0.7 < _delay_seconds(event) <= OUTBOX_BACKOFF_BASE * 2 * 1.2
+
+        _make_due(Session, event_id)
+        _run_once(dispatcher)
+        event = _event(Session, event_id)
+        assert event.status == "SENT" and event.attempts == 3
+        assert stub.count("bookings") == 1 and stub.count("links") == 3
+    finally:
+        stub.close()
+
+
+def test_5xx_until_max_attempts_fails():
+    Session, dispatcher, stub = _setup(max_attempts=2)
+    try:
+        stub.responses["bookings"] = [500]
+        event_id = _enqueue(Session)
+        _run_once(dispatcher)
+        _make_due(Session, event_id)
+        _run_once(dispatcher)
+        event = _event(Session, event_id)
+        assert event.status == "FAILED" and event.attempts == 2
+    finally:
+        stub.close()
+
+
+def test_non_retryable_4xx_fails_immediately():
+    Session, dispatcher, stub = _setup()
+    try:
+        stub.responses["bookings"] = [422]
+        event_id = _enqueue(Session)
+        _run_once(dispatcher)
+
+        event = _event(Session, event_id)
+        assert event.status == "FAILED" and event.attempts == 1
+        assert "422" in event.last_error
+        _make_due(Session, event_id)
+        assert _run_once(dispatcher) == 0
+        assert stub.count("bookings") == 1
+    finally:
+        stub.close()
+
+
+def test_expired_lease_is_reclaimed():
+    Session, dispatcher, stub = _setup()
+    try:
+        event_id = _enqueue(Session)
+        # El proceso reclama el evento y muere antes de registrar el resultado
+        assert len(dispatcher._claim_batch()) == 1
+        assert _event(Session, event_id).status == "PROCESSING"
+        assert dispatcher._claim_batch() == []  # lease vigente: nadie más lo toma
+
+        _make_due(Session, event_id)  # vence el lease
+        assert _run_once(dispatcher) == 1
+        event = _event(Session, event_id)
+        assert event.status == "SENT" and event.attempts == 2
+    finally:
+        stub.close()
+
+
+def test_expired_lease_on_last_attempt_fails():
+    Session, dispatcher, stub = _setup(max_attempts=2)
+    try:
+        event_id = _enqueue(Session)
+        for _ in range(2):  # dos intentos que matan al proceso
+            assert len(dispatcher._claim_batch()) == 1
+            _make_due(Session, event_id)
+
+        assert dispatcher._claim_batch() == []
+        event = _event(Session, event_id)
+        assert event.status == "FAILED" and event.attempts == 2
+        assert "Lease vencido" in event.last_error
+        assert stub.requests == []
+    finally:
+        stub.close()
+
+
+def test_reservation_event_key_is_reservation_id():
+    Session, dispatcher, stub = _setup()
+    try:
+        from datetime import date
+        reservation_id = "0b9c1f7e-6d1a-4c36-9a55-3f1d2e8a7b40"
+        r = models.Reservation(id=reservation_id, check_in=date(2025, 7, 1), check_out=date(2025, 7, 5),
+                               guests=2, channel="manual")
+        with Session() as db:
+            event = events.enqueue_ses_reservation_created(db, r)
+            db.commit()
+            event_id = event.id
+        assert _event(Session, event_id).idempotency_key == reservation_id
+
+        _run_once(dispatcher)
+        assert [req[2] for req in stub.requests] == [reservation_id, reservation_id]
+    finally:
+        stub.close()
+
+
+if __name__ == "__main__":
+    tests = [v for k, v in list(globals().items()) if k.startswith("test_") and callable(v)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la extracción por reglas de tickets y facturas
+(app/bot/Receipt_Rules.py): separadores de miles, líneas de total
+excluidas, letra de control del NIF, fecha de emisión frente a vencimiento
+y reconstrucción de líneas desde las cajas de palabras de Tesseract.
+
+No necesita Tesseract ni LLM: el texto OCR va escrito en cada prueba.
+
+    python -m pytest -q test_receipt_rules.py
+    python test_receipt_rules.py
+"""
+import os
+import sys
+from datetime import date
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from app.bot.Receipt_Rules import extract_receipt_fields, lines_from_words, valid_tax_id
+
+TODAY = date(2026, 3, 15)
+
+
+def _fields(text: str, words=None) -> dict:
+    return extract_receipt_fields(text, words=words, today=TODAY)
+
+
+def _word(text, left, top, conf=95, height=20, width=60):
+    return {"text": text, "left": left, "top": top, "width": width, "height": height, "conf": conf}
+
+
+# ---------- PRUEBAS ----------
+
+def test_european_thousands_separator():
+    fields = _fields("REFORMAS LOPEZ S.L.\nFecha: 02/03/2026\nTOTAL FACTURA 1.234,56 €")
+    assert fields["amount_gross"].value == 1234.56
+
+
+def test_us_thousands_separator():
+    fields = _fields("HARDWARE STORE\nFecha: 02/03/2026\nTOTAL 1,234.56")
+    assert fields["amount_gross"].value == 1234.56
+
+
+def test_subtotal_and_vat_lines_are_not_the_total():
+    text = "\n".join([
+        "FERRETERIA CENTRAL S.L.",
+        "Fecha: 02/03/2026",
+        "SUBTOTAL 100,00",
+        "TOTAL IVA 21,00",
+        "TOTAL 121,00",
+    ])
+    fields = _fields(text)
+    assert fields["amount_gross"].value == 121.0
+    assert fields["amount_gross"].line == "TOTAL 121,00"
+
+
+def test_only_subtotal_and_vat_fall_back_to_largest_amount():
+    # Sin TOTAL: ni SUBTOTAL ni TOTAL IVA cuentan como total etiquetado
+    fields = _fields("SUBTOTAL 100,00\nTOTAL IVA 21,00")
+    assert fields["amount_gross"].line == "mayor importe"
+    assert fields["amount_gross"].confidence < 0.5
+
+
+def test_invalid_nif_letter_is_rejected():
+    assert valid_tax_id("12345678Z")
+    assert not valid_tax_id("12345678A")
+    assert valid_tax_id("B12345674")
+    assert not valid_tax_id("B12345670")
+
+    valid = _fields("TALLER PEREZ\nNIF: 12345678Z\nTOTAL 50,00")["vendor_tax_id"]
+    invalid = _fields("TALLER PEREZ\nNIF: 12345678A\nTOTAL 50,00")["vendor_tax_id"]
+    assert valid.value == "12345678Z" and valid.confidence >= 0.9
+    # Etiquetado pero con la letra mal: se devuelve con confianza baja
+    assert invalid.value == "12345678A" and invalid.confidence < 0.6
+
+
+def test_valid_tax_id_wins_over_invalid_one():
+    fields = _fields("TALLER PEREZ\nCIF: 12345678A\nNIF: 12345678Z\nTOTAL 50,00")
+    assert fields["vendor_tax_id"].value == "12345678Z"
+
+
+def test_issue_date_preferred_over_due_date():
+    text = "\n".join([
+        "LIMPIEZAS SOL S.L.",
+        "Fecha vencimiento: 30/03/2026",
+        "Fecha factura: 01/03/2026",
+        "TOTAL 80,00",
+    ])
+    fields = _fields(text)
+    assert fields["date"].value == "2026-03-01"
+
+
+def test_due_date_alone_is_ignored():
+    fields = _fields("LIMPIEZAS SOL S.L.\nVencimiento: 30/03/2026\nTOTAL 80,00")
+    assert "date" not in fields
+
+
+def test_lines_from_words_groups_by_height_and_orders_by_left():
+    words = [
+        # El importe viene en otro bloque y antes en la lista que su etiqueta
+        _word("12,50", left=400, top=102),
+        _word("TOTAL", left=20, top=100),
+        _word("MERCADO", left=20, top=10),
+        _word("SOL", left=110, top=12, conf=75),
+        _word("  ", left=200, top=10),           # vacía: se descarta
+        _word("ruido", left=300, top=10, conf=-1),  # conf -1 (no es palabra): se descarta
+    ]
+    lines = lines_from_words(words)
+    assert [text for text, _ in lines] == ["MERCADO SOL", "TOTAL 12,50"]
+    assert abs(lines[0][1] - 0.85) < 1e-9  # media de 95 y 75, en 0-1
+
+
+def test_words_reconstruct_total_and_lower_confidence():
+    words = [
+        _word("MERCADO", left=20, top=10),
+        _word("TOTAL", left=20, top=100, conf=40),
+        _word("12,50", left=400, top=101, conf=40),
+    ]
+    from_words = _fields("", words=words)["amount_gross"]
+    from_text = _fields("MERCADO\nTOTAL 12,50")["amount_gross"]
+    assert from_words.value == 12.5
+    # La confianza OCR baja de la línea rebaja la del campo
+    assert from_words.confidence < from_text.confidence
+
+
+if __name__ == "__main__":
+    tests = [v for k, v in list(globals().items()) if k.startswith("test_") and callable(v)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
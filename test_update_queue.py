@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la cola de updates del webhook de Telegram
+(app/services/update_queue.py): orden por chat, deduplicación por
+update_id, cola llena y que el OCR de los handlers no bloquee el loop.
+
+    python -m pytest -q test_update_queue.py
+    python test_update_queue.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from app.services.update_queue import ChatUpdateQueue, UpdateIdRing, UpdateQueueFull
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+# ---------- PRUEBAS ----------
+
+def test_same_chat_in_order_other_chats_in_parallel():
+    async def go():
+        done = []
+        running = {"now": 0, "max": 0}
+
+        async def handler(item):
+            chat, n = item
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            await asyncio.sleep(0.02 if n == 0 else 0.001)  # el primero de cada chat es el lento
+            running["now"] -= 1
+            done.append(item)
+
+        queue = ChatUpdateQueue(handler, workers=4)
+        update_id = 0
+        for n in range(5):
+            for chat in ("a", "b", "c"):
+                update_id += 1
+                assert queue.submit(update_id, chat, (chat, n)) == "queued"
+        assert await queue.join(timeout=5)
+        await queue.stop()
+        return done, running["max"], queue.stats()
+
+    done, max_running, stats = _run(go())
+    for chat in ("a", "b", "c"):
+        assert [n for c, n in done if c == chat] == [0, 1, 2, 3, 4]
+    assert max_running == 3  # un update a la vez por chat, los tres chats a la vez
+    assert stats["processed"] == 15 and stats["pending"] == 0 and stats["chats_waiting"] == 0
+
+
+def test_duplicate_update_id_is_dropped():
+    async def go():
+        seen = []
+
+        async def handler(item):
+            seen.append(item)
+
+        queue = ChatUpdateQueue(handler, workers=2)
+        assert queue.submit(1, "a", "first") == "queued"
+        assert queue.submit(1, "a", "retry") == "duplicate"  # reenvío de Telegram
+        assert queue.submit(2, "a", "second") == "queued"
+        await queue.join(timeout=5)
+        assert queue.submit(1, "a", "late retry") == "duplicate"  # ya procesado: sigue en el buffer
+        await queue.join(timeout=5)
+        await queue.stop()
+        return seen, queue.stats()
+
+    seen, stats = _run(go())
+    assert seen == ["first", "second"]
+    assert stats["duplicate"] == 2 and stats["processed"] == 2
+
+
+def test_dedupe_ring_is_bounded():
+    ring = UpdateIdRing(size=3)
+    for update_id in range(5):
+        assert ring.add(update_id)
+    assert len(ring) == 3
+    assert 0 not in ring and 1 not in ring and 4 in ring
+    assert not ring.add(4)
+
+
+def test_full_queue_rejects_without_marking_seen():
+    async def go():
+        release = asyncio.Event()
+        seen = []
+
+        async def handler(item):
+            await release.wait()
+            seen.append(item)
+
+        queue = ChatUpdateQueue(handler, workers=1, max_pending=2)
+        queue.submit(1, "a", 1)
+        await asyncio.sleep(0.01)  # el worker toma el 1: deja de contar como pendiente
+        queue.submit(2, "a", 2)
+        queue.submit(3, "b", 3)
+        try:
+            queue.submit(4, "c", 4)
+            raise AssertionError("debía lanzar UpdateQueueFull")
+        except UpdateQueueFull:
+            pass
+        assert queue.stats()["rejected"] == 1
+
+        release.set()
+        await queue.join(timeout=5)
+        # El reintento de Telegram del update rechazado entra
+        assert queue.submit(4, "c", 4) == "queued"
+        await queue.join(timeout=5)
+        await queue.stop()
+        return seen
+
+    assert sorted(_run(go())) == [1, 2, 3, 4]
+
+
+def test_handler_timeout_frees_the_chat():
+    async def go():
+        seen = []
+
+        async def handler(item):
+            if item == "slow":
+                await asyncio.sleep(10)
+            seen.append(item)
+
+        queue = ChatUpdateQueue(handler, workers=1, timeout=0.05)
+        queue.submit(1, "a", "slow")
+        queue.submit(2, "a", "next")
+        assert await queue.join(timeout=5)
+        await queue.stop()
+        return seen, queue.stats()
+
+    seen, stats = _run(go())
+    assert seen == ["next"]
+    assert stats["timeout"] == 1 and stats["processed"] == 1
+
+
+def test_ocr_in_handlers_does_not_block_the_loop():
+    from app.bot.Ocr_untils import run_ocr
+
+    def blocking_ocr(seconds):  # como Tesseract: bloquea el hilo que lo llama
+        time.sleep(seconds)
+        return "texto"
+
+    async def go():
+        async def handler(item):
+            assert await run_ocr(blocking_ocr, 0.2) == "texto"
+
+        queue = ChatUpdateQueue(handler, workers=4)
+        for n in range(4):
+            queue.submit(n, f"chat-{n}", n)
+
+        # Mientras los 4 handlers hacen "OCR", el loop sigue atendiendo
+        # (p. ej. POST /webhook/telegram)
+        worst = 0.0
+        while queue.pending or queue.in_progress:
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.01)
+            worst = max(worst, time.perf_counter() - t0)
+        await queue.stop()
+        return worst, queue.stats()
+
+    worst, stats = _run(go())
+    assert stats["processed"] == 4
+    assert worst < 0.1, f"el loop se bloqueó {worst:.2f}s"
+
+
+if __name__ == "__main__":
+    tests = [v for k, v in list(globals().items()) if k.startswith("test_") and callable(v)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)